@@ -1,7 +1,5 @@
 import os
 import streamlit as st
-import tempfile
-import io
 from dotenv import load_dotenv
 
 # Set page configuration as the very first Streamlit command.
@@ -11,14 +9,20 @@ st.set_page_config(page_title="Document Chat Assistant", layout="wide")
 load_dotenv()
 
 # ------------------------------------------------------------
-# Import necessary libraries.
-from mistralai import Mistral, DocumentURLChunk
-from mistralai.models import OCRResponse
-import arxiv
-from langchain.embeddings.huggingface import HuggingFaceEmbeddings
-from langchain.vectorstores import FAISS
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from PIL import Image
+# Import necessary libraries. mistralai and arxiv are imported where they are
+# first used, so a cold start only pays for Streamlit and the local modules.
+from src.metrics import span
+from src.pdf_extract import extract_batch, has_text_layer
+from src.blob_store import SessionBlobStore, sweep_stale_sessions
+from src.singleflight import get_flight, canonical_key
+from src.profiling import profile_action, PROFILE_ACTIONS, PROFILE_DIR
+from src.deadline import deadline_scope, call_timeout, request_done, OCR_BUDGET, CHAT_BUDGET
+
+# Uploaded PDFs with a text layer are read locally; only scanned ones go to Mistral OCR
+PDF_LOCAL_EXTRACTION = os.getenv("PDF_LOCAL_EXTRACTION", "1") == "1"
+# Per-call caps for the Mistral SDK; the action's remaining budget can make them shorter
+MISTRAL_OCR_TIMEOUT = float(os.getenv("MISTRAL_OCR_TIMEOUT", "300"))
+MISTRAL_CHAT_TIMEOUT = float(os.getenv("MISTRAL_CHAT_TIMEOUT", "120"))
 
 # ------------------------------------------------------------
 # Custom CSS for a dark, ChatGPT-like UI.
@@ -123,6 +127,12 @@ if "chat_counter" not in st.session_state:
     st.session_state.chat_counter = 0
 if "arxiv_results" not in st.session_state:
     st.session_state.arxiv_results = []     # Temporary storage for arXiv search results.
+if "blobs" not in st.session_state:
+    sweep_stale_sessions()
+    st.session_state.blobs = SessionBlobStore()  # PDF bytes and document text live on disk.
+if "profile_ui" not in st.session_state:
+    # Hidden diagnostics: open the app with ?profile=1 to get the profiling toggle
+    st.session_state.profile_ui = st.query_params.get("profile") == "1"
 
 # ------------------------------------------------------------
 # Function Definitions.
@@ -130,18 +140,34 @@ def initialize_mistral_client(api_key):
     if not api_key:
         st.error("Missing API Key.")
         return None
+    from mistralai import Mistral
     return Mistral(api_key=api_key)
 
+# Sessions processing the same paper URL at once share one OCR call
+ocr_flight = get_flight("mistral_ocr", copy_result=False)
+
+def timeout_ms(default):
+    """The Mistral SDK takes per-call timeouts in milliseconds"""
+    return int(call_timeout(default) * 1000)
+
 def process_ocr(client, document_source):
     if client is None:
         raise ValueError("Mistral client not available.")
-    return client.ocr.process(
-        document=DocumentURLChunk(document_url=document_source["document_url"]),
-        model="mistral-ocr-latest",
-        include_image_base64=True
-    )
+    return ocr_flight.do(canonical_key(document_source["document_url"]), _run_ocr, client, document_source)
+
+def _run_ocr(client, document_source):
+    from mistralai import DocumentURLChunk
+    with span("ocr", source="mistral", model="mistral-ocr-latest"):
+        return client.ocr.process(
+            document=DocumentURLChunk(document_url=document_source["document_url"]),
+            model="mistral-ocr-latest",
+            # Only the markdown is used; page images would just be downloaded and dropped
+            include_image_base64=False,
+            timeout_ms=timeout_ms(MISTRAL_OCR_TIMEOUT)
+        )
 
 def do_arxiv_search(query: str, author: str, sort_by: str):
+    import arxiv
     if len(query.split()) > 3:
         query = f"ti:{query}"
     else:
@@ -154,68 +180,109 @@ def do_arxiv_search(query: str, author: str, sort_by: str):
     client_arxiv = arxiv.Client()
     return list(client_arxiv.results(search))
 
-def get_combined_markdown(ocr_response: OCRResponse) -> str:
+def get_combined_markdown(ocr_response) -> str:
     texts = [page.markdown for page in ocr_response.pages]
     return "\n\n".join(texts)
 
+def store_document_text(blobs, text, name):
+    """
+    Spills a processed document's text to the blob store, pinned so the quota
+    never evicts text that chat still needs; None (with an error shown) if full.
+    """
+    handle = blobs.put_text(text, f"{name}.md", pin=True)
+    if handle is None:
+        st.error(f"No room left to keep the text of '{name}'; remove documents or start a new session.")
+    return handle
+
 def process_ocr_for_staged(client):
     if not client:
         st.error("Mistral client not available.")
         return
+    blobs = st.session_state.blobs
 
-    # Process staged PDFs.
+    # Process staged PDFs (already on disk in the blob store).
+    staged_pdfs = [s for s in st.session_state.staged_pdfs if s["blob"] in blobs]
     for staged in st.session_state.staged_pdfs:
+        if staged not in staged_pdfs:
+            st.warning(f"'{staged['filename']}' was evicted to stay within the session quota; please upload it again.")
+    pdf_paths = [blobs.path(s["blob"]) for s in staged_pdfs]
+    # Local text layer first (all documents in parallel); pages are cached by file hash
+    local_pages = extract_batch(pdf_paths) if PDF_LOCAL_EXTRACTION and pdf_paths else {}
+    # Whatever is not reached before the budget runs out stays staged for the next run
+    left_pdfs = list(staged_pdfs)
+    for staged, pdf_path in zip(staged_pdfs, pdf_paths):
+        if request_done():
+            break
+        left_pdfs.remove(staged)
         filename = staged["filename"]
-        file_bytes = staged["file_bytes"]
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
-            tmp.write(file_bytes)
-            tmp_path = tmp.name
         try:
-            with open(tmp_path, "rb") as f:
+            pages = local_pages.get(pdf_path)
+            if has_text_layer(pages):
+                content = store_document_text(blobs, "\n\n".join(p["text"] for p in pages), filename)
+                if content is not None:
+                    st.session_state.uploaded_docs.append({
+                        "source": "upload",
+                        "filename": filename,
+                        "document_url": None,
+                        "content": content
+                    })
+                    st.success(f"Processed PDF '{filename}' locally!")
+                continue
+            with open(pdf_path, "rb") as f:
                 file_upload = client.files.upload(
                     file={"file_name": filename, "content": f},
-                    purpose="ocr"
+                    purpose="ocr",
+                    timeout_ms=timeout_ms(MISTRAL_OCR_TIMEOUT)
                 )
-            signed_url = client.files.get_signed_url(file_id=file_upload.id)
+            signed_url = client.files.get_signed_url(file_id=file_upload.id, timeout_ms=timeout_ms(MISTRAL_CHAT_TIMEOUT))
             ocr_response = process_ocr(client, {"document_url": signed_url.url})
             if ocr_response and ocr_response.pages:
-                text = "\n\n".join([page.markdown for page in ocr_response.pages])
-                st.session_state.uploaded_docs.append({
-                    "source": "upload",
-                    "filename": filename,
-                    "document_url": signed_url.url,
-                    "content": text
-                })
-                st.success(f"Processed PDF '{filename}'!")
+                content = store_document_text(blobs, get_combined_markdown(ocr_response), filename)
+                if content is not None:
+                    st.session_state.uploaded_docs.append({
+                        "source": "upload",
+                        "filename": filename,
+                        "document_url": signed_url.url,
+                        "content": content
+                    })
+                    st.success(f"Processed PDF '{filename}'!")
             else:
                 st.warning(f"No text found in '{filename}'.")
         except Exception as e:
             st.error(f"Error processing '{filename}': {str(e)}")
         finally:
-            if os.path.exists(tmp_path):
-                os.remove(tmp_path)
-    st.session_state.staged_pdfs.clear()
+            # The extracted text is what chat uses; the raw PDF only takes up quota now
+            blobs.delete(staged["blob"])
+    st.session_state.staged_pdfs = left_pdfs
 
     # Process staged arXiv papers.
+    left_arxiv = list(st.session_state.staged_arxiv)
     for staged in st.session_state.staged_arxiv:
+        if request_done():
+            break
+        left_arxiv.remove(staged)
         pdf_url = staged["pdf_url"]
         title = staged.get("title", "Paper")
         try:
             ocr_response = process_ocr(client, {"document_url": pdf_url})
             if ocr_response and ocr_response.pages:
-                text = "\n\n".join([page.markdown for page in ocr_response.pages])
-                st.session_state.arxiv_docs.append({
-                    "source": "arxiv",
-                    "title": title,
-                    "document_url": pdf_url,
-                    "content": text
-                })
-                st.success(f"Processed paper '{title}'!")
+                content = store_document_text(blobs, get_combined_markdown(ocr_response), title[:60])
+                if content is not None:
+                    st.session_state.arxiv_docs.append({
+                        "source": "arxiv",
+                        "title": title,
+                        "document_url": pdf_url,
+                        "content": content
+                    })
+                    st.success(f"Processed paper '{title}'!")
             else:
                 st.warning(f"No text found in '{title}'.")
         except Exception as e:
             st.error(f"Error processing paper '{title}': {str(e)}")
-    st.session_state.staged_arxiv.clear()
+    st.session_state.staged_arxiv = left_arxiv
+    if left_pdfs or left_arxiv:
+        st.warning(f"Stopped after {OCR_BUDGET:.0f} s; {len(left_pdfs) + len(left_arxiv)} document(s) are still staged. "
+                   "Click 'Process All Documents' again to continue.")
 
 def generate_response_from_documents(client, query, context_text):
     try:
@@ -227,7 +294,9 @@ Answer this question based on the documents:
 {query}"""
         messages = [{"role": "user", "content": [{"type": "text", "text": prompt}]}]
         model = "mistral-small-latest"
-        response = client.chat.complete(model=model, messages=messages)
+        with span("llm_request", source="mistral", model=model), deadline_scope(CHAT_BUDGET, name="chat"):
+            response = client.chat.complete(model=model, messages=messages,
+                                            timeout_ms=timeout_ms(MISTRAL_CHAT_TIMEOUT))
         return response.choices[0].message.content
     except Exception as e:
         st.error(f"Error generating response: {str(e)}")
@@ -251,13 +320,16 @@ def render_chat_message(role, message):
 {container_end}""", unsafe_allow_html=True)
 
 def get_global_context():
-    texts = []
-    for doc in st.session_state.uploaded_docs:
-        if doc.get("content"):
-            texts.append(doc["content"])
-    for doc in st.session_state.arxiv_docs:
-        if doc.get("content"):
-            texts.append(doc["content"])
+    # Document text is read back from disk per question; nothing large stays in session state
+    texts, missing = [], []
+    for doc in st.session_state.uploaded_docs + st.session_state.arxiv_docs:
+        text = st.session_state.blobs.read_text(doc.get("content"))
+        if text is None:
+            missing.append(doc.get("filename") or doc.get("title"))
+        elif text:
+            texts.append(text)
+    if missing:
+        st.warning(f"The text of {', '.join(map(repr, missing))} is no longer available; please process it again.")
     return "\n\n".join(texts)
 
 def chat_ui(client):
@@ -302,6 +374,7 @@ def main():
 
     # Store client in session_state.
     st.session_state.client = client
+    st.session_state.blobs.touch_session()
 
     # ------------------------------------------------------------
     # Sidebar: Document Loader Panel with friendly instructions.
@@ -314,9 +387,14 @@ def main():
         current_files = [pdf['filename'] for pdf in st.session_state.staged_pdfs]
         for file in staged_files:
             if file.name not in current_files:
+                # getbuffer() writes the upload straight to disk without another in-memory copy
+                handle = st.session_state.blobs.put_bytes(file.getbuffer(), file.name, kind="pdf")
+                if handle is None:
+                    st.sidebar.error(f"'{file.name}' is larger than the per-session storage quota.")
+                    continue
                 st.session_state.staged_pdfs.append({
                     "filename": file.name,
-                    "file_bytes": file.read()
+                    "blob": handle
                 })
         st.sidebar.success(f"Added {len(staged_files)} PDF(s) to your upload list.")
     if st.session_state.staged_pdfs:
@@ -342,6 +420,7 @@ def main():
         if final_query:
             with st.spinner("Searching online papers..."):
                 try:
+                    import arxiv
                     if search_type == "Keyword":
                         from arxiv import SortCriterion
                         sort_by = SortCriterion.SubmittedDate if sort_by_option == "SubmittedDate" else SortCriterion.Relevance
@@ -389,10 +468,17 @@ def main():
             st.sidebar.markdown(f"- PDF: {pdf['filename']}")
         for paper in st.session_state.staged_arxiv:
             st.sidebar.markdown(f"- Online Paper: {paper['title']}")
+        if st.session_state.profile_ui:
+            st.sidebar.toggle("Profile processing", key="profile_actions",
+                              help=f"Writes CPU stacks and allocation reports to {PROFILE_DIR}")
         if st.sidebar.button("Process All Documents"):
-            with st.spinner("Processing documents..."):
+            profiling = PROFILE_ACTIONS or st.session_state.get("profile_actions", False)
+            with st.spinner("Processing documents..."), profile_action("process_ocr", enabled=profiling) as profile, \
+                    deadline_scope(OCR_BUDGET, name="process_ocr"):
                 process_ocr_for_staged(st.session_state.client)
             st.sidebar.success("Documents have been processed!")
+            if profile is not None:
+                st.sidebar.caption(f"Profile: {profile.summary()}")
     else:
         st.sidebar.info("No documents staged yet.")
 
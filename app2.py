@@ -1,29 +1,99 @@
 import chainlit as cl
-import google.generativeai as genai
 import os
 import json
-from groq import Groq
+import asyncio
+import functools
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from src.arxiv_fetcher import ArxivLoader
 from src.pubmed_fetcher import PubMedLoader
-from src.insight_generator import generate_paper_insight, generate_comparison_insight
+from src.comparison_engine import compare_papers, COMPARE_MAX_PAPERS
+from src.insight_store import cached_paper_insight
+from src.insight_generator import insight_failed
+from src.dedup import deduplicate_papers
+from src.reranker import rerank, RERANK_POOL, RERANK_TOP_N
+from src.query_refiner import refine_query
+from src.chat_memory import ChatMemory, SUMMARY_SYSTEM_PROMPT, CHAT_SUMMARY_TOKEN_BUDGET
+from src.metrics import span
+from src.profiling import profile_action, PROFILE_ACTIONS
+from src.deadline import (deadline_scope, bind, call_timeout, remaining, request_done,
+                          HTTP_TIMEOUT, SEARCH_BUDGET, ANALYSIS_BUDGET, CHAT_BUDGET)
 
 # --- Configuration ---
-genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
-groq_client = Groq(api_key=os.getenv("GROQ_API_KEY"))
+GEMINI_MODEL = "gemini-1.5-flash"
+GROQ_MODEL = "llama-3.3-70b-versatile"
+BLOCKING_WORKERS = int(os.getenv("APP2_BLOCKING_WORKERS", "32"))       # shared by all sessions
+ANALYSIS_CONCURRENCY = int(os.getenv("APP2_ANALYSIS_CONCURRENCY", "4"))  # papers analyzed at once per user
+
+# Loaders, the insight store and the comparison engine are synchronous; they run
+# here so a slow call never stalls the event loop other chats are served from
+_blocking_executor = ThreadPoolExecutor(max_workers=BLOCKING_WORKERS, thread_name_prefix="app2-blocking")
+
+async def run_blocking(fn, *args, **kwargs):
+    # The worker thread runs under the caller's deadline, so its calls time out with the request
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_blocking_executor, bind(functools.partial(fn, *args, **kwargs)))
+
+@contextmanager
+def session_deadline(budget, name):
+    """
+    Deadline for one user action, registered with the session so that Stop or
+    a disconnect cancels the work still running in the blocking pool
+    """
+    with deadline_scope(budget, name=name) as deadline:
+        active = cl.user_session.get("deadlines")
+        active.add(deadline)
+        try:
+            yield deadline
+        except BaseException:
+            # The handler task itself was cancelled (Stop) or failed: its threads stop too
+            deadline.cancel("handler ended")
+            raise
+        finally:
+            active.discard(deadline)
+
+def cancel_session_work(reason):
+    for deadline in list(cl.user_session.get("deadlines") or ()):
+        deadline.cancel(reason)
+
+# --- Lazily created clients (importing the SDKs dominates cold start) ---
+@functools.lru_cache(maxsize=None)
+def get_groq_client():
+    from groq import Groq
+    return Groq(api_key=os.getenv("GROQ_API_KEY"))
+
+@functools.lru_cache(maxsize=None)
+def get_genai():
+    import google.generativeai as genai
+    genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+    return genai
+
+def gemini_model():
+    return get_genai().GenerativeModel(GEMINI_MODEL)
 
 # --- Helper Functions ---
 def refine_search_query(user_input):
+    """Groq fallback for refine_query when the local refinement is not confident"""
     try:
-        completion = groq_client.chat.completions.create(
-            model="llama-3.3-70b-versatile",
-            messages=[
-                {"role": "system", "content": "You are a Scientific Search Optimizer. Convert the user's natural language request into a precise, keyword-based search query. Return ONLY the keywords."},
-                {"role": "user", "content": user_input}
-            ]
-        )
+        with span("refine_query", source="groq", model=GROQ_MODEL):
+            completion = get_groq_client().chat.completions.create(
+                model=GROQ_MODEL,
+                messages=[
+                    {"role": "system", "content": "You are a Scientific Search Optimizer. Convert the user's natural language request into a precise, keyword-based search query. Return ONLY the keywords."},
+                    {"role": "user", "content": user_input}
+                ],
+                timeout=call_timeout(HTTP_TIMEOUT)
+            )
         return completion.choices[0].message.content.strip()
     except Exception:
-        return user_input
+        return None
+
+def summarize_with_gemini(summary, turns):
+    """Chat-memory summarizer for the Gemini UI"""
+    transcript = "\n".join(f"User: {q}\nAssistant: {a}" for q, a in turns)
+    prompt = (SUMMARY_SYSTEM_PROMPT.format(words=CHAT_SUMMARY_TOKEN_BUDGET * 3 // 4)
+              + f"\n\nExisting summary:\n{summary or '(none)'}\n\nNew exchanges:\n{transcript}")
+    return gemini_model().generate_content(prompt, request_options={"timeout": call_timeout(CHAT_BUDGET)}).text
 
 # --- Chainlit Session Management ---
 
@@ -34,38 +104,63 @@ async def start():
     cl.user_session.set("found_papers", [])
     cl.user_session.set("selected_papers", [])
     cl.user_session.set("mode", "search") # Modes: search, select, chat
+    cl.user_session.set("chat_memory", ChatMemory(summarize=summarize_with_gemini))
+    cl.user_session.set("deadlines", set())  # of the actions still running
 
     await cl.Message("🧬 **Life Sciences Research Agent**\n\nI can help you find, analyze, and compare research papers from Arxiv and PubMed.\n\n**Please enter a search topic to begin.**").send()
 
+@cl.on_stop
+async def on_stop():
+    cancel_session_work("stopped by user")
+
+@cl.on_chat_end
+async def on_chat_end():
+    # Disconnected or a new chat: nobody is left to read the results
+    cancel_session_work("session ended")
+
 @cl.on_message
 async def main(message: cl.Message):
     mode = cl.user_session.get("mode")
     
-    if mode == "search":
-        await handle_search(message.content)
+    if message.content.strip() == "/profile":
+        # Hidden diagnostics command: profile this session's searches
+        enabled = not cl.user_session.get("profile_actions", False)
+        cl.user_session.set("profile_actions", enabled)
+        await cl.Message(f"Search profiling {'on' if enabled else 'off'}.").send()
+    elif mode == "search":
+        with profile_action("handle_search", enabled=PROFILE_ACTIONS or cl.user_session.get("profile_actions", False)) as profile, \
+                session_deadline(SEARCH_BUDGET, "search"):
+            await handle_search(message.content)
+        if profile is not None:
+            await cl.Message(f"Profile: {profile.summary()}").send()
     elif mode == "chat":
-        await handle_chat(message.content)
+        with session_deadline(CHAT_BUDGET, "chat"):
+            await handle_chat(message.content)
     else:
         # Fallback or specific selection handling if done via text
         pass
 
 async def handle_search(query):
-    refined_query = refine_search_query(query)
-    msg = cl.Message(content=f"🔎 Searching Arxiv & PubMed for: **'{refined_query}'**...")
+    refined = await run_blocking(refine_query, query, llm_refine=refine_search_query)
+    msg = cl.Message(content=f"🔎 Searching Arxiv & PubMed for: **'{refined.display}'**...")
     await msg.send()
 
     arxiv_loader = cl.user_session.get("arxiv_loader")
     pubmed_loader = cl.user_session.get("pubmed_loader")
 
-    # Fetch from both sources
-    arxiv_papers = arxiv_loader.fetch_papers(refined_query, limit=3)
-    pubmed_papers = pubmed_loader.fetch_papers(refined_query, limit=3)
+    # Fetch a wide pool from both sources concurrently, then keep the best matches
+    arxiv_papers, pubmed_papers = await asyncio.gather(
+        run_blocking(arxiv_loader.fetch_papers, refined.arxiv(), limit=RERANK_POOL),
+        run_blocking(pubmed_loader.fetch_papers, refined.pubmed(), limit=RERANK_POOL))
     
-    all_papers = arxiv_papers + pubmed_papers
+    # A source that ran out of time returned nothing; rank what the other one found
+    partial = request_done()
+    candidates, removed = await run_blocking(deduplicate_papers, arxiv_papers + pubmed_papers)
+    all_papers = await run_blocking(rerank, refined, candidates, RERANK_TOP_N)
     cl.user_session.set("found_papers", all_papers)
 
     if not all_papers:
-        await cl.Message(f"❌ No papers found for '{refined_query}'. Try a different topic.").send()
+        await cl.Message(f"❌ No papers found for '{refined.display}'. Try a different topic.").send()
         return
 
     # Display results with actions for selection
@@ -73,11 +168,17 @@ async def handle_search(query):
     results_text = "### 📄 Found Papers:\n"
     
     for i, paper in enumerate(all_papers):
-        source_icon = "🅰️" if paper['source'] == 'arxiv' else "Pw"
-        results_text += f"**{i+1}. [{source_icon}] {paper['title']}**\n*Published: {paper['published']}*\n\n"
+        source_icon = " + ".join("🅰️" if s == 'arxiv' else "Pw" for s in paper.get('sources', [paper['source']]))
+        results_text += (f"**{i+1}. [{source_icon}] {paper['title']}**\n"
+                         f"*Published: {paper['published']} · relevance {paper['relevance']:.2f}*\n\n")
         actions.append(cl.Action(name="select_paper", value=str(i), label=f"Select #{i+1}"))
 
-    results_text += "\n👇 **Click buttons below to select papers for analysis (Max 3).**"
+    results_text += f"*Best {len(all_papers)} of {len(candidates)} candidates, ranked by relevance.*\n"
+    if removed:
+        results_text += f"*Merged {removed} duplicate result(s) across sources.*\n"
+    if partial:
+        results_text += "*⏳ Not every source answered in time; these results are partial.*\n"
+    results_text += f"\n👇 **Click buttons below to select papers for analysis (Max {COMPARE_MAX_PAPERS}).**"
     
     await cl.Message(content=results_text, actions=actions).send()
     
@@ -99,8 +200,8 @@ async def on_select_paper(action: cl.Action):
         await cl.Message(content=f"⚠️ '{paper['title']}' is already selected.").send()
         return
 
-    if len(selected_papers) >= 3:
-        await cl.Message(content=f"⚠️ You can only select up to 3 papers.").send()
+    if len(selected_papers) >= COMPARE_MAX_PAPERS:
+        await cl.Message(content=f"⚠️ You can only select up to {COMPARE_MAX_PAPERS} papers.").send()
         return
 
     selected_papers.append(paper)
@@ -116,21 +217,35 @@ async def on_analyze_papers(action: cl.Action):
         return
 
     cl.user_session.set("mode", "chat") # Switch to chat mode
-    
+    # No overall time limit (each paper and the comparison have their own), but Stop cancels it all
+    with session_deadline(None, "analysis"):
+        await analyze_selected(selected_papers)
+
+async def analyze_selected(selected_papers):
     await cl.Message(content=f"🧠 Analyzing {len(selected_papers)} papers... This may take a moment.").send()
     
-    combined_context = ""
-    
-    # Generate individual insights
-    for paper in selected_papers:
-        msg = cl.Message(content=f"📖 Reading **{paper['title']}**...")
-        await msg.send()
-        
+    progress = cl.Message(content=f"📖 Reading papers... (0/{len(selected_papers)} done)")
+    await progress.send()
+    limit = asyncio.Semaphore(ANALYSIS_CONCURRENCY)
+    done = 0
+
+    async def analyze(paper):
+        nonlocal done
         # Use summary as text for now (Full text fetching is complex and varies by source)
         # In a real full implementation, we would try to download PDF/HTML here.
         text_content = f"Title: {paper['title']}\nAbstract: {paper['summary']}"
         
-        insight = generate_paper_insight(text_content)
+        # Shared insight store first; only a miss calls the LLM
+        async with limit:
+            with deadline_scope(ANALYSIS_BUDGET, name="insight") as deadline:
+                insight, _ = await run_blocking(cached_paper_insight, paper, text_content)
+        done += 1
+        progress.content = f"📖 Reading papers... ({done}/{len(selected_papers)} done)"
+        await progress.update()
+        if insight_failed(insight) and deadline.done:
+            # Left out of the comparison and chat context; the other papers still go ahead
+            await cl.Message(content=f"⏳ Analysis of **{paper['title']}** did not finish in time.").send()
+            return None
         
         # Store insight in paper dict for reference
         paper['insight'] = insight
@@ -142,14 +257,25 @@ async def on_analyze_papers(action: cl.Action):
         **Results:** {insight.results}
         **Conclusions:** {insight.conclusions}
         """
+        # Each analysis is shown as soon as it lands, not in selection order
         await cl.Message(content=display_text).send()
-        
-        combined_context += f"\n\n=== PAPER: {paper['title']} ===\n{text_content}\nAnalysis: {insight.model_dump_json()}"
+        return {"paper": paper, "text": text_content, "insight": insight}
+
+    # Generate individual insights concurrently
+    compare_entries = [e for e in await asyncio.gather(*(analyze(paper) for paper in selected_papers)) if e]
+    if not compare_entries:
+        await cl.Message(content="❌ No analysis finished in time. Please try again.").send()
+        return
+    combined_context = "".join(
+        f"\n\n=== PAPER: {e['paper']['title']} ===\n{e['text']}\nAnalysis: {e['insight'].model_dump_json()}"
+        for e in compare_entries)
 
     # Generate Comparison if > 1 paper
-    if len(selected_papers) > 1:
+    if len(compare_entries) > 1:
         await cl.Message(content="⚖️ Generating Comparative Analysis...").send()
-        comparison = generate_comparison_insight(combined_context)
+        # Past the budget the comparison still returns its locally built table
+        with deadline_scope(ANALYSIS_BUDGET, name="compare"):
+            comparison = await run_blocking(compare_papers, compare_entries)
         
         comp_text = f"""
         ## 📊 Comparative Analysis
@@ -181,23 +307,40 @@ async def handle_chat(user_input):
         await cl.Message(content="⚠️ No papers loaded. Please search and select papers first.").send()
         return
 
-    # Simple RAG / Chat
-    model = genai.GenerativeModel("gemini-1.5-flash")
+    # Simple RAG / Chat with bounded history (recent turns + rolling summary)
+    memory = cl.user_session.get("chat_memory")
+    # First use imports and configures the Gemini SDK; keep that off the event loop
+    model = await run_blocking(gemini_model)
     prompt = f"""
     You are a research assistant. Answer the user's question based ONLY on the provided context.
     
     Context:
     {context[:40000]}
     
+    Conversation so far:
+    {memory.history_text() or "(none)"}
+    
     User Question: {user_input}
     """
     
     msg = cl.Message(content="")
     await msg.send()
     
-    response = model.generate_content(prompt, stream=True)
-    for chunk in response:
-        if chunk.text:
-            await msg.stream_token(chunk.text)
+    with span("llm_request", source="gemini", model=GEMINI_MODEL) as sp:
+        # Async client: waiting on Gemini yields the loop to other chats
+        async def stream():
+            response = await model.generate_content_async(
+                prompt, stream=True, request_options={"timeout": call_timeout(CHAT_BUDGET)})
+            async for chunk in response:
+                if chunk.text:
+                    await msg.stream_token(chunk.text)
+
+        try:
+            await asyncio.wait_for(stream(), remaining())
+        except asyncio.TimeoutError:
+            # Keep what was streamed so far
+            sp.status = "deadline"
+            await msg.stream_token(f"\n\n*⏳ Answer cut off after {CHAT_BUDGET:.0f} s.*")
     
-    await msg.update()
\ No newline at end of file
+    await msg.update()
+    memory.add_turn(user_input, msg.content)
\ No newline at end of file
@@ -1,11 +1,19 @@
 import streamlit as st
 import os
 import json
+import time
+import uuid
 from dotenv import load_dotenv
-from src.arxiv_fetcher import ArxivLoader
-from src.pubmed_fetcher import PubMedLoader
-from src.insight_generator import generate_paper_insight, generate_comparison_insight
-from src.llm_client import get_llm_response
+from src.insight_generator import PaperInsight, ComparisonInsight
+from src.comparison_engine import COMPARE_MAX_PAPERS
+from src.llm_router import routed_llm_response, router
+from src.gateway_guard import guard_snapshot
+from src.chat_memory import ChatMemory
+from src.corpus_store import get_default_store
+from src.job_queue import create_default_queue, DONE, FAILED, CANCELLED, PRIORITY_SPECULATIVE
+from src.metrics import span, registry
+from src.profiling import start_profile, PROFILE_ACTIONS, PROFILE_DIR
+from src.deadline import deadline_scope, CHAT_BUDGET
 
 # --- Configuration ---
 load_dotenv()
@@ -13,22 +21,24 @@ load_dotenv()
 # Load specific model names from env or defaults
 MODEL_FAST = os.getenv("MODEL_FAST", "azure_ai/genailab-maas-Llama-3.3-70B-Instruct")
 MODEL_REASONING = os.getenv("MODEL_REASONING", "azure/genailab-maas-gpt-4o")
+JOB_POLL_SECONDS = 1.0
+DEBUG_METRICS = os.getenv("DEBUG_METRICS", "").lower() in ("1", "true", "yes")
+# Speculative pre-analysis of the top results while the user is still choosing
+SPECULATIVE_DEFAULT = os.getenv("SPECULATIVE_ANALYSIS", "").lower() in ("1", "true", "yes")
+SPECULATIVE_TOP_N = int(os.getenv("SPECULATIVE_TOP_N", "3"))
+SPECULATIVE_TOKEN_BUDGET = int(os.getenv("SPECULATIVE_TOKEN_BUDGET", "60000"))  # per session, estimated
+INSIGHT_OVERHEAD_TOKENS = 1500  # schema prompt + a typical structured answer
 
-# --- Helper Functions ---
-def refine_search_query(user_input):
-    """Uses the Llama 3.3 model to refine the search query"""
-    try:
-        messages = [
-            {"role": "system", "content": "You are a Scientific Search Optimizer. Convert the user's natural language request into a precise, keyword-based search query. Return ONLY the keywords. Do not add quotes or prefixes."},
-            {"role": "user", "content": user_input}
-        ]
-        # Using the Fast model (Llama) for this
-        response = get_llm_response(messages, MODEL_FAST, temperature=0.1)
-        return response.strip() if response else user_input
-    except Exception:
-        return user_input
+@st.cache_resource
+def get_job_queue():
+    """One queue and worker pool per server process, shared by all sessions"""
+    return create_default_queue()
+
+job_queue = get_job_queue()
 
 # --- Session State Initialization ---
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
 if "found_papers" not in st.session_state:
     st.session_state.found_papers = []
 if "selected_papers" not in st.session_state:
@@ -37,10 +47,111 @@ if "chat_context" not in st.session_state:
     st.session_state.chat_context = ""
 if "messages" not in st.session_state:
     st.session_state.messages = []
+if "chat_memory" not in st.session_state:
+    st.session_state.chat_memory = ChatMemory()
 if "paper_insights" not in st.session_state:
     st.session_state.paper_insights = {} 
 if "comparison_insight" not in st.session_state:
     st.session_state.comparison_insight = None
+if "search_job_id" not in st.session_state:
+    # Job IDs live in the URL too, so a browser refresh picks the work back up
+    st.session_state.search_job_id = st.query_params.get("search")
+if "insight_job_ids" not in st.session_state:
+    st.session_state.insight_job_ids = [j for j in st.query_params.get("insights", "").split(",") if j]
+if "compare_job_id" not in st.session_state:
+    st.session_state.compare_job_id = st.query_params.get("compare")
+if "speculative_jobs" not in st.session_state:
+    st.session_state.speculative_jobs = {}  # paper id -> {"job_id", "cost"}
+if "speculative_tokens" not in st.session_state:
+    st.session_state.speculative_tokens = 0
+if "profile_ui" not in st.session_state:
+    # Hidden diagnostics: open the app with ?profile=1 to get the profiling toggle
+    st.session_state.profile_ui = st.query_params.get("profile") == "1"
+
+# Every run (including the job polling reruns) tells the queue this session is still here;
+# once a closed tab stops them, its searches and analyses are cancelled
+job_queue.heartbeat(st.session_state.session_id)
+
+def sync_query_params():
+    params = {"search": st.session_state.search_job_id,
+              "insights": ",".join(st.session_state.insight_job_ids),
+              "compare": st.session_state.compare_job_id}
+    st.query_params.clear()
+    st.query_params.update({k: v for k, v in params.items() if v})
+
+def show_job_progress(job):
+    st.progress(job["progress"], text=job.get("message") or job["status"].capitalize())
+
+def estimate_insight_tokens(paper):
+    return (len(paper["title"]) + len(paper.get("summary") or "")) // 4 + INSIGHT_OVERHEAD_TOKENS
+
+def start_speculative_analysis(papers):
+    """Queues low-priority insight jobs for the top results, within the session budget"""
+    for paper in papers[:SPECULATIVE_TOP_N]:
+        if paper["id"] in st.session_state.speculative_jobs:
+            continue
+        cost = estimate_insight_tokens(paper)
+        if st.session_state.speculative_tokens + cost > SPECULATIVE_TOKEN_BUDGET:
+            break
+        job_id = job_queue.submit("insight", {"paper": paper}, session_id=st.session_state.session_id,
+                                  priority=PRIORITY_SPECULATIVE)
+        st.session_state.speculative_jobs[paper["id"]] = {"job_id": job_id, "cost": cost}
+        st.session_state.speculative_tokens += cost
+
+def claim_speculative_job(paper):
+    """Reuses a speculative job for a selected paper, promoting it if it has not started"""
+    entry = st.session_state.speculative_jobs.get(paper["id"])
+    if not entry:
+        return None
+    job = job_queue.get(entry["job_id"])
+    if job is None or job["status"] in (FAILED, CANCELLED):
+        return None
+    job_queue.promote(entry["job_id"])
+    return entry["job_id"]
+
+def cancel_speculative_jobs(keep_ids=()):
+    """Cancels queued speculative work for papers not in keep_ids; started or finished jobs stay for reuse"""
+    for paper_id, entry in list(st.session_state.speculative_jobs.items()):
+        if paper_id in keep_ids:
+            continue
+        if job_queue.cancel(entry["job_id"]):
+            st.session_state.speculative_tokens -= entry["cost"]
+            del st.session_state.speculative_jobs[paper_id]
+
+def cancel_jobs(job_ids, keep_ids=()):
+    """Cancels superseded jobs of this session, including ones already running"""
+    for job_id in job_ids:
+        if job_id and job_id not in keep_ids:
+            job_queue.cancel(job_id, running=True)
+
+def stop_analysis_profile():
+    """Writes the profile of the analysis that just finished (or was replaced), if one is running"""
+    profile = st.session_state.pop("analysis_profile", None)
+    if profile is not None:
+        profile.stop()
+        st.sidebar.caption(f"Profile: {profile.summary()}")
+
+def render_metrics_panel():
+    """Sidebar debug panel with per-stage latency (enable with DEBUG_METRICS=1)"""
+    with st.sidebar.expander("🛠️ Latency Metrics"):
+        rows = registry.snapshot()
+        if rows:
+            st.dataframe(rows, use_container_width=True, hide_index=True)
+        else:
+            st.caption("No spans recorded yet.")
+        routes = router.snapshot()
+        if routes:
+            st.caption("Model routing (rolling window)")
+            st.dataframe(routes, use_container_width=True, hide_index=True)
+        guards = guard_snapshot()
+        if guards:
+            st.caption("Gateway concurrency / circuit breakers")
+            st.dataframe(guards, use_container_width=True, hide_index=True)
+        st.download_button("Prometheus text", registry.export_prometheus(), file_name="metrics.prom",
+                           mime="text/plain", key="dl_metrics_prom")
+        recent = "\n".join(json.dumps(r) for r in registry.recent_spans(200))
+        st.download_button("Recent spans (JSONL)", recent, file_name="spans.jsonl",
+                           mime="application/json", key="dl_metrics_jsonl")
 
 # --- UI Layout ---
 st.set_page_config(page_title="Life Sciences Agent", page_icon="🧬", layout="wide")
@@ -48,29 +159,83 @@ st.set_page_config(page_title="Life Sciences Agent", page_icon="🧬", layout="w
 st.title("🧬 Life Sciences Research Agent (Secure Env)")
 st.markdown("Search, Analyze, and Compare Research Papers using Internal GenAI APIs.")
 
+render_span = span("ui_render", source="app_streamlit")
+jobs_pending = False
+
+def rerun():
+    # st.rerun() ends the script run at once; record the render first
+    render_span.finish()
+    st.rerun()
+
 # --- Sidebar: Search ---
 with st.sidebar:
     st.header("🔎 Search Papers")
     query = st.text_input("Enter topic (e.g., 'COVID-19 vaccines')")
+    speculative = st.toggle("⚡ Pre-analyze top results", value=SPECULATIVE_DEFAULT,
+                            help="Start analyzing the top results in the background while you choose.")
+    if st.session_state.profile_ui:
+        st.toggle("Profile analysis", key="profile_actions",
+                  help=f"Writes CPU stacks and allocation reports to {PROFILE_DIR}")
     if st.button("Search"):
-        with st.spinner("Refining query & Searching..."):
-            refined_query = refine_search_query(query)
-            st.write(f"**Keywords:** {refined_query}")
-            
-            # Initialize Loaders
-            arxiv_loader = ArxivLoader()
-            pubmed_loader = PubMedLoader()
-            
-            # Fetch Papers
-            arxiv_papers = arxiv_loader.fetch_papers(refined_query, limit=3)
-            pubmed_papers = pubmed_loader.fetch_papers(refined_query, limit=3)
-            
-            st.session_state.found_papers = arxiv_papers + pubmed_papers
-            st.session_state.selected_papers = []
-            st.session_state.chat_context = ""
-            st.session_state.messages = []
-            st.session_state.paper_insights = {}
-            st.session_state.comparison_insight = None
+        cancel_speculative_jobs()
+        # A new search replaces the previous search and analysis; stop them instead of finishing unseen work
+        cancel_jobs([st.session_state.search_job_id, *st.session_state.insight_job_ids, st.session_state.compare_job_id])
+        st.session_state.search_job_id = job_queue.submit(
+            "search", {"query": query}, session_id=st.session_state.session_id)
+        st.session_state.found_papers = []
+        st.session_state.selected_papers = []
+        st.session_state.chat_context = ""
+        st.session_state.messages = []
+        st.session_state.chat_memory.clear()
+        st.session_state.paper_insights = {}
+        st.session_state.comparison_insight = None
+        st.session_state.insight_job_ids = []
+        st.session_state.compare_job_id = None
+        sync_query_params()
+
+    # Poll the search job; the UI never runs the search itself
+    if st.session_state.search_job_id:
+        search_job = job_queue.get(st.session_state.search_job_id)
+        if search_job is None:
+            st.session_state.search_job_id = None
+        elif search_job["status"] == DONE:
+            result = search_job["result"]
+            st.write(f"**Keywords:** {result['refined_query']}")
+            if "candidates" in result:
+                st.caption(f"Best {len(result['papers'])} of {result['candidates']} candidates, ranked by relevance.")
+            if result["duplicates_removed"]:
+                st.caption(f"Merged {result['duplicates_removed']} duplicate result(s) across sources.")
+            if result.get("partial"):
+                st.caption("⏳ Not every source answered in time; these results are partial.")
+            if not st.session_state.found_papers:
+                st.session_state.found_papers = result["papers"]
+                if speculative:
+                    start_speculative_analysis(result["papers"])
+            if st.session_state.speculative_jobs:
+                st.caption(f"⚡ Pre-analyzing {len(st.session_state.speculative_jobs)} paper(s) · "
+                           f"~{st.session_state.speculative_tokens:,}/{SPECULATIVE_TOKEN_BUDGET:,} tokens used")
+        elif search_job["status"] == FAILED:
+            st.error(f"Search failed: {search_job['error']}")
+        elif search_job["status"] == CANCELLED:
+            st.warning("Search was cancelled; please search again.")
+        else:
+            show_job_progress(search_job)
+            jobs_pending = True
+
+# --- Sidebar: Corpus of previously analyzed papers (no LLM calls) ---
+with st.sidebar.expander("📚 Analyzed Corpus"):
+    min_score = st.slider("Min. rigor score", 1, 10, 8)
+    published_after = st.date_input("Published after", value=None)
+    if st.button("Query corpus"):
+        with span("corpus_query", source="app_streamlit"):
+            table = get_default_store().query_insights(
+                min_score=min_score, published_after=published_after,
+                columns=["title", "source", "published_date", "methodology_score", "conclusions"], limit=500)
+        if table is None:
+            st.caption("Corpus unavailable (nothing recorded yet, or pyarrow not installed).")
+        else:
+            st.caption(f"{table.num_rows} paper(s)")
+            st.dataframe(table, use_container_width=True, hide_index=True)
 
 # --- Main Area ---
 
@@ -81,16 +246,18 @@ if st.session_state.found_papers:
     with st.form("selection_form"):
         selected_indices = []
         for i, paper in enumerate(st.session_state.found_papers):
-            source_icon = "🅰️" if paper['source'] == 'arxiv' else "Pw"
+            source_icon = " + ".join("🅰️" if s == 'arxiv' else "Pw" for s in paper.get('sources', [paper['source']]))
             label = f"[{source_icon}] {paper['title']} ({paper['published']})"
+            if "relevance" in paper:
+                label += f" · relevance {paper['relevance']:.2f}"
             if st.checkbox(label, key=f"paper_{i}"):
                 selected_indices.append(i)
         
         submitted = st.form_submit_button("✅ Analyze Selected Papers")
         
         if submitted:
-            if len(selected_indices) > 3:
-                st.error("Please select max 3 papers.")
+            if len(selected_indices) > COMPARE_MAX_PAPERS:
+                st.error(f"Please select max {COMPARE_MAX_PAPERS} papers.")
             elif len(selected_indices) == 0:
                 st.error("Please select at least one paper.")
             else:
@@ -98,39 +265,89 @@ if st.session_state.found_papers:
                 st.session_state.paper_insights = {}
                 st.session_state.comparison_insight = None
                 st.session_state.chat_context = ""
-                st.rerun()
+                st.session_state.messages = []
+                st.session_state.chat_memory.clear()
+                previous_job_ids = [*st.session_state.insight_job_ids, st.session_state.compare_job_id]
+                st.session_state.insight_job_ids = [
+                    claim_speculative_job(paper)
+                    or job_queue.submit("insight", {"paper": paper}, session_id=st.session_state.session_id)
+                    for paper in st.session_state.selected_papers
+                ]
+                cancel_speculative_jobs(keep_ids={paper["id"] for paper in st.session_state.selected_papers})
+                cancel_jobs(previous_job_ids, keep_ids=set(st.session_state.insight_job_ids))
+                st.session_state.compare_job_id = None
+                # The analysis spans many reruns, so the profile runs from here until the jobs finish
+                stop_analysis_profile()
+                st.session_state.analysis_profile = start_profile(
+                    "analysis", enabled=PROFILE_ACTIONS or st.session_state.get("profile_actions", False))
+                sync_query_params()
+                rerun()
 
-# 2. Analysis & Comparison Logic
-if st.session_state.selected_papers and not st.session_state.chat_context:
-    with st.spinner("Analyzing papers using GenAI Lab Models..."):
-        combined_context = ""
-        
-        # Individual Analysis
-        for paper in st.session_state.selected_papers:
-            if paper['id'] not in st.session_state.paper_insights:
-                text_content = f"Title: {paper['title']}\nAbstract: {paper['summary']}"
-                insight = generate_paper_insight(text_content)
-                st.session_state.paper_insights[paper['id']] = insight
-                combined_context += f"\n\n=== PAPER: {paper['title']} ===\n{text_content}\nAnalysis: {insight.model_dump_json()}"
-
-        # Comparative Analysis
-        if len(st.session_state.selected_papers) > 1:
-            comparison = generate_comparison_insight(combined_context)
+# 2. Analysis & Comparison Logic (submitted as background jobs, polled here)
+if st.session_state.insight_job_ids and not st.session_state.chat_context:
+    insight_jobs = [job for job in job_queue.get_many(st.session_state.insight_job_ids) if job]
+    if not st.session_state.selected_papers:
+        # Restored after a refresh: rebuild the selection from the job parameters
+        st.session_state.selected_papers = [job["params"]["paper"] for job in insight_jobs]
+
+    combined_context = ""
+    compare_entries = []
+    for job in insight_jobs:
+        paper = job["params"]["paper"]
+        if job["status"] == DONE:
+            insight = PaperInsight.model_validate(job["result"]["insight"])
+            st.session_state.paper_insights[paper['id']] = insight
+            compare_entries.append({"paper": paper, "text": job["result"]["text"], "insight": job["result"]["insight"]})
+            combined_context += f"\n\n=== PAPER: {paper['title']} ===\n{job['result']['text']}\nAnalysis: {insight.model_dump_json()}"
+        elif job["status"] == FAILED:
+            st.error(f"Analysis failed for '{paper['title']}': {job['error']}")
+        elif job["status"] == CANCELLED:
+            st.warning(f"Analysis of '{paper['title']}' was cancelled.")
+
+    pending = [job for job in insight_jobs if job["status"] not in (DONE, FAILED, CANCELLED)]
+    if pending:
+        st.markdown(f"🧠 Analyzing papers using GenAI Lab Models... ({len(insight_jobs) - len(pending)}/{len(insight_jobs)} done)")
+        for job in pending:
+            show_job_progress(job)
+        jobs_pending = True
+
+    # Comparative Analysis
+    elif len(st.session_state.selected_papers) > 1:
+        if not st.session_state.compare_job_id:
+            st.session_state.compare_job_id = job_queue.submit(
+                "compare", {"papers": compare_entries}, session_id=st.session_state.session_id)
+            sync_query_params()
+        compare_job = job_queue.get(st.session_state.compare_job_id)
+        if compare_job and compare_job["status"] == DONE:
+            comparison = ComparisonInsight.model_validate(compare_job["result"]["comparison"])
             st.session_state.comparison_insight = comparison
             st.session_state.chat_context = f"Comparative Analysis:\n{comparison.model_dump_json()}\n\nPapers Data:\n{combined_context}"
-        else:
+        elif compare_job and compare_job["status"] in (FAILED, CANCELLED):
+            st.error(f"Comparison failed: {compare_job['error'] or 'cancelled'}")
             st.session_state.chat_context = combined_context
+        else:
+            st.markdown("⚖️ Generating Comparative Analysis...")
+            if compare_job:
+                show_job_progress(compare_job)
+            jobs_pending = True
+    else:
+        st.session_state.chat_context = combined_context
+    if not jobs_pending:
+        stop_analysis_profile()
 
 # 3. Display Analysis
 if st.session_state.selected_papers and st.session_state.paper_insights:
     st.divider()
     st.subheader("🧠 Analysis & Comparison")
     
-    cols = st.columns(len(st.session_state.selected_papers))
+    # Up to three cards per row so larger comparisons stay readable
+    per_row = min(3, len(st.session_state.selected_papers))
     for idx, paper in enumerate(st.session_state.selected_papers):
+        if idx % per_row == 0:
+            cols = st.columns(per_row)
         insight = st.session_state.paper_insights.get(paper['id'])
         if insight:
-            with cols[idx]:
+            with cols[idx % per_row]:
                 st.markdown(f"### {paper['title']}")
                 
                 # Score Badge
@@ -192,17 +409,32 @@ if st.session_state.chat_context:
             st.markdown(prompt)
 
         with st.chat_message("assistant"):
-            # Construct messages for RAG Chat
+            # Construct messages for RAG Chat: bounded history (recent turns + rolling summary), then the question
             rag_messages = [
                 {"role": "system", "content": "You are a research assistant. Answer the user's question based ONLY on the provided context."},
+                *st.session_state.chat_memory.history_messages(),
                 {"role": "user", "content": f"Context:\n{st.session_state.chat_context[:30000]}\n\nUser Question: {prompt}"}
             ]
             
-            # Use Reasoning Model (GPT-4o) for best chat answers
-            response_text = get_llm_response(rag_messages, MODEL_REASONING)
+            # Reasoning Model (GPT-4o) for best chat answers, hedged to the fast model when slow;
+            # the whole answer, including waiting for a gateway slot, fits in CHAT_BUDGET
+            with deadline_scope(CHAT_BUDGET, name="chat") as deadline:
+                response_text = routed_llm_response(rag_messages, "chat")
             
             if response_text:
                 st.markdown(response_text)
                 st.session_state.messages.append({"role": "assistant", "content": response_text})
+                st.session_state.chat_memory.add_turn(prompt, response_text)
+            elif deadline.done:
+                st.error(f"No answer within {CHAT_BUDGET:.0f} s. Please try again.")
             else:
-                st.error("Failed to get response from API.")
\ No newline at end of file
+                st.error("Failed to get response from API.")
+
+render_span.finish()
+if DEBUG_METRICS:
+    render_metrics_panel()
+
+# 5. Poll background jobs without blocking the script run
+if jobs_pending:
+    time.sleep(JOB_POLL_SECONDS)
+    rerun()
@@ -0,0 +1,267 @@
+"""
+Headless batch literature analysis.
+
+Reads a file of search queries or paper IDs (one per line), fetches papers
+through the existing loaders and runs `generate_paper_insight` on each with a
+worker pool, reusing anything already in the shared insight store. Results
+stream to a JSONL file that doubles as the checkpoint: re-running the same
+command skips everything already written.
+
+Input lines:
+    COVID-19 vaccine efficacy      -> searched on arXiv and PubMed
+    arxiv:2101.00001               -> fetched by arXiv ID
+    pmid:34567890                  -> fetched by PubMed ID
+    # comment lines are ignored
+
+Usage:
+    python batch_runner.py queries.txt -o results.jsonl --workers 8 --limit 20
+    python batch_runner.py queries.txt -o results.jsonl --parquet results.parquet
+
+Point ARXIV_API_URL, NCBI_EUTILS_URL and GENAI_LAB_BASE_URL (or the
+matching flags) at local stand-ins to run without the real services.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from src.arxiv_fetcher import ArxivLoader
+from src.pubmed_fetcher import PubMedLoader
+from src.insight_generator import insight_failed
+from src.insight_store import cached_paper_insight
+from src.query_refiner import refine_query
+from src.dedup import deduplicate_papers
+
+# --- Input Parsing ---
+def parse_input_line(line):
+    """Classifies an input line as a query or a source-prefixed ID"""
+    line = line.strip()
+    if not line or line.startswith("#"):
+        return None
+    prefix, _, value = line.partition(":")
+    if prefix.lower() == "arxiv" and value.strip():
+        return {"kind": "arxiv", "value": value.strip(), "raw": line}
+    if prefix.lower() == "pmid" and value.strip():
+        return {"kind": "pubmed", "value": value.strip(), "raw": line}
+    return {"kind": "query", "value": line, "raw": line}
+
+def paper_key(paper):
+    return f"{paper['source']}:{paper['id']}"
+
+def paper_text(paper):
+    # Same context the UIs send for a single paper
+    return f"Title: {paper['title']}\nAbstract: {paper['summary']}"
+
+# --- Checkpointing ---
+class JsonlCheckpoint:
+    """Append-only JSONL file; every record is flushed and fsynced before returning"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def load(self):
+        records = []
+        if not os.path.exists(self.path):
+            return records
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # A crash can leave one truncated trailing line
+                    continue
+        return records
+
+    def append(self, record):
+        line = json.dumps(record, ensure_ascii=False)
+        with self.lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+class ProgressTracker:
+    """Prints throughput and ETA as items complete"""
+
+    def __init__(self, total, label):
+        self.total = total
+        self.label = label
+        self.done = 0
+        self.failed = 0
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+
+    def update(self, ok=True):
+        with self.lock:
+            self.done += 1
+            if not ok:
+                self.failed += 1
+            elapsed = time.monotonic() - self.started
+            rate = self.done / elapsed if elapsed > 0 else 0.0
+            remaining = (self.total - self.done) / rate if rate > 0 else float("inf")
+            print(f"[{self.label}] {self.done}/{self.total} ({self.failed} failed) | "
+                  f"{rate:.2f} items/s | ETA {format_duration(remaining)}", flush=True)
+
+def format_duration(seconds):
+    if seconds == float("inf"):
+        return "--"
+    seconds = int(seconds)
+    hours, rem = divmod(seconds, 3600)
+    minutes, secs = divmod(rem, 60)
+    return f"{hours}h{minutes:02d}m{secs:02d}s" if hours else f"{minutes}m{secs:02d}s"
+
+# --- Pipeline Stages ---
+def resolve_item(item, arxiv_loader, pubmed_loader, limit, refine):
+    """
+    Turns one input line into a list of paper dicts. Loader errors are raised
+    (strict=True) so a failed line is not checkpointed as an empty result.
+    """
+    if item["kind"] == "arxiv":
+        return arxiv_loader.fetch_by_ids([item["value"]], strict=True)
+    if item["kind"] == "pubmed":
+        return pubmed_loader.fetch_by_ids([item["value"]], strict=True)
+
+    if not refine:
+        arxiv_query = pubmed_query = item["value"]
+    else:
+        refined = refine_query(item["value"])
+        arxiv_query, pubmed_query = refined.arxiv(), refined.pubmed()
+    return (arxiv_loader.fetch_papers(arxiv_query, limit=limit, strict=True)
+            + pubmed_loader.fetch_papers(pubmed_query, limit=limit, strict=True))
+
+def analyze_paper(paper):
+    started = time.monotonic()
+    # Served from the shared insight store when this exact input was analyzed before
+    insight, _ = cached_paper_insight(paper, paper_text(paper))
+    return insight, time.monotonic() - started
+
+def export_parquet(jsonl_path, parquet_path):
+    """Rewrites the JSONL results as a Parquet table with flattened insight fields"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        print("[ERROR] pyarrow is required for Parquet output (pip install pyarrow)")
+        return False
+
+    rows = []
+    for record in JsonlCheckpoint(jsonl_path).load():
+        row = {"key": record["key"], "elapsed_s": record.get("elapsed_s")}
+        row.update({f"paper_{k}": v if not isinstance(v, (list, dict)) else json.dumps(v)
+                    for k, v in record["paper"].items()})
+        row.update({f"insight_{k}": v for k, v in record["insight"].items()})
+        rows.append(row)
+    pq.write_table(pa.Table.from_pylist(rows), parquet_path)
+    print(f"[BATCH] Wrote {len(rows)} rows to {parquet_path}")
+    return True
+
+def run_batch(args):
+    with open(args.input, "r", encoding="utf-8") as f:
+        items = [item for item in map(parse_input_line, f) if item]
+
+    results = JsonlCheckpoint(args.output)
+    searches = JsonlCheckpoint(args.output + ".searches.jsonl")
+    errors = JsonlCheckpoint(args.output + ".errors.jsonl")
+
+    done_keys = {r["key"] for r in results.load()}
+    resolved = {r["raw"]: r["papers"] for r in searches.load()}
+    if done_keys or resolved:
+        print(f"[BATCH] Resuming: {len(resolved)} input lines and {len(done_keys)} papers already done")
+
+    arxiv_loader = ArxivLoader(base_url=args.arxiv_url)
+    pubmed_loader = PubMedLoader(base_url=args.eutils_url)
+
+    executor = ThreadPoolExecutor(max_workers=args.workers)
+    submitted = []
+    try:
+        # 1. Search / fetch every input line not already resolved
+        pending_items = [item for item in items if item["raw"] not in resolved]
+        fetch_failed = 0
+        if pending_items:
+            progress = ProgressTracker(len(pending_items), "FETCH")
+            futures = {executor.submit(resolve_item, item, arxiv_loader, pubmed_loader, args.limit, args.refine): item
+                       for item in pending_items}
+            submitted += futures
+            for future in as_completed(futures):
+                item = futures[future]
+                try:
+                    papers = future.result()
+                except Exception as e:
+                    # Not checkpointed: the next run retries this line
+                    print(f"[ERROR] Fetch failed for '{item['raw']}': {e}")
+                    progress.update(ok=False)
+                    fetch_failed += 1
+                    continue
+                searches.append({"raw": item["raw"], "papers": papers})
+                resolved[item["raw"]] = papers
+                progress.update()
+
+        # 2. Collapse duplicates across lines and sources, skip finished papers
+        all_papers = [p for item in items for p in resolved.get(item["raw"], [])]
+        unique_papers, removed = deduplicate_papers(all_papers)
+        todo = [p for p in unique_papers if paper_key(p) not in done_keys]
+        print(f"[BATCH] {len(unique_papers)} unique papers ({removed} duplicates merged), {len(todo)} to analyze")
+
+        # 3. Insight generation; each result is checkpointed by the worker that produced it
+        if todo:
+            progress = ProgressTracker(len(todo), "INSIGHT")
+
+            def work(paper):
+                insight, elapsed = analyze_paper(paper)
+                record = {"key": paper_key(paper), "paper": paper,
+                          "insight": insight.model_dump(), "elapsed_s": round(elapsed, 3)}
+                if insight_failed(insight):
+                    errors.append(record)
+                    progress.update(ok=False)
+                else:
+                    results.append(record)
+                    progress.update()
+
+            work_futures = [executor.submit(work, p) for p in todo]
+            submitted += work_futures
+            for future in as_completed(work_futures):
+                future.result()
+    except KeyboardInterrupt:
+        print("\n[BATCH] Interrupted - waiting for in-flight items to checkpoint. Re-run the same command to resume.")
+        # Drop queued work (shutdown's cancel_futures needs Python 3.9)
+        for future in submitted:
+            future.cancel()
+        executor.shutdown(wait=True)
+        return 130
+    executor.shutdown(wait=True)
+
+    if args.parquet:
+        export_parquet(args.output, args.parquet)
+    if fetch_failed:
+        print(f"[BATCH] {fetch_failed} input line(s) could not be fetched. Re-run the same command to retry them.")
+        return 1
+    return 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Batch literature analysis with checkpoint/resume.")
+    parser.add_argument("input", help="File with one query, arxiv:<id> or pmid:<id> per line")
+    parser.add_argument("-o", "--output", default="batch_results.jsonl", help="JSONL results / checkpoint file")
+    parser.add_argument("--parquet", help="Also export the results to this Parquet file when finished")
+    parser.add_argument("--workers", type=int, default=4, help="Concurrent fetch/insight workers")
+    parser.add_argument("--limit", type=int, default=10, help="Papers per source for each query")
+    parser.add_argument("--refine", action="store_true", help="Refine queries before searching (local vocabulary, LLM only when unsure)")
+    parser.add_argument("--arxiv-url", help="Override the arXiv API URL (e.g. a local stand-in)")
+    parser.add_argument("--eutils-url", help="Override the NCBI E-utilities base URL")
+    parser.add_argument("--llm-url", help="Override GENAI_LAB_BASE_URL for the LLM gateway")
+    args = parser.parse_args(argv)
+
+    if args.llm_url:
+        import src.llm_client as llm_client
+        llm_client.BASE_URL = args.llm_url
+
+    return run_batch(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,175 @@
+"""
+Concurrent-user load generator for the search -> analyze -> chat flow.
+
+Each simulated analyst runs the same code the UIs run: the job handlers from
+job_queue (query refinement, loaders, dedup and reranking, generate_paper_insight,
+the hierarchical compare_papers) followed by a chat turn through the model router.
+By default the stand-ins from benchmarks/stand_ins.py are started in-process,
+so no real gateway, NCBI or arXiv traffic is generated. The insight store,
+corpus and dedup index live in a temporary directory for the run, so results
+never leak into ./data and every run starts cold.
+
+Usage:
+    python -m benchmarks.load_test --users 20 --iterations 3 --llm-median 1.0 --rate-429 0.05
+    python -m benchmarks.load_test --users 20 --llm-capacity 6   # gateway that throttles above 6 in flight
+    python -m benchmarks.load_test --users 5 --no-stand-ins      # use whatever the env points at
+    python -m benchmarks.load_test --users 20 --pool 10 --top-n 5   # lighter searches than the UIs' defaults
+"""
+import os
+import sys
+import json
+import time
+import atexit
+import shutil
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.stand_ins import StandInConfig, start_stand_ins, stand_in_env
+
+STAGES = ("search", "insight", "compare", "chat", "flow")
+TOPICS = ["malaria vaccine efficacy in children", "seasonal malaria chemoprevention",
+          "R21 Matrix-M phase 3 trial", "antibody kinetics after CSP vaccination"]
+
+class StageRecorder:
+    def __init__(self):
+        self.durations = {stage: [] for stage in STAGES}
+        self.errors = {stage: 0 for stage in STAGES}
+        self.lock = threading.Lock()
+
+    def record(self, stage, seconds, ok=True):
+        with self.lock:
+            self.durations[stage].append(seconds)
+            if not ok:
+                self.errors[stage] += 1
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+def run_user(user_id, args, recorder):
+    """One analyst: search, analyze the top papers, compare, then ask a question"""
+    # Imported here so the environment set up by main() is already in place
+    from src.job_queue import search_job, insight_job, compare_job
+    from src.llm_router import routed_llm_response
+
+    noop_progress = lambda fraction, message=None: None
+    for iteration in range(args.iterations):
+        flow_started = time.perf_counter()
+        topic = TOPICS[(user_id + iteration) % len(TOPICS)]
+
+        started = time.perf_counter()
+        search = search_job({"query": topic, "pool": args.pool, "top_n": args.top_n}, noop_progress)
+        recorder.record("search", time.perf_counter() - started, ok=bool(search["papers"]))
+
+        combined_context, entries = "", []
+        for paper in search["papers"][:args.papers]:
+            started = time.perf_counter()
+            result = insight_job({"paper": paper}, noop_progress)
+            ok = result["insight"]["methodology_score"] != 0
+            recorder.record("insight", time.perf_counter() - started, ok=ok)
+            entries.append({"paper": paper, "text": result["text"], "insight": result["insight"]})
+            combined_context += f"\n\n=== PAPER: {paper['title']} ===\n{result['text']}\nAnalysis: {json.dumps(result['insight'])}"
+
+        if len(entries) > 1:
+            # Same job parameters as the UIs, so the hierarchical engine is what gets loaded
+            started = time.perf_counter()
+            comparison = compare_job({"papers": entries}, noop_progress)["comparison"]
+            recorder.record("compare", time.perf_counter() - started, ok=comparison["conclusion"] != "Error")
+
+        started = time.perf_counter()
+        answer = routed_llm_response([
+            {"role": "system", "content": "You are a research assistant. Answer the user's question based ONLY on the provided context."},
+            {"role": "user", "content": f"Context:\n{combined_context[:30000]}\n\nUser Question: What are the main findings?"}
+        ], "chat")
+        recorder.record("chat", time.perf_counter() - started, ok=answer is not None)
+
+        recorder.record("flow", time.perf_counter() - flow_started)
+        if args.think_time:
+            time.sleep(args.think_time)
+
+def build_report(recorder, elapsed, args):
+    report = {"users": args.users, "iterations": args.iterations, "pool": args.pool, "top_n": args.top_n,
+              "elapsed_s": round(elapsed, 3),
+              "flows_completed": len(recorder.durations["flow"]),
+              "throughput_flows_per_s": round(len(recorder.durations["flow"]) / elapsed, 3) if elapsed else None,
+              "stages": {}}
+    for stage in STAGES:
+        values = recorder.durations[stage]
+        report["stages"][stage] = {
+            "count": len(values), "errors": recorder.errors[stage],
+            "p50_s": round(percentile(values, 0.5), 4) if values else None,
+            "p95_s": round(percentile(values, 0.95), 4) if values else None,
+            "p99_s": round(percentile(values, 0.99), 4) if values else None,
+        }
+    return report
+
+def print_report(report):
+    print(f"\n[LOAD] {report['users']} users x {report['iterations']} iterations "
+          f"(search pool {report['pool']}, top {report['top_n']}) in {report['elapsed_s']}s "
+          f"-> {report['flows_completed']} flows, {report['throughput_flows_per_s']} flows/s")
+    print(f"  {'stage':<10}{'count':>7}{'errors':>8}{'p50 s':>10}{'p95 s':>10}{'p99 s':>10}")
+    for stage, row in report["stages"].items():
+        fmt = lambda v: f"{v:>10.3f}" if v is not None else f"{'-':>10}"
+        print(f"  {stage:<10}{row['count']:>7}{row['errors']:>8}{fmt(row['p50_s'])}{fmt(row['p95_s'])}{fmt(row['p99_s'])}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate N concurrent analysts against stand-in services.")
+    parser.add_argument("--users", type=int, default=10, help="Concurrent simulated users")
+    parser.add_argument("--iterations", type=int, default=2, help="Flows per user")
+    parser.add_argument("--papers", type=int, default=3, help="Papers analyzed per flow")
+    parser.add_argument("--pool", type=int, default=50, help="Candidates fetched per source per search (the UIs use RERANK_POOL)")
+    parser.add_argument("--top-n", type=int, default=10, help="Ranked results kept per search (the UIs use RERANK_TOP_N)")
+    parser.add_argument("--think-time", type=float, default=0.0, help="Pause between flows (s)")
+    parser.add_argument("--no-stand-ins", action="store_true", help="Do not start stand-ins; use the current env")
+    parser.add_argument("--llm-median", type=float, default=0.5)
+    parser.add_argument("--llm-sigma", type=float, default=0.4)
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--rate-5xx", type=float, default=0.0)
+    parser.add_argument("--api-latency", type=float, default=0.05)
+    parser.add_argument("--llm-capacity", type=int, help="Stand-in gateway answers 429 above this many concurrent calls")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="Write the report as JSON to this path")
+    args = parser.parse_args(argv)
+
+    # Local state goes to a throwaway directory; set before run_user imports the pipeline
+    state_dir = tempfile.mkdtemp(prefix="load_test_")
+    # Registered first, so it runs after the corpus store's own exit-time flush
+    atexit.register(shutil.rmtree, state_dir, ignore_errors=True)
+    os.environ.update({
+        "INSIGHT_DB_PATH": os.path.join(state_dir, "insight_store.db"),
+        "CORPUS_PATH": os.path.join(state_dir, "corpus"),
+        "DEDUP_INDEX_PATH": os.path.join(state_dir, "dedup_index.db"),
+    })
+
+    server = None
+    if not args.no_stand_ins:
+        config = StandInConfig(args.llm_median, args.llm_sigma, args.rate_429, args.rate_5xx, args.api_latency,
+                               seed=args.seed, llm_capacity=args.llm_capacity)
+        server, base_url = start_stand_ins(config=config)
+        os.environ.update(stand_in_env(base_url))
+        print(f"[LOAD] Stand-ins running on {base_url}")
+
+    recorder = StageRecorder()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.users) as pool:
+        futures = [pool.submit(run_user, i, args, recorder) for i in range(args.users)]
+        for future in futures:
+            future.result()
+    elapsed = time.perf_counter() - started
+
+    report = build_report(recorder, elapsed, args)
+    if server is not None:
+        report["stand_in_requests"] = dict(server.config.counts)
+        server.shutdown()
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,284 @@
+"""
+Offline benchmark suite for the fetchers and parsers.
+
+Replays recorded arXiv / PubMed / PMC / LLM responses from benchmarks/fixtures
+instead of calling the live services, and measures:
+  * parse throughput (entries/s, MB/s) and peak memory of the Atom / efetch parsers
+  * BioC JSON download + save throughput
+  * end-to-end fetch_papers latency with a simulated network delay per request
+  * clean_json_string and PaperInsight validation throughput
+
+Usage (from the project root):
+    python -m benchmarks.run_benchmarks --output benchmarks/baselines/current.json
+    python -m benchmarks.run_benchmarks --baseline benchmarks/baselines/main.json --tolerance 0.2
+    python -m benchmarks.run_benchmarks --record "malaria vaccine"   # refresh fixtures from the live APIs
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import statistics
+from unittest import mock
+
+import requests
+
+# Fixture papers must not land in the real ./data/corpus (nor time its lazy setup);
+# set before the loaders import corpus_store, which reads it once
+os.environ["CORPUS_ENABLED"] = "0"
+
+from src.arxiv_fetcher import ArxivLoader
+from src.pubmed_fetcher import PubMedLoader
+from src.insight_generator import PaperInsight, clean_json_string
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+# URL fragment -> (fixture file, content type)
+ROUTES = [
+    ("esearch.fcgi", "pubmed_esearch.json", "application/json"),
+    ("esummary.fcgi", "pubmed_esummary.json", "application/json"),
+    ("efetch.fcgi", "pubmed_efetch.xml", "text/xml"),
+    ("BioC_json", "bioc_PMC10098765.json", "application/json"),
+    ("oa.fcgi", "pmc_oa.xml", "text/xml"),
+    (".pdf", None, "application/pdf"),
+    ("chat/completions", "llm_chat_completion.json", "application/json"),
+    ("arxiv.org/api/query", "arxiv_query.xml", "application/atom+xml"),
+]
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURE_DIR, name), "rb") as f:
+        return f.read()
+
+# --- Replay Transport ---
+class FixtureReplay:
+    """Patches requests.get/post to serve fixtures, optionally sleeping to simulate the network"""
+
+    def __init__(self, delay=0.0, overrides=None):
+        self.delay = delay
+        self.overrides = overrides or {}
+        self.calls = 0
+        self._patches = []
+
+    def _respond(self, url, **kwargs):
+        self.calls += 1
+        if self.delay:
+            time.sleep(self.delay)
+        for fragment, fixture, content_type in ROUTES:
+            if fragment in url:
+                body = self.overrides.get(fixture) if fixture in self.overrides else (
+                    load_fixture(fixture) if fixture else b"%PDF-1.4\n%bench\n")
+                response = requests.models.Response()
+                response.status_code = 200
+                response._content = body
+                response.headers["Content-Type"] = content_type
+                response.encoding = "utf-8"
+                response.url = url
+                return response
+        raise requests.exceptions.ConnectionError(f"No fixture recorded for {url}")
+
+    def get(self, url, params=None, **kwargs):
+        return self._respond(url)
+
+    def post(self, url, json=None, **kwargs):
+        return self._respond(url)
+
+    def __enter__(self):
+        self._patches = [mock.patch.object(requests, "get", self.get), mock.patch.object(requests, "post", self.post)]
+        for p in self._patches:
+            p.start()
+        return self
+
+    def __exit__(self, *exc):
+        for p in self._patches:
+            p.stop()
+        return False
+
+def amplify(xml_bytes, tag, copies):
+    """Repeats every <tag>...</tag> block so parsers see a realistically large payload"""
+    text = xml_bytes.decode("utf-8")
+    blocks = re.findall(rf"<{tag}[\s>].*?</{tag}>", text, flags=re.S)
+    first = text.find(blocks[0])
+    last = text.rfind(blocks[-1]) + len(blocks[-1])
+    return (text[:first] + "\n".join(blocks) * copies + text[last:]).encode("utf-8")
+
+# --- Measurement Helpers ---
+def timed_runs(func, repeat):
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - started)
+    return durations
+
+def peak_memory_mb(func):
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return round(peak / (1024 * 1024), 3)
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+# --- Benchmarks ---
+def bench_arxiv_parse(args):
+    payload = amplify(load_fixture("arxiv_query.xml"), "entry", args.copies)
+    loader = ArxivLoader()
+    entries = len(loader._parse_xml_response(payload))
+    durations = timed_runs(lambda: loader._parse_xml_response(payload), args.repeat)
+    best = min(durations)
+    return {"entries": entries, "entries_per_s": round(entries / best, 1),
+            "mb_per_s": round(len(payload) / best / 1e6, 2),
+            "peak_mem_mb": peak_memory_mb(lambda: loader._parse_xml_response(payload))}
+
+def bench_pubmed_efetch_parse(args):
+    payload = amplify(load_fixture("pubmed_efetch.xml"), "PubmedArticle", args.copies)
+    loader = PubMedLoader()
+    with FixtureReplay(overrides={"pubmed_efetch.xml": payload}):
+        entries = len(loader._fetch_abstracts(["0"]))
+        durations = timed_runs(lambda: loader._fetch_abstracts(["0"]), args.repeat)
+        peak = peak_memory_mb(lambda: loader._fetch_abstracts(["0"]))
+    best = min(durations)
+    # Duplicated PMIDs collapse in the result dict, so count articles in the payload
+    articles = payload.count(b"<PubmedArticle>")
+    return {"entries": articles, "unique_pmids": entries, "entries_per_s": round(articles / best, 1),
+            "mb_per_s": round(len(payload) / best / 1e6, 2), "peak_mem_mb": peak}
+
+def bench_bioc_download(args):
+    try:
+        from src.compliance_fetcher import NCBILoader
+    except ImportError as e:
+        return {"skipped": f"NCBILoader unavailable ({e})"}
+    payload = load_fixture("bioc_PMC10098765.json")
+    with tempfile.TemporaryDirectory() as tmp, FixtureReplay():
+        loader = NCBILoader(data_dir=tmp)
+        durations = timed_runs(lambda: loader._get_bioc_json("10098765"), args.repeat)
+        peak = peak_memory_mb(lambda: loader._get_bioc_json("10098765"))
+    best = min(durations)
+    return {"docs_per_s": round(1 / best, 1), "mb_per_s": round(len(payload) / best / 1e6, 2), "peak_mem_mb": peak}
+
+def bench_fetch_papers_e2e(args):
+    results = {}
+    for name, loader in (("arxiv", ArxivLoader()), ("pubmed", PubMedLoader())):
+        with FixtureReplay(delay=args.delay) as replay:
+            durations = timed_runs(lambda: loader.fetch_papers("malaria vaccine", limit=3), args.e2e_repeat)
+            calls = replay.calls // args.e2e_repeat
+        results[f"{name}_requests"] = calls
+        results[f"{name}_p50_s"] = round(statistics.median(durations), 4)
+        results[f"{name}_p95_s"] = round(percentile(durations, 0.95), 4)
+    results["simulated_delay_s"] = args.delay
+    return results
+
+def bench_insight_json(args):
+    raw = json.loads(load_fixture("llm_chat_completion.json"))["choices"][0]["message"]["content"]
+    n = args.repeat * 500
+    started = time.perf_counter()
+    for _ in range(n):
+        cleaned = clean_json_string(raw)
+    clean_s = time.perf_counter() - started
+    started = time.perf_counter()
+    for _ in range(n):
+        PaperInsight.model_validate_json(cleaned)
+    validate_s = time.perf_counter() - started
+    return {"clean_per_s": round(n / clean_s, 1), "validate_per_s": round(n / validate_s, 1),
+            "peak_mem_mb": peak_memory_mb(lambda: [PaperInsight.model_validate_json(clean_json_string(raw)) for _ in range(500)])}
+
+BENCHMARKS = {
+    "arxiv_parse": bench_arxiv_parse,
+    "pubmed_efetch_parse": bench_pubmed_efetch_parse,
+    "bioc_download": bench_bioc_download,
+    "fetch_papers_e2e": bench_fetch_papers_e2e,
+    "insight_json": bench_insight_json,
+}
+
+# --- Baselines ---
+def higher_is_better(metric):
+    return metric.endswith("_per_s")
+
+def compare_to_baseline(current, baseline, tolerance):
+    """Returns a list of regression descriptions (empty when within tolerance)"""
+    regressions = []
+    for bench, metrics in current["results"].items():
+        base = baseline.get("results", {}).get(bench, {})
+        for metric, value in metrics.items():
+            old = base.get(metric)
+            if not isinstance(value, (int, float)) or not isinstance(old, (int, float)) or not old:
+                continue
+            if not (higher_is_better(metric) or metric.endswith("_s") or metric.endswith("_mb")):
+                continue
+            change = (value - old) / old
+            worse = -change if higher_is_better(metric) else change
+            marker = "REGRESSION" if worse > tolerance else "ok"
+            print(f"  {bench}.{metric}: {old} -> {value} ({change:+.1%}) {marker}")
+            if worse > tolerance:
+                regressions.append(f"{bench}.{metric} {change:+.1%}")
+    return regressions
+
+def record_fixtures(query):
+    """Refreshes the fixtures from the live APIs (network required)"""
+    eutils = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils"
+    r = requests.get("http://export.arxiv.org/api/query", params={"search_query": f"all:{query}", "max_results": 3}, verify=False)
+    open(os.path.join(FIXTURE_DIR, "arxiv_query.xml"), "wb").write(r.content)
+    r = requests.get(f"{eutils}/esearch.fcgi", params={"db": "pubmed", "term": query, "retmode": "json", "retmax": 3}, verify=False)
+    open(os.path.join(FIXTURE_DIR, "pubmed_esearch.json"), "wb").write(r.content)
+    ids = ",".join(r.json()["esearchresult"]["idlist"])
+    r = requests.get(f"{eutils}/esummary.fcgi", params={"db": "pubmed", "id": ids, "retmode": "json"}, verify=False)
+    open(os.path.join(FIXTURE_DIR, "pubmed_esummary.json"), "wb").write(r.content)
+    r = requests.get(f"{eutils}/efetch.fcgi", params={"db": "pubmed", "id": ids, "rettype": "abstract", "retmode": "xml"}, verify=False)
+    open(os.path.join(FIXTURE_DIR, "pubmed_efetch.xml"), "wb").write(r.content)
+    print(f"[BENCH] Recorded fixtures for '{query}' into {FIXTURE_DIR}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline fetcher/parser benchmarks.")
+    parser.add_argument("--only", nargs="*", choices=sorted(BENCHMARKS), help="Run a subset of benchmarks")
+    parser.add_argument("--repeat", type=int, default=5, help="Repetitions for throughput benchmarks")
+    parser.add_argument("--copies", type=int, default=300, help="Payload amplification for parse benchmarks")
+    parser.add_argument("--delay", type=float, default=0.05, help="Simulated network delay per request (s)")
+    parser.add_argument("--e2e-repeat", type=int, default=10, help="Repetitions for end-to-end latency")
+    parser.add_argument("--output", help="Write results as a JSON baseline to this path")
+    parser.add_argument("--baseline", help="Compare against a previously saved baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative regression (0.2 = 20%%)")
+    parser.add_argument("--record", metavar="QUERY", help="Re-record fixtures from the live APIs and exit")
+    args = parser.parse_args(argv)
+
+    if args.record:
+        record_fixtures(args.record)
+        return 0
+
+    results = {}
+    for name in args.only or BENCHMARKS:
+        print(f"[BENCH] {name} ...", flush=True)
+        results[name] = BENCHMARKS[name](args)
+        print(f"        {results[name]}")
+
+    report = {
+        "meta": {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+                 "platform": platform.platform(), "args": {k: v for k, v in vars(args).items() if k != "record"}},
+        "results": results,
+    }
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"[BENCH] Saved results to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(f"[BENCH] Comparing against {args.baseline} (tolerance {args.tolerance:.0%})")
+        regressions = compare_to_baseline(report, baseline, args.tolerance)
+        if regressions:
+            print(f"[BENCH] {len(regressions)} regression(s): {', '.join(regressions)}")
+            return 1
+        print("[BENCH] No regressions.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
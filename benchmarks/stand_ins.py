@@ -0,0 +1,286 @@
+"""
+Local stand-ins for the GenAI Lab gateway, NCBI E-utilities/BioC/OA and arXiv.
+
+One threaded HTTP server answers:
+    POST /v1/chat/completions                      OpenAI-compatible (JSON or SSE streaming)
+    POST /v1/embeddings                            hashed bag-of-words vectors (EMBEDDING_DIM)
+    GET  /entrez/eutils/{esearch,esummary,efetch}.fcgi
+    GET  /research/bionlp/RESTful/pmcoa.cgi/BioC_json/<id>/unicode
+    GET  /pmc/utils/oa/oa.fcgi
+    GET  /api/query                                arXiv Atom
+
+LLM latency is drawn from a log-normal distribution, and a configurable
+fraction of requests fail with 429 or 5xx. With llm_capacity set, requests
+beyond that many in flight are answered with 429, like a throttling gateway. JSON-mode requests get a canned
+PaperInsight or ComparisonInsight payload. Responses for the literature APIs
+come from benchmarks/fixtures.
+
+Usage:
+    python -m benchmarks.stand_ins --port 8900 --llm-median 1.2 --rate-429 0.05
+and point the app at it with the environment variables printed on startup.
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+EMBEDDING_DIM = 256
+
+CANNED_COMPARISON = {
+    "title": "Comparison of malaria vaccine studies",
+    "hypothesis": "Seasonally targeted malaria vaccination improves protection against clinical malaria.",
+    "methodology": "One randomised phase 3 trial compared with an observational cohort and a mixed-methods survey.",
+    "tabular_data": "| Study | Design | N | Effect |\n|---|---|---|---|\n| Trial | RCT | 4800 | 75% efficacy |\n| Cohort | Cohort | 2310 | IRR 0.59 |",
+    "conclusion": "Evidence consistently favours seasonal delivery, with dose completion as the main barrier.",
+    "key_findings": ["Efficacy is highest with seasonal delivery", "Fourth-dose dropout limits impact"],
+}
+
+CANNED_FACETS = {
+    "study_design": "Randomised controlled trial",
+    "population": "Children 5-17 months in seasonal transmission areas",
+    "sample_size": "4800",
+    "intervention": "R21/Matrix-M, seasonal administration",
+    "comparator": "Rabies control vaccine",
+    "endpoints": ["Clinical malaria incidence"],
+    "effect_sizes": ["Efficacy 75% (95% CI 71-79)"],
+}
+CANNED_SYNTHESIS = {key: CANNED_COMPARISON[key] for key in ("hypothesis", "methodology", "conclusion", "key_findings")}
+
+def _load(name):
+    with open(os.path.join(FIXTURE_DIR, name), "rb") as f:
+        return f.read()
+
+class StandInConfig:
+    def __init__(self, llm_median=0.8, llm_sigma=0.4, rate_429=0.0, rate_5xx=0.0,
+                 api_latency=0.05, stream_chunk_delay=0.02, seed=None, llm_capacity=None):
+        self.llm_median = llm_median
+        self.llm_sigma = llm_sigma
+        self.rate_429 = rate_429
+        self.rate_5xx = rate_5xx
+        self.api_latency = api_latency
+        self.stream_chunk_delay = stream_chunk_delay
+        self.llm_capacity = llm_capacity
+        self.llm_in_flight = 0
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.insight = json.loads(json.loads(_load("llm_chat_completion.json"))["choices"][0]["message"]["content"]
+                                  .replace("```json", "").replace("```", ""))
+        self.counts = {}
+
+    def llm_delay(self):
+        with self.lock:
+            return self.random.lognormvariate(0, self.llm_sigma) * self.llm_median
+
+    def roll_failure(self):
+        with self.lock:
+            roll = self.random.random()
+        if roll < self.rate_429:
+            return 429
+        if roll < self.rate_429 + self.rate_5xx:
+            return 503
+        return None
+
+    def enter_llm(self):
+        """False when the simulated gateway is at capacity"""
+        with self.lock:
+            if self.llm_capacity and self.llm_in_flight >= self.llm_capacity:
+                return False
+            self.llm_in_flight += 1
+            return True
+
+    def exit_llm(self):
+        with self.lock:
+            self.llm_in_flight -= 1
+
+    def count(self, key):
+        with self.lock:
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+def stand_in_embedding(text, dim=EMBEDDING_DIM):
+    """Deterministic hashed bag-of-words vector: texts sharing words get similar vectors"""
+    vector = [0.0] * dim
+    for word in re.findall(r"\w+", text.lower()):
+        digest = hashlib.md5(word.encode("utf-8")).digest()
+        vector[int.from_bytes(digest[:4], "little") % dim] += 1.0 if digest[4] & 1 else -1.0
+    return vector
+
+def make_handler(config):
+    class StandInHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status, body, content_type="application/json", headers=None):
+            if isinstance(body, str):
+                body = body.encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(body)
+
+        # --- Literature APIs ---
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            config.count(url.path)
+            time.sleep(config.api_latency)
+
+            if url.path.endswith("/esearch.fcgi"):
+                data = json.loads(_load("pubmed_esearch.json"))
+                if query.get("db", ["pubmed"])[0] == "pmc":
+                    data["esearchresult"]["idlist"] = ["10098765"]
+                retmax = int(query.get("retmax", ["20"])[0])
+                data["esearchresult"]["idlist"] = data["esearchresult"]["idlist"][:retmax]
+                return self._send(200, json.dumps(data))
+            if url.path.endswith("/esummary.fcgi"):
+                return self._send(200, _load("pubmed_esummary.json"))
+            if url.path.endswith("/efetch.fcgi"):
+                return self._send(200, _load("pubmed_efetch.xml"), "text/xml")
+            if "/BioC_json/" in url.path:
+                return self._send(200, _load("bioc_PMC10098765.json"))
+            if url.path.endswith("/oa.fcgi"):
+                return self._send(200, _load("pmc_oa.xml"), "text/xml")
+            if url.path.endswith(".pdf"):
+                return self._send(200, b"%PDF-1.4\n%stand-in\n", "application/pdf")
+            if url.path.endswith("/api/query"):
+                return self._send(200, _load("arxiv_query.xml"), "application/atom+xml")
+            self._send(404, json.dumps({"error": f"No stand-in for {url.path}"}))
+
+        # --- OpenAI-compatible gateway ---
+        def do_POST(self):
+            url = urlparse(self.path)
+            length = int(self.headers.get("Content-Length", 0))
+            payload = json.loads(self.rfile.read(length) or b"{}")
+            if url.path.endswith("/embeddings"):
+                config.count(url.path)
+                time.sleep(config.api_latency)
+                inputs = payload.get("input", [])
+                inputs = [inputs] if isinstance(inputs, str) else inputs
+                return self._send(200, json.dumps({
+                    "object": "list", "model": payload.get("model", "stand-in"),
+                    "data": [{"object": "embedding", "index": i, "embedding": stand_in_embedding(text)}
+                             for i, text in enumerate(inputs)],
+                }))
+            if not url.path.endswith("/chat/completions"):
+                return self._send(404, json.dumps({"error": "not found"}))
+            config.count(url.path)
+
+            if not config.enter_llm():
+                config.count("capacity_429")
+                return self._send(429, json.dumps({"error": {"message": "Too many concurrent requests", "type": "rate_limit"}}),
+                                  headers={"Retry-After": "1"})
+            try:
+                time.sleep(config.llm_delay())
+            finally:
+                config.exit_llm()
+            failure = config.roll_failure()
+            if failure == 429:
+                return self._send(429, json.dumps({"error": {"message": "Rate limit exceeded", "type": "rate_limit"}}),
+                                  headers={"Retry-After": "1"})
+            if failure:
+                return self._send(failure, json.dumps({"error": {"message": "Upstream unavailable"}}))
+
+            content = self._completion_text(payload)
+            model = payload.get("model", "stand-in")
+            if payload.get("stream"):
+                return self._stream(model, content)
+            self._send(200, json.dumps({
+                "id": f"chatcmpl-{random.getrandbits(40):x}", "object": "chat.completion",
+                "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+                "usage": {"prompt_tokens": sum(len(str(m.get("content", ""))) for m in payload.get("messages", [])) // 4,
+                          "completion_tokens": len(content) // 4},
+            }))
+
+        def _completion_text(self, payload):
+            messages = payload.get("messages", [])
+            system = " ".join(str(m.get("content", "")) for m in messages if m.get("role") == "system")
+            if payload.get("response_format", {}).get("type") == "json_object":
+                if "effect_sizes" in system:
+                    return json.dumps(CANNED_FACETS)
+                if "tabular_data" in system:
+                    return json.dumps(CANNED_COMPARISON)
+                return json.dumps(CANNED_SYNTHESIS if "hypothesis" in system else config.insight)
+            if "Search Optimizer" in system:
+                user = next((m["content"] for m in reversed(messages) if m.get("role") == "user"), "")
+                return " ".join(w for w in str(user).split() if len(w) > 3)[:200] or "malaria vaccine"
+            return "Based on the provided context, the studies report consistent protective effects of seasonal vaccination."
+
+        def _stream(self, model, content):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            words = content.split(" ")
+            for i, word in enumerate(words):
+                delta = {"content": word + (" " if i < len(words) - 1 else "")}
+                chunk = {"object": "chat.completion.chunk", "model": model,
+                         "choices": [{"index": 0, "delta": delta, "finish_reason": None}]}
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+                time.sleep(config.stream_chunk_delay)
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+            self.close_connection = True
+
+    return StandInHandler
+
+def start_stand_ins(host="127.0.0.1", port=0, config=None):
+    """Starts the stand-in server on a background thread; returns (server, base_url)"""
+    config = config or StandInConfig()
+    server = ThreadingHTTPServer((host, port), make_handler(config))
+    server.daemon_threads = True
+    server.config = config
+    threading.Thread(target=server.serve_forever, name="stand-ins", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+def stand_in_env(base_url):
+    """Environment variables that point the loaders and llm_client at the stand-ins"""
+    return {
+        "GENAI_LAB_BASE_URL": base_url,
+        "GENAI_LAB_API_KEY": "stand-in",
+        "NCBI_EUTILS_URL": f"{base_url}/entrez/eutils",
+        "ARXIV_API_URL": f"{base_url}/api/query",
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local stand-ins for the GenAI gateway, NCBI and arXiv.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--llm-median", type=float, default=0.8, help="Median LLM latency in seconds")
+    parser.add_argument("--llm-sigma", type=float, default=0.4, help="Log-normal sigma of LLM latency")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="Fraction of LLM calls answered with 429")
+    parser.add_argument("--rate-5xx", type=float, default=0.0, help="Fraction of LLM calls answered with 503")
+    parser.add_argument("--api-latency", type=float, default=0.05, help="Latency of NCBI/arXiv responses (s)")
+    parser.add_argument("--llm-capacity", type=int, help="Concurrent LLM calls before answering 429")
+    parser.add_argument("--seed", type=int, help="Random seed for reproducible latency/failures")
+    args = parser.parse_args(argv)
+
+    config = StandInConfig(args.llm_median, args.llm_sigma, args.rate_429, args.rate_5xx, args.api_latency,
+                           seed=args.seed, llm_capacity=args.llm_capacity)
+    server, base_url = start_stand_ins(args.host, args.port, config)
+    print(f"[STAND-IN] Serving on {base_url}")
+    for key, value in stand_in_env(base_url).items():
+        print(f"  {key}={value}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
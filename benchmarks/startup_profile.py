@@ -0,0 +1,116 @@
+"""
+Cold-start import profile for the app entry points.
+
+Imports each target in a fresh interpreter under `python -X importtime`
+(best of --runs), reports the total and the slowest modules by cumulative
+time, and fails when a target exceeds --budget-ms or regresses against a
+saved baseline (same JSON layout and tolerance rule as run_benchmarks).
+
+Usage (from the project root):
+    python -m benchmarks.startup_profile
+    python -m benchmarks.startup_profile src.app2 src.insight_generator --top 15
+    python -m benchmarks.startup_profile --output benchmarks/baselines/startup.json
+    python -m benchmarks.startup_profile --baseline benchmarks/baselines/startup.json --tolerance 0.2 --budget-ms 1500
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+
+from benchmarks.run_benchmarks import compare_to_baseline
+
+DEFAULT_TARGETS = ["src.app", "src.app2", "src.insight_generator", "src.job_queue"]
+IMPORTTIME_RE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+def profile_import(module, cwd=None):
+    """(total_s, {module: (self_s, cumulative_s)}) for one cold import, or (None, error text)"""
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                          capture_output=True, text=True, cwd=cwd)
+    modules, total = {}, None
+    for line in proc.stderr.splitlines():
+        match = IMPORTTIME_RE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, name = match.groups()
+        modules[name] = (int(self_us) / 1e6, int(cumulative_us) / 1e6)
+        if len(indent) == 1:
+            # A top-level line closes an import tree; keep only the target's, not interpreter startup
+            if name == module:
+                total = int(cumulative_us) / 1e6
+                break
+            modules = {}
+    if proc.returncode != 0:
+        last = proc.stderr.strip().splitlines()[-1:] or ["unknown error"]
+        return None, last[0]
+    return total, modules
+
+def profile_target(module, runs, cwd=None):
+    """Best of `runs` cold imports (the minimum filters out scheduler noise)"""
+    best = None
+    for _ in range(runs):
+        total, modules = profile_import(module, cwd)
+        if total is None:
+            return None, modules
+        if best is None or total < best[0]:
+            best = (total, modules)
+    return best
+
+def print_report(module, total, modules, top):
+    print(f"\n[STARTUP] {module}: {total * 1000:.0f} ms")
+    slowest = sorted(modules.items(), key=lambda kv: kv[1][1], reverse=True)
+    print(f"  {'cumulative':>10}  {'self':>8}  module")
+    for name, (self_s, cumulative_s) in [kv for kv in slowest if kv[0] != module][:top]:
+        print(f"  {cumulative_s * 1000:8.1f}ms  {self_s * 1000:6.1f}ms  {name}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Profile cold-start import time of the entry points.")
+    parser.add_argument("targets", nargs="*", default=DEFAULT_TARGETS, help="Modules to import")
+    parser.add_argument("--runs", type=int, default=3, help="Cold imports per target (best is kept)")
+    parser.add_argument("--top", type=int, default=10, help="Slowest modules to list per target")
+    parser.add_argument("--budget-ms", type=float, help="Fail when any target takes longer than this")
+    parser.add_argument("--output", help="Write results as a JSON baseline to this path")
+    parser.add_argument("--baseline", help="Compare against a previously saved baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative regression (0.2 = 20%%)")
+    args = parser.parse_args(argv)
+
+    results, failures = {}, []
+    for module in args.targets:
+        total, modules = profile_target(module, args.runs)
+        if total is None:
+            print(f"\n[STARTUP] {module}: import failed ({modules})")
+            failures.append(f"{module} import failed")
+            continue
+        print_report(module, total, modules, args.top)
+        results[module] = {"import_s": round(total, 4)}
+        if args.budget_ms and total * 1000 > args.budget_ms:
+            failures.append(f"{module} {total * 1000:.0f} ms > budget {args.budget_ms:.0f} ms")
+
+    report = {
+        "meta": {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+                 "platform": platform.platform(), "args": vars(args)},
+        "results": results,
+    }
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\n[STARTUP] Saved results to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(f"\n[STARTUP] Comparing against {args.baseline} (tolerance {args.tolerance:.0%})")
+        failures += compare_to_baseline(report, baseline, args.tolerance)
+
+    if failures:
+        print(f"\n[STARTUP] {len(failures)} problem(s): {', '.join(failures)}")
+        return 1
+    print("\n[STARTUP] Within budget.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,198 @@
+"""
+Disk-backed blob store for per-session artifacts (uploaded PDFs, document text).
+
+Session state keeps only small BlobHandles; the bytes live in files under
+BLOB_DIR/<session id>/ and are read back lazily through mmap. Each session has
+a byte quota and evicts its least recently used blobs when a write would exceed
+it, so server memory tracks the number of sessions, not what they uploaded.
+Pinned blobs (text that session state still refers to) are never evicted; a
+write that only fits by evicting one is refused instead. Session directories
+idle for longer than BLOB_SESSION_TTL are swept.
+"""
+import os
+import re
+import mmap
+import time
+import uuid
+import shutil
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from src.metrics import registry
+
+# --- Configuration ---
+BLOB_DIR = os.getenv("BLOB_DIR", "./data/blobs")
+BLOB_SESSION_QUOTA_MB = float(os.getenv("BLOB_SESSION_QUOTA_MB", "512"))
+BLOB_SESSION_TTL = float(os.getenv("BLOB_SESSION_TTL", str(24 * 3600)))  # seconds idle before a sweep
+
+SAFE_NAME_RE = re.compile(r"[^A-Za-z0-9._-]+")
+
+class BlobHandle:
+    """What session state holds instead of the bytes"""
+
+    __slots__ = ("key", "name", "kind", "size")
+
+    def __init__(self, key, name, kind, size):
+        self.key = key
+        self.name = name
+        self.kind = kind   # "pdf", "text", ...
+        self.size = size
+
+    def __repr__(self):
+        return f"BlobHandle({self.name!r}, {self.kind}, {self.size} bytes)"
+
+class SessionBlobStore:
+    def __init__(self, session_id=None, root=BLOB_DIR, quota_bytes=BLOB_SESSION_QUOTA_MB * 1024 * 1024):
+        self.session_id = session_id or uuid.uuid4().hex
+        self.dir = os.path.join(root, self.session_id)
+        self.quota = quota_bytes
+        self.index = OrderedDict()   # key -> BlobHandle, least recently used first
+        self.pinned = set()          # keys that are never evicted
+        self.used = 0
+        self.lock = threading.Lock()
+        os.makedirs(self.dir, exist_ok=True)
+
+    def path(self, handle):
+        return os.path.join(self.dir, handle.key)
+
+    def __contains__(self, handle):
+        return handle is not None and handle.key in self.index
+
+    # --- Writes ---
+    def put_bytes(self, data, name, kind="bin", pin=False):
+        """
+        Stores a bytes-like object (memoryview/getbuffer() avoid a copy); returns
+        a handle, or None if it does not fit. pin=True keeps it until delete().
+        """
+        key = f"{uuid.uuid4().hex[:12]}-{SAFE_NAME_RE.sub('_', name)[-80:]}"
+        handle = BlobHandle(key, name, kind, len(data))
+        if handle.size > self.quota:
+            print(f"[WARN] Blob '{name}' ({handle.size} bytes) exceeds the session quota; not stored")
+            return None
+        with self.lock:
+            if not self._evict_for(handle.size):
+                print(f"[WARN] Blob '{name}' does not fit next to the session's pinned blobs; not stored")
+                return None
+            tmp = os.path.join(self.dir, f".{key}.tmp")
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, os.path.join(self.dir, key))
+            self.index[key] = handle
+            self.used += handle.size
+            if pin:
+                self.pinned.add(key)
+        registry.inc("blob_bytes_written", handle.size, kind=kind)
+        return handle
+
+    def put_text(self, text, name, kind="text", pin=False):
+        return self.put_bytes(text.encode("utf-8"), name, kind, pin)
+
+    def _evict_for(self, incoming):
+        """Drops least recently used unpinned blobs until `incoming` fits; False if it cannot (lock held)"""
+        pinned_bytes = sum(self.index[k].size for k in self.pinned)
+        if pinned_bytes + incoming > self.quota:
+            return False
+        for key in list(self.index):
+            if self.used + incoming <= self.quota:
+                break
+            if key in self.pinned:
+                continue
+            handle = self.index.pop(key)
+            self.used -= handle.size
+            try:
+                os.remove(os.path.join(self.dir, key))
+            except OSError:
+                pass
+            registry.inc("blob_evictions", kind=handle.kind)
+        return True
+
+    # --- Reads ---
+    def _touch(self, handle):
+        with self.lock:
+            if handle is None or handle.key not in self.index:
+                return False
+            self.index.move_to_end(handle.key)
+            return True
+
+    @contextmanager
+    def view(self, handle):
+        """
+        Read-only memoryview over the blob (mmap, nothing copied); None if it was
+        evicted. The view is only valid inside the with block.
+        """
+        if not self._touch(handle):
+            yield None
+            return
+        if handle.size == 0:
+            yield memoryview(b"")
+            return
+        try:
+            f = open(self.path(handle), "rb")
+        except FileNotFoundError:
+            # Removed behind our back (an idle sweep); forget it
+            self.delete(handle)
+            yield None
+            return
+        with f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            view = memoryview(mm)
+            try:
+                yield view
+            finally:
+                view.release()
+
+    def read_bytes(self, handle):
+        with self.view(handle) as view:
+            return None if view is None else bytes(view)
+
+    def read_text(self, handle):
+        with self.view(handle) as view:
+            return None if view is None else str(view, "utf-8")
+
+    # --- Lifecycle ---
+    def delete(self, handle):
+        with self.lock:
+            if handle is not None and self.index.pop(handle.key, None) is not None:
+                self.used -= handle.size
+                self.pinned.discard(handle.key)
+                try:
+                    os.remove(self.path(handle))
+                except OSError:
+                    pass
+
+    def clear(self):
+        with self.lock:
+            shutil.rmtree(self.dir, ignore_errors=True)
+            os.makedirs(self.dir, exist_ok=True)
+            self.index.clear()
+            self.pinned.clear()
+            self.used = 0
+
+    def touch_session(self):
+        """Marks the session as active for the idle sweep; recreates the directory if a sweep removed it"""
+        try:
+            os.utime(self.dir)
+        except FileNotFoundError:
+            print(f"[WARN] Blob directory of session {self.session_id} was swept; its blobs are gone")
+            with self.lock:
+                os.makedirs(self.dir, exist_ok=True)
+                self.index.clear()
+                self.pinned.clear()
+                self.used = 0
+
+    def usage(self):
+        return {"blobs": len(self.index), "pinned": len(self.pinned), "bytes": self.used, "quota": int(self.quota)}
+
+def sweep_stale_sessions(root=BLOB_DIR, ttl=BLOB_SESSION_TTL):
+    """Removes session directories idle for longer than ttl seconds; returns how many"""
+    if not os.path.isdir(root):
+        return 0
+    removed, cutoff = 0, time.time() - ttl
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        try:
+            if os.path.isdir(path) and os.path.getmtime(path) < cutoff:
+                shutil.rmtree(path, ignore_errors=True)
+                removed += 1
+        except OSError:
+            continue
+    return removed
@@ -0,0 +1,127 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from src.llm_router import routed_llm_response
+from src.metrics import span
+
+# --- Configuration ---
+CHAT_KEEP_TURNS = int(os.getenv("CHAT_KEEP_TURNS", "4"))                       # exchanges kept verbatim
+CHAT_HISTORY_TOKEN_BUDGET = int(os.getenv("CHAT_HISTORY_TOKEN_BUDGET", "2000"))  # history tokens per prompt
+CHAT_SUMMARY_TOKEN_BUDGET = int(os.getenv("CHAT_SUMMARY_TOKEN_BUDGET", "400"))
+
+SUMMARY_SYSTEM_PROMPT = (
+    "You maintain a running summary of a conversation between a researcher and an assistant about "
+    "scientific papers. Merge the new exchanges into the existing summary. Keep the questions asked, "
+    "the answers' key facts and numbers, and any preferences the user stated. "
+    "Return only the updated summary, at most {words} words."
+)
+
+# Summaries never block a chat answer; they run here and land before a later turn
+_summary_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="chat-summary")
+
+def estimate_tokens(text):
+    """Rough token count (about 4 characters per token) without a tokenizer dependency"""
+    return len(text) // 4 + 1
+
+def truncate_to_tokens(text, tokens):
+    limit = tokens * 4
+    return text if len(text) <= limit else text[:limit] + " …"
+
+def summarize_with_gateway(summary, turns):
+    """Default summarizer: folds (question, answer) turns into the summary via the LLM router"""
+    transcript = "\n".join(f"User: {q}\nAssistant: {a}" for q, a in turns)
+    messages = [
+        {"role": "system", "content": SUMMARY_SYSTEM_PROMPT.format(words=CHAT_SUMMARY_TOKEN_BUDGET * 3 // 4)},
+        {"role": "user", "content": f"Existing summary:\n{summary or '(none)'}\n\nNew exchanges:\n{transcript}"}
+    ]
+    return routed_llm_response(messages, "summarize", temperature=0.1, max_tokens=CHAT_SUMMARY_TOKEN_BUDGET)
+
+class ChatMemory:
+    """
+    Bounded conversation memory: the last keep_turns exchanges verbatim plus a
+    rolling summary of everything older. Older turns are folded into the summary
+    on a background thread; until that lands they are simply left out, so the
+    prompt never waits on it and never exceeds the history token budget.
+    """
+
+    def __init__(self, summarize=summarize_with_gateway, keep_turns=CHAT_KEEP_TURNS,
+                 token_budget=CHAT_HISTORY_TOKEN_BUDGET, summary_budget=CHAT_SUMMARY_TOKEN_BUDGET):
+        self.summarize = summarize
+        self.keep_turns = keep_turns
+        self.token_budget = token_budget
+        self.summary_budget = summary_budget
+        self.turns = []        # [(question, answer)] not yet folded into the summary
+        self.summary = ""
+        self.lock = threading.Lock()
+        self._pending = None   # Future of the running summary refresh
+        self._generation = 0   # bumped by clear() so a late summary cannot resurrect old turns
+
+    def add_turn(self, question, answer):
+        with self.lock:
+            self.turns.append((question, answer))
+        self._maybe_refresh_summary()
+
+    def clear(self):
+        with self.lock:
+            self.turns = []
+            self.summary = ""
+            self._generation += 1
+
+    def _recent_turns(self):
+        """The newest verbatim turns that fit the budget left after the summary"""
+        budget = self.token_budget - (estimate_tokens(self.summary) if self.summary else 0)
+        recent = []
+        for question, answer in reversed(self.turns[-self.keep_turns:]):
+            # Long answers are clipped rather than dropping the whole exchange
+            answer = truncate_to_tokens(answer, max(50, budget // 2 - estimate_tokens(question)))
+            cost = estimate_tokens(question) + estimate_tokens(answer)
+            if cost > budget:
+                break
+            recent.append((question, answer))
+            budget -= cost
+        return list(reversed(recent))
+
+    def history_messages(self):
+        """OpenAI-style messages to place between the system prompt and the new question"""
+        with self.lock:
+            summary, recent = self.summary, self._recent_turns()
+        messages = [{"role": "system", "content": f"Summary of the earlier conversation:\n{summary}"}] if summary else []
+        for question, answer in recent:
+            messages += [{"role": "user", "content": question}, {"role": "assistant", "content": answer}]
+        return messages
+
+    def history_text(self):
+        """The same history as plain text, for single-prompt models"""
+        with self.lock:
+            summary, recent = self.summary, self._recent_turns()
+        lines = [f"Summary of the earlier conversation: {summary}"] if summary else []
+        for question, answer in recent:
+            lines += [f"User: {question}", f"Assistant: {answer}"]
+        return "\n".join(lines)
+
+    def _maybe_refresh_summary(self):
+        with self.lock:
+            overflow = len(self.turns) - self.keep_turns
+            if overflow <= 0 or (self._pending is not None and not self._pending.done()):
+                return
+            to_fold, summary = self.turns[:overflow], self.summary
+            self._pending = _summary_executor.submit(self._refresh_summary, summary, to_fold, self._generation)
+
+    def _refresh_summary(self, summary, to_fold, generation):
+        with span("chat_summary", source="chat_memory"):
+            try:
+                updated = self.summarize(summary, to_fold)
+            except Exception as e:
+                print(f"[WARN] Chat summary refresh failed: {e}")
+                updated = None
+        with self.lock:
+            if generation != self._generation:
+                return
+            if updated:
+                self.summary = truncate_to_tokens(updated.strip(), self.summary_budget)
+                # Only drop what was actually folded; newer turns may have arrived meanwhile
+                if self.turns[:len(to_fold)] == to_fold:
+                    self.turns = self.turns[len(to_fold):]
+            else:
+                # Summarizer unavailable: drop the overflow instead of letting it grow
+                self.turns = self.turns[-self.keep_turns:]
@@ -0,0 +1,202 @@
+"""
+Hierarchical comparison of N papers.
+
+generate_comparison_insight puts every paper into one 40k-character prompt,
+which is why the UIs stopped at three papers. Here instead:
+
+1. Facets (population, intervention, endpoints, effect sizes, ...) are
+   extracted per paper, in parallel, with small fixed-size prompts.
+2. The comparison table is assembled from the facets locally; no LLM call.
+3. The narrative is synthesized as a tree: groups of COMPARE_FANOUT compact
+   paper digests are merged into partial syntheses, which are merged again
+   until one remains. Every prompt stays bounded and each level runs in
+   parallel, so 20 papers cost about log_fanout(20) synthesis rounds.
+"""
+import os
+import json
+from typing import List
+from concurrent.futures import ThreadPoolExecutor
+from pydantic import BaseModel, Field
+from src.insight_generator import ComparisonInsight, clean_json_string, validates_as
+from src.llm_router import routed_llm_response
+from src.metrics import span
+from src.deadline import bind
+
+# --- Configuration ---
+COMPARE_MAX_PAPERS = int(os.getenv("COMPARE_MAX_PAPERS", "20"))
+COMPARE_FANOUT = int(os.getenv("COMPARE_FANOUT", "4"))        # digests per synthesis prompt
+COMPARE_WORKERS = int(os.getenv("COMPARE_WORKERS", "6"))
+FACET_TEXT_LIMIT = 6000     # characters of paper text per facet prompt
+DIGEST_LIMIT = 1500         # characters per paper digest / partial synthesis in a merge prompt
+CELL_LIMIT = 160            # characters per table cell
+
+class PaperFacets(BaseModel):
+    study_design: str = Field(description="Study design, e.g. RCT, cohort, simulation, review")
+    population: str = Field(description="Population, organism or dataset studied")
+    sample_size: str = Field(description="Sample size or dataset size, 'n/a' if not stated")
+    intervention: str = Field(description="Intervention, exposure or method under test")
+    comparator: str = Field(description="Control or baseline, 'none' if absent")
+    endpoints: List[str] = Field(description="Primary outcomes / endpoints measured")
+    effect_sizes: List[str] = Field(description="Quantitative results with units, e.g. 'RR 0.62 (95% CI 0.5-0.8)'")
+
+class PartialSynthesis(BaseModel):
+    hypothesis: str = Field(description="Common hypothesis or theme across these papers")
+    methodology: str = Field(description="How their methodologies compare")
+    conclusion: str = Field(description="Synthesis of what they show together")
+    key_findings: List[str] = Field(description="3-6 key comparative findings")
+
+FACETS_SYSTEM_PROMPT = f"""
+    Extract comparable study facets from the paper below.
+    Return ONLY a JSON object matching this schema exactly:
+    {json.dumps(PaperFacets.model_json_schema())}
+    Use short phrases. Write 'n/a' for anything the text does not state.
+    """
+
+SYNTHESIS_SYSTEM_PROMPT = f"""
+    You compare scientific papers. The input is a set of paper digests or partial
+    comparisons of groups of papers. Merge them into one comparison.
+    Return ONLY a JSON object matching this schema exactly:
+    {json.dumps(PartialSynthesis.model_json_schema())}
+    Keep every field concise; name papers by their short titles.
+    """
+
+TITLE_SYSTEM_PROMPT = "Write a short title (max 12 words) for a comparison of these papers. Return only the title."
+
+def _call_json(call_type, system_prompt, user_prompt, model_cls):
+    messages = [{"role": "system", "content": system_prompt}, {"role": "user", "content": user_prompt}]
+    response = routed_llm_response(messages, call_type, validate=validates_as(model_cls), json_mode=True)
+    return model_cls.model_validate_json(clean_json_string(response))
+
+def extract_facets(entry):
+    """PaperFacets for one {paper, text, insight} entry; None if extraction failed"""
+    paper, insight = entry["paper"], entry.get("insight")
+    context = entry.get("text", "")[:FACET_TEXT_LIMIT]
+    if insight is not None:
+        context += f"\n\nMethods: {insight.methods}\nResults: {insight.results}"
+    try:
+        with span("compare_facets", source="comparison"):
+            return _call_json("facets", FACETS_SYSTEM_PROMPT, f"Title: {paper['title']}\n{context}", PaperFacets)
+    except Exception as e:
+        print(f"[WARN] Facet extraction failed for '{paper['title'][:60]}': {e}")
+        return None
+
+def _cell(value):
+    if isinstance(value, list):
+        value = "; ".join(value)
+    value = " ".join(str(value or "n/a").split()).replace("|", "\\|")
+    return value if len(value) <= CELL_LIMIT else value[:CELL_LIMIT - 1] + "…"
+
+def facet_table(entries, facets):
+    """Markdown comparison table built locally from the extracted facets"""
+    header = ["Paper", "Design", "Population", "N", "Intervention", "Comparator", "Endpoints", "Effect sizes", "Rigor"]
+    lines = ["| " + " | ".join(header) + " |", "|" + "---|" * len(header)]
+    for entry, facet in zip(entries, facets):
+        insight = entry.get("insight")
+        score = f"{insight.methodology_score}/10" if insight is not None and insight.methodology_score else "n/a"
+        if facet is None:
+            row = [entry["paper"]["title"]] + ["n/a"] * 7 + [score]
+        else:
+            row = [entry["paper"]["title"], facet.study_design, facet.population, facet.sample_size,
+                   facet.intervention, facet.comparator, facet.endpoints, facet.effect_sizes, score]
+        lines.append("| " + " | ".join(_cell(v) for v in row) + " |")
+    return "\n".join(lines)
+
+def paper_digest(entry, facet):
+    """Fixed-size summary of one paper: the leaf input of the synthesis tree"""
+    paper, insight = entry["paper"], entry.get("insight")
+    parts = [f"PAPER: {paper['title']}"]
+    if facet is not None:
+        parts.append(f"Design: {facet.study_design}; population: {facet.population}; intervention: {facet.intervention}; "
+                     f"endpoints: {', '.join(facet.endpoints)}; effects: {', '.join(facet.effect_sizes)}")
+    if insight is not None:
+        parts.append(f"Conclusions: {insight.conclusions}\nFindings: " + "; ".join(insight.key_findings))
+    else:
+        parts.append(entry.get("text", ""))
+    return "\n".join(parts)[:DIGEST_LIMIT]
+
+def synthesis_digest(partial):
+    text = (f"Theme: {partial.hypothesis}\nMethods: {partial.methodology}\n"
+            f"Conclusion: {partial.conclusion}\nFindings: " + "; ".join(partial.key_findings))
+    return text[:DIGEST_LIMIT]
+
+def _synthesize_group(digests):
+    prompt = "\n\n".join(f"=== INPUT {i + 1} ===\n{d}" for i, d in enumerate(digests))
+    try:
+        with span("compare_synthesis", source="comparison"):
+            return _call_json("compare", SYNTHESIS_SYSTEM_PROMPT, prompt, PartialSynthesis)
+    except Exception as e:
+        print(f"[WARN] Comparison synthesis step failed: {e}")
+        return None
+
+def synthesize_tree(digests, titles, executor, fanout=COMPARE_FANOUT):
+    """
+    Merges digests fanout at a time, level by level, until one PartialSynthesis
+    is left. A group whose merge fails is carried up to the next level as it
+    is; papers that still cannot be merged are left out rather than holding up
+    the rest. Returns (synthesis, titles left out); synthesis is None if no
+    merge succeeded at all.
+    """
+    fanout = max(2, fanout)
+    level = [(None, digest, [title]) for digest, title in zip(digests, titles)]   # (synthesis, digest, titles)
+    left_out = []
+    while True:
+        groups = [level[i:i + fanout] for i in range(0, len(level), fanout)]
+        merged = executor.map(bind(_synthesize_group), [[digest for _, digest, _ in g] for g in groups])
+        next_level, carried = [], []
+        for group, result in zip(groups, merged):
+            if result is not None:
+                next_level.append((result, synthesis_digest(result), [t for _, _, ts in group for t in ts]))
+            else:
+                carried += group
+        if not next_level:
+            return _widest(level, left_out)
+        if len(next_level) + len(carried) >= len(level):
+            # Not converging: drop the papers never merged (or, failing that, the unmerged syntheses)
+            dropped = [item for item in carried if item[0] is None] or carried
+            left_out += [t for _, _, ts in dropped for t in ts]
+            carried = [item for item in carried if not any(item is d for d in dropped)]
+        level = next_level + carried
+        if len(level) == 1:
+            return level[0][0], left_out
+
+def _widest(level, left_out):
+    """The synthesis covering the most papers, with every other paper reported as left out"""
+    partials = [item for item in level if item[0] is not None]
+    if not partials:
+        return None, left_out + [t for _, _, ts in level for t in ts]
+    best = max(partials, key=lambda item: len(item[2]))
+    return best[0], left_out + [t for item in level if item is not best for t in item[2]]
+
+def _comparison_title(entries):
+    titles = "\n".join(f"- {e['paper']['title']}" for e in entries)[:DIGEST_LIMIT * 2]
+    try:
+        response = routed_llm_response([{"role": "system", "content": TITLE_SYSTEM_PROMPT},
+                                        {"role": "user", "content": titles}], "facets", max_tokens=40)
+        return response.strip().strip('"') if response else None
+    except Exception:
+        return None
+
+def compare_papers(entries, fanout=COMPARE_FANOUT, workers=COMPARE_WORKERS):
+    """
+    ComparisonInsight for entries [{paper, text, insight (PaperInsight or None)}].
+    The table is filled even when every LLM step fails.
+    """
+    entries = entries[:COMPARE_MAX_PAPERS]
+    with span("compare_papers", source="comparison"), ThreadPoolExecutor(max_workers=workers) as executor:
+        # Steps run under the caller's deadline; once it passes they fail fast and the table still fills
+        title_future = executor.submit(bind(_comparison_title), entries)
+        facets = list(executor.map(bind(extract_facets), entries))
+        table = facet_table(entries, facets)
+        synthesis, left_out = synthesize_tree([paper_digest(e, f) for e, f in zip(entries, facets)],
+                                              [e["paper"]["title"] for e in entries], executor, fanout)
+        title = title_future.result() or f"Comparison of {len(entries)} papers"
+    if synthesis is None:
+        return ComparisonInsight(title=title, hypothesis="Error", methodology="Error", tabular_data=table,
+                                 conclusion="Error", key_findings=["Failed to synthesize the comparison."])
+    key_findings = list(synthesis.key_findings)
+    if left_out:
+        # Still in the table, but the narrative could not take them into account
+        key_findings.append(f"Not covered by this synthesis ({len(left_out)} of {len(entries)} papers): "
+                            + "; ".join(left_out))
+    return ComparisonInsight(title=title, hypothesis=synthesis.hypothesis, methodology=synthesis.methodology,
+                             tabular_data=table, conclusion=synthesis.conclusion, key_findings=key_findings)
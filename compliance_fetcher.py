@@ -1,13 +1,20 @@
 import os
 import requests
 import json
-from Bio import Entrez
+from src.metrics import span
+from src.fulltext_index import FullTextIndex
+from src.singleflight import get_flight, canonical_key
+from src.deadline import call_timeout
 
 import urllib3
 # Disable annoying warnings when we turn off SSL verification
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 # ⚠️ IMPORTANT: You MUST replace this with your actual email or NCBI might block you.
-Entrez.email = "your.email@example.com" 
+NCBI_EMAIL = os.getenv("NCBI_EMAIL", "your.email@example.com")
+
+# Concurrent requests for the same article download it once
+_bioc_flight = get_flight("pmc_bioc", copy_result=False)
+_pdf_flight = get_flight("pmc_pdf", copy_result=False)
 
 class NCBILoader:
     def __init__(self, data_dir="./data"):
@@ -15,28 +22,69 @@ class NCBILoader:
         self.pdf_dir = os.path.join(data_dir, "pdfs")
         os.makedirs(self.json_dir, exist_ok=True)
         os.makedirs(self.pdf_dir, exist_ok=True)
+        # Same E-utilities endpoint (and stand-in override) as the PubMed loader
+        self.eutils_url = os.getenv("NCBI_EUTILS_URL", "https://eutils.ncbi.nlm.nih.gov/entrez/eutils")
+        # Full-text index over everything already downloaded; catches up on files from earlier runs
+        self.index = FullTextIndex(os.path.join(data_dir, "fulltext.db"), self.json_dir)
+        self.index.sync()
 
-    def fetch_papers(self, query, limit=1):
+    def fetch_papers(self, query, limit=1, prefer_local=True):
         """Finds papers and fetches BOTH BioC JSON (Text) and PDF (Images)"""
+        with span("fetch_papers", source="pmc"):
+            return self._fetch_papers(query, limit, prefer_local)
+
+    def search_local(self, query, limit=10):
+        """Articles already on disk that match the query, ranked, with highlighted snippets"""
+        results = []
+        for hit in self.index.search(query, limit):
+            pdf_path = os.path.join(self.pdf_dir, f"{hit['pmcid']}.pdf")
+            results.append({
+                "id": hit["pmcid"][3:],
+                "json": hit["path"],
+                "pdf": pdf_path if os.path.exists(pdf_path) else None,
+                "title": hit["title"],
+                "snippet": hit["snippet"],
+                "source": "local"
+            })
+        return results
+
+    def _fetch_papers(self, query, limit, prefer_local=True):
+        # 0. Local corpus first; NCBI is only asked for the shortfall
+        results = self.search_local(query, limit) if prefer_local else []
+        if len(results) >= limit:
+            print(f"📚 {len(results)} local match(es) for: {query}")
+            return results
         print(f"🔍 Searching PMC for: {query}")
         
         try:
-            # 1. Search for Open Access papers in PMC
-            handle = Entrez.esearch(db="pmc", term=f"{query} AND open access[filter]", sort='relevance', retmax=limit)
-            search_results = Entrez.read(handle)
-            pmc_ids = search_results["IdList"]
+            # 1. Search for Open Access papers in PMC (extra IDs cover the ones we already hold)
+            search_results = self._esearch(query, sort='relevance', retmax=limit + len(results))
+            local_ids = {r["id"] for r in results}
+            pmc_ids = [pid for pid in search_results["idlist"] if pid not in local_ids]
             
             if not pmc_ids:
-                print("   ❌ No IDs found matching query.")
-                return []
+                print("   ❌ No new IDs found matching query.")
+                return results
                 
             print(f"   found IDs: {pmc_ids}")
         except Exception as e:
             print(f"   ❌ Entrez Search Error: {e}")
-            return []
+            return results
         
-        results = []
         for pid in pmc_ids:
+            if len(results) >= limit:
+                break
+            if self.index.has(pid):
+                # Downloaded earlier but not among the local hits: reuse the stored copy
+                pdf_path = os.path.join(self.pdf_dir, f"PMC{pid}.pdf")
+                results.append({
+                    "id": pid,
+                    "json": self.index.path_for(pid),
+                    "pdf": pdf_path if os.path.exists(pdf_path) else None,
+                    "source": "local"
+                })
+                continue
+
             # 2. Get Text (BioC API)
             text_data_path = self._get_bioc_json(pid)
             
@@ -55,7 +103,41 @@ class NCBILoader:
                 
         return results
 
+    def fetch_new_since(self, query, since=None, reldate=30, limit=50):
+        """
+        (results, complete): open-access articles added to PMC (Entrez date) on
+        or after `since` ('YYYY/MM/DD'), or within `reldate` days; only articles
+        not stored yet are downloaded. complete is False when more than `limit`
+        matched. Raises on search errors so the caller can keep its watermark.
+        """
+        dates = {"mindate": since, "maxdate": "3000/12/31"} if since else {"reldate": reldate}
+        with span("fetch_new", source="pmc"):
+            search = self._esearch(query, datetype="edat", retmax=limit, **dates)
+            pmc_ids = search["idlist"]
+            complete = int(search.get("count", len(pmc_ids))) <= len(pmc_ids)
+            results = []
+            for pid in pmc_ids:
+                text_path = self.index.path_for(pid) or self._get_bioc_json(pid)
+                if text_path:
+                    pdf_path = os.path.join(self.pdf_dir, f"PMC{pid}.pdf")
+                    results.append({"id": pid, "json": text_path,
+                                    "pdf": pdf_path if os.path.exists(pdf_path) else self._download_pdf(pid)})
+            return results, complete
+
+    def _esearch(self, query, **params):
+        """Open-access PMC search; raises on network errors, times out with the request's budget"""
+        params.update(db="pmc", term=f"{query} AND open access[filter]", retmode="json", email=NCBI_EMAIL)
+        with span("esearch", source="pmc"):
+            resp = requests.get(f"{self.eutils_url}/esearch.fcgi", params=params, timeout=call_timeout())
+        resp.raise_for_status()
+        result = resp.json().get("esearchresult", {})
+        result.setdefault("idlist", [])
+        return result
+
     def _get_bioc_json(self, pmc_id):
+        return _bioc_flight.do(canonical_key(self.json_dir, str(pmc_id).strip()), self._fetch_bioc_json, pmc_id)
+
+    def _fetch_bioc_json(self, pmc_id):
         # --- THE FIX IS HERE ---
         # The BioC API requires the 'PMC' prefix (e.g., PMC8531986)
         # Entrez returns just the number (e.g., 8531986). We must add it.
@@ -65,7 +147,8 @@ class NCBILoader:
         url = f"https://www.ncbi.nlm.nih.gov/research/bionlp/RESTful/pmcoa.cgi/BioC_json/{formatted_id}/unicode"
         
         try:
-            r = requests.get(url)
+            with span("bioc_download", source="pmc"):
+                r = requests.get(url, timeout=call_timeout())
             
             # Check if request was successful
             if r.status_code == 200:
@@ -74,6 +157,7 @@ class NCBILoader:
                     save_path = os.path.join(self.json_dir, f"{formatted_id}.json")
                     with open(save_path, "w", encoding="utf-8") as f:
                         json.dump(data, f)
+                    self.index.index_file(save_path)
                     return save_path
                 except json.JSONDecodeError:
                     print(f"   ❌ Error: BioC API returned invalid JSON for {formatted_id}. Response: {r.text[:50]}...")
@@ -86,13 +170,17 @@ class NCBILoader:
         return None
 
     def _download_pdf(self, pmc_id):
+        return _pdf_flight.do(canonical_key(self.pdf_dir, str(pmc_id).strip()), self._fetch_pdf, pmc_id)
+
+    def _fetch_pdf(self, pmc_id):
         # Format ID correctly for OA API as well
         clean_id = str(pmc_id).strip()
         formatted_id = f"PMC{clean_id}" if not clean_id.startswith("PMC") else clean_id
         
         oa_url = "https://www.ncbi.nlm.nih.gov/pmc/utils/oa/oa.fcgi"
         try:
-            r = requests.get(oa_url, params={"id": formatted_id})
+            with span("oa_lookup", source="pmc"):
+                r = requests.get(oa_url, params={"id": formatted_id}, timeout=call_timeout())
             
             if "format=\"pdf\"" in r.text:
                 start = r.text.find('href="', r.text.find('format="pdf"')) + 6
@@ -101,7 +189,8 @@ class NCBILoader:
                 
                 # Download
                 print(f"   📄 Downloading PDF from: {link}")
-                pdf_r = requests.get(link)
+                with span("pdf_download", source="pmc"):
+                    pdf_r = requests.get(link, timeout=call_timeout())
                 save_path = os.path.join(self.pdf_dir, f"{formatted_id}.pdf")
                 with open(save_path, "wb") as f:
                     f.write(pdf_r.content)
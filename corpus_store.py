@@ -0,0 +1,333 @@
+"""
+Persistent columnar corpus of papers and their insights.
+
+Two Parquet datasets under CORPUS_PATH, hive-partitioned by source and year:
+
+    papers/source=pubmed/year=2023/part-<ts>-<id>.parquet     metadata + abstract
+    insights/source=arxiv/year=2024/part-<ts>-<id>.parquet    flattened PaperInsight
+
+Writes are append-only: rows are buffered briefly and flushed as new part
+files, never rewriting existing ones (`compact` merges small parts offline).
+Reads use pyarrow.dataset with vectorized filters and partition pruning.
+pyarrow is optional; without it recording is a no-op.
+
+Usage:
+    python corpus_store.py query --min-score 8 --after 2022-12-31 --limit 20
+    python corpus_store.py stats
+    python corpus_store.py compact
+"""
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import atexit
+import argparse
+import datetime
+import threading
+
+# --- Configuration ---
+CORPUS_PATH = os.getenv("CORPUS_PATH", "./data/corpus")
+CORPUS_ENABLED = os.getenv("CORPUS_ENABLED", "1").lower() in ("1", "true", "yes")
+CORPUS_FLUSH_ROWS = int(os.getenv("CORPUS_FLUSH_ROWS", "200"))
+CORPUS_FLUSH_SECONDS = float(os.getenv("CORPUS_FLUSH_SECONDS", "30"))
+
+PAPERS, INSIGHTS = "papers", "insights"
+MONTHS = {m: i for i, m in enumerate(["jan", "feb", "mar", "apr", "may", "jun",
+                                      "jul", "aug", "sep", "oct", "nov", "dec"], start=1)}
+DATE_RE = re.compile(r"(\d{4})(?:[-\s/](\d{1,2}|[A-Za-z]{3})[A-Za-z]*)?(?:[-\s/](\d{1,2}))?")
+
+_arrow = None
+_arrow_warned = False
+
+def _import_arrow():
+    """(pa, pq, ds, pc) or None when pyarrow is not installed"""
+    global _arrow, _arrow_warned
+    if _arrow is None:
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            import pyarrow.dataset as ds
+            import pyarrow.compute as pc
+            _arrow = (pa, pq, ds, pc)
+        except ImportError:
+            if not _arrow_warned:
+                print("[WARN] pyarrow is not installed; the paper corpus is disabled (pip install pyarrow)")
+                _arrow_warned = True
+            return None
+    return _arrow
+
+def _schemas(pa):
+    papers = pa.schema([
+        ("paper_key", pa.string()), ("paper_id", pa.string()), ("title", pa.string()),
+        ("abstract", pa.string()), ("published", pa.string()), ("published_date", pa.date32()),
+        ("doi", pa.string()), ("pmcid", pa.string()), ("pdf_url", pa.string()),
+        ("sources", pa.list_(pa.string())), ("source_ids", pa.string()),
+        ("ingested_at", pa.timestamp("ms", tz="UTC")),
+        ("source", pa.string()), ("year", pa.int16()),
+    ])
+    insights = pa.schema([
+        ("paper_key", pa.string()), ("paper_id", pa.string()), ("title", pa.string()),
+        ("published_date", pa.date32()),
+        ("background", pa.string()), ("methods", pa.string()), ("results", pa.string()),
+        ("conclusions", pa.string()), ("key_findings", pa.list_(pa.string())),
+        ("methodology_score", pa.int8()), ("methodology_critique", pa.string()),
+        ("model", pa.string()), ("generated_at", pa.timestamp("ms", tz="UTC")),
+        ("source", pa.string()), ("year", pa.int16()),
+    ])
+    return {PAPERS: papers, INSIGHTS: insights}
+
+def parse_published(value):
+    """Best-effort date from arXiv (2023-01-05) and PubMed (2023 Jan 5, 2023 Jan-Feb, 2023) strings"""
+    match = DATE_RE.search(value or "")
+    if not match:
+        return None
+    year, month, day = match.groups()
+    if month and not month.isdigit():
+        month = MONTHS.get(month[:3].lower())
+    try:
+        return datetime.date(int(year), int(month or 1), int(day or 1))
+    except ValueError:
+        return datetime.date(int(year), 1, 1)
+
+def paper_key(paper):
+    return f"{paper['source']}:{paper['id']}"
+
+class CorpusStore:
+    def __init__(self, path=CORPUS_PATH, flush_rows=CORPUS_FLUSH_ROWS, flush_seconds=CORPUS_FLUSH_SECONDS):
+        self.path = path
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self.buffers = {PAPERS: [], INSIGHTS: []}
+        self.oldest = {PAPERS: None, INSIGHTS: None}
+        self.lock = threading.Lock()
+
+    # --- Writes ---
+    def append_papers(self, papers):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        rows = []
+        for paper in papers:
+            published = parse_published(paper.get("published"))
+            rows.append({
+                "paper_key": paper_key(paper), "paper_id": str(paper["id"]), "title": paper.get("title"),
+                "abstract": paper.get("summary"), "published": paper.get("published"), "published_date": published,
+                "doi": paper.get("doi"), "pmcid": paper.get("pmcid"), "pdf_url": paper.get("pdf_url"),
+                "sources": paper.get("sources", [paper["source"]]),
+                "source_ids": json.dumps(paper.get("source_ids", {paper["source"]: [paper["id"]]})),
+                "ingested_at": now, "source": paper["source"], "year": published.year if published else 0,
+            })
+        self._buffer(PAPERS, rows)
+
+    def append_insight(self, paper, insight, model=None):
+        """insight is a PaperInsight or its model_dump()"""
+        data = insight.model_dump() if hasattr(insight, "model_dump") else dict(insight)
+        published = parse_published(paper.get("published"))
+        row = {"paper_key": paper_key(paper), "paper_id": str(paper["id"]), "title": paper.get("title"),
+               "published_date": published, "model": model,
+               "generated_at": datetime.datetime.now(datetime.timezone.utc),
+               "source": paper["source"], "year": published.year if published else 0}
+        row.update({k: data.get(k) for k in ("background", "methods", "results", "conclusions",
+                                             "key_findings", "methodology_score", "methodology_critique")})
+        self._buffer(INSIGHTS, [row])
+
+    def _buffer(self, table, rows):
+        if not rows:
+            return
+        with self.lock:
+            self.buffers[table].extend(rows)
+            if self.oldest[table] is None:
+                self.oldest[table] = time.monotonic()
+            due = (len(self.buffers[table]) >= self.flush_rows
+                   or time.monotonic() - self.oldest[table] >= self.flush_seconds)
+        if due:
+            self.flush(table)
+
+    def flush(self, table=None):
+        """Writes buffered rows as new part files, one per (source, year) partition"""
+        arrow = _import_arrow()
+        if arrow is None:
+            return 0
+        pa, pq, _, pc = arrow
+        written = 0
+        for name in ([table] if table else [PAPERS, INSIGHTS]):
+            with self.lock:
+                rows, self.buffers[name], self.oldest[name] = self.buffers[name], [], None
+            if not rows:
+                continue
+            data = pa.Table.from_pylist(rows, schema=_schemas(pa)[name])
+            stamp = time.strftime("%Y%m%d%H%M%S")
+            for source in pc.unique(data["source"]).to_pylist():
+                by_source = data.filter(pc.equal(data["source"], source))
+                for year in pc.unique(by_source["year"]).to_pylist():
+                    part = by_source.filter(pc.equal(by_source["year"], year))
+                    directory = os.path.join(self.path, name, f"source={source}", f"year={year}")
+                    os.makedirs(directory, exist_ok=True)
+                    part_name = f"part-{stamp}-{uuid.uuid4().hex[:8]}.parquet"
+                    # Write under a hidden temp name so readers never see a half-written part
+                    _atomic_write(pq, part.drop(["source", "year"]), directory, part_name)
+                    written += part.num_rows
+        return written
+
+    # --- Reads ---
+    def dataset(self, table):
+        arrow = _import_arrow()
+        directory = os.path.join(self.path, table)
+        if arrow is None or not os.path.isdir(directory):
+            return None
+        pa, _, ds, _ = arrow
+        partitioning = ds.partitioning(pa.schema([("source", pa.string()), ("year", pa.int16())]), flavor="hive")
+        schema = _schemas(pa)[table]
+        return ds.dataset(directory, format="parquet", partitioning=partitioning, schema=schema,
+                          exclude_invalid_files=False, ignore_prefixes=[".", "_"])
+
+    def scan(self, table, filter=None, columns=None, latest_only=True):
+        """
+        Arrow Table of rows matching a pyarrow.compute expression. With
+        latest_only, re-recorded papers keep only their newest row, and the
+        filter applies to that row (an older, superseded row never matches).
+        """
+        self.flush(table)
+        dataset = self.dataset(table)
+        if dataset is None:
+            return None
+        pa, _, _, pc = _import_arrow()
+        data = dataset.to_table(filter=filter)
+        if latest_only and data.num_rows:
+            stamp = "generated_at" if table == INSIGHTS else "ingested_at"
+            if filter is not None:
+                # Newest row per paper over the whole table (two columns), then keep matches that are it
+                latest = dataset.to_table(columns=["paper_key", stamp]).group_by(
+                    "paper_key", use_threads=False).aggregate([(stamp, "max")])
+                rows = pa.table({"paper_key": data["paper_key"], stamp: data[stamp],
+                                 "_row": pa.array(range(data.num_rows), pa.int64())})
+                keep = rows.join(latest, keys=["paper_key", stamp], right_keys=["paper_key", f"{stamp}_max"],
+                                 join_type="inner")["_row"]
+                data = data.take(pc.take(keep, pc.sort_indices(keep)))
+            data = data.sort_by([(stamp, "descending")])
+            data = data.append_column("_row", pa.array(range(data.num_rows), pa.int64()))
+            first = data.group_by("paper_key", use_threads=False).aggregate([("_row", "min")])["_row_min"]
+            data = data.take(pc.take(first, pc.sort_indices(first))).drop(["_row"])
+        return data.select(columns) if columns else data
+
+    def query_insights(self, min_score=None, published_after=None, source=None, columns=None, limit=None):
+        """Vectorized insight filter, e.g. query_insights(min_score=8, published_after="2022-12-31")"""
+        arrow = _import_arrow()
+        if arrow is None:
+            return None
+        _, _, ds, _ = arrow
+        conditions = []
+        if min_score is not None:
+            conditions.append(ds.field("methodology_score") >= min_score)
+        if published_after:
+            after = published_after if isinstance(published_after, datetime.date) else datetime.date.fromisoformat(str(published_after))
+            conditions.append(ds.field("published_date") > after)
+            conditions.append(ds.field("year") >= after.year)  # lets the scan skip older partitions
+        if source:
+            conditions.append(ds.field("source") == source)
+        expression = None
+        for condition in conditions:
+            expression = condition if expression is None else expression & condition
+        data = self.scan(INSIGHTS, filter=expression, columns=columns)
+        if data is not None and limit:
+            data = data.slice(0, limit)
+        return data
+
+    def stats(self):
+        out = {}
+        for table in (PAPERS, INSIGHTS):
+            dataset = self.dataset(table)
+            out[table] = {"rows": dataset.count_rows() if dataset else 0,
+                          "files": len(dataset.files) if dataset else 0}
+        return out
+
+    def compact(self):
+        """Merges each partition's part files into one (run offline; readers see old or new parts)"""
+        arrow = _import_arrow()
+        if arrow is None:
+            return 0
+        pa, pq, _, _ = arrow
+        self.flush()
+        merged = 0
+        for table in (PAPERS, INSIGHTS):
+            root = os.path.join(self.path, table)
+            for directory, _, files in os.walk(root):
+                parts = sorted(f for f in files if f.startswith("part-") and f.endswith(".parquet"))
+                if len(parts) < 2:
+                    continue
+                data = pa.concat_tables([pq.read_table(os.path.join(directory, p)) for p in parts])
+                _atomic_write(pq, data, directory, f"part-{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}.parquet")
+                for p in parts:
+                    os.remove(os.path.join(directory, p))
+                merged += len(parts)
+        return merged
+
+def _atomic_write(pq, table, directory, name):
+    temp = os.path.join(directory, f".{name}.tmp")
+    pq.write_table(table, temp)
+    os.replace(temp, os.path.join(directory, name))
+
+_default_store = None
+_default_lock = threading.Lock()
+
+def get_default_store():
+    global _default_store
+    with _default_lock:
+        if _default_store is None:
+            _default_store = CorpusStore()
+            atexit.register(_default_store.flush)
+        return _default_store
+
+def record_papers(papers):
+    """Appends loader results to the corpus; never lets a corpus problem break a search"""
+    if not CORPUS_ENABLED or not papers or _import_arrow() is None:
+        return
+    try:
+        get_default_store().append_papers(papers)
+    except Exception as e:
+        print(f"[WARN] Could not record papers in the corpus: {e}")
+
+def record_insight(paper, insight, model=None):
+    if not CORPUS_ENABLED or _import_arrow() is None:
+        return
+    try:
+        get_default_store().append_insight(paper, insight, model=model)
+    except Exception as e:
+        print(f"[WARN] Could not record insight in the corpus: {e}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Query and maintain the paper corpus.")
+    parser.add_argument("--path", default=CORPUS_PATH, help="Corpus directory")
+    sub = parser.add_subparsers(dest="command", required=True)
+    query = sub.add_parser("query", help="Filter analyzed papers")
+    query.add_argument("--min-score", type=int, help="Minimum methodology score")
+    query.add_argument("--after", help="Published after this date (YYYY-MM-DD)")
+    query.add_argument("--source", choices=["arxiv", "pubmed"])
+    query.add_argument("--limit", type=int, default=20)
+    query.add_argument("--json", action="store_true", help="Print rows as JSON lines")
+    sub.add_parser("stats", help="Row and file counts")
+    sub.add_parser("compact", help="Merge small part files per partition")
+    args = parser.parse_args(argv)
+
+    if _import_arrow() is None:
+        return 1
+    store = CorpusStore(args.path)
+    if args.command == "stats":
+        print(json.dumps(store.stats(), indent=2))
+    elif args.command == "compact":
+        print(f"[CORPUS] Merged {store.compact()} part files")
+    else:
+        started = time.perf_counter()
+        data = store.query_insights(args.min_score, args.after, args.source, limit=args.limit)
+        elapsed = (time.perf_counter() - started) * 1000
+        rows = data.to_pylist() if data is not None else []
+        for row in rows:
+            if args.json:
+                print(json.dumps(row, default=str))
+            else:
+                print(f"[{row['methodology_score']:>2}] {row['published_date']} {row['source']:<7} {row['title'][:90]}")
+        print(f"[CORPUS] {len(rows)} row(s) in {elapsed:.1f} ms")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
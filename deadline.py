@@ -0,0 +1,180 @@
+"""
+Request-scoped deadlines and cancellation.
+
+A user action (a search, an analysis, an OCR run, a chat answer) opens
+`deadline_scope(budget)`; the Deadline lives in a context variable, so
+everything called underneath sees it without extra parameters: query
+refinement, the loaders, OCR, the LLM client and router. Each outbound call
+asks `call_timeout(default)` for its timeout, which is the remaining budget
+capped at the call's usual timeout, and raises DeadlineExceeded (or
+Cancelled) instead of starting a call that could not finish in time. Calls
+made outside any scope still get the default, so nothing waits forever.
+
+Thread pools do not inherit context variables: work handed to an executor
+goes through `bind(fn)`, which carries the caller's Deadline along, or
+`submit(executor, fn, ...)`, which also skips work whose deadline is gone by
+the time a worker picks it up. Together with the per-call timeouts, hung or
+abandoned requests drain from the pools instead of piling up.
+
+`Deadline.cancel()` ends a request early (a replaced Streamlit run, a
+stopped or disconnected chat, a cancelled job); the work sees it at its next
+check or call. Callers that have something useful by then (one source's
+results, some analyses, the streamed part of an answer) return it and flag
+it as partial.
+"""
+import os
+import time
+import threading
+import functools
+import contextvars
+from contextlib import contextmanager
+from src.metrics import registry
+
+# --- Configuration ---
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "30"))             # any outbound call without a tighter budget
+SEARCH_BUDGET = float(os.getenv("SEARCH_BUDGET", "60"))           # refine + fetch + rank
+ANALYSIS_BUDGET = float(os.getenv("ANALYSIS_BUDGET", "240"))      # one paper insight or one comparison
+OCR_BUDGET = float(os.getenv("OCR_BUDGET", "600"))                # one "Process All Documents" run
+CHAT_BUDGET = float(os.getenv("CHAT_BUDGET", "120"))              # one chat answer
+MIN_CALL_TIMEOUT = 0.5   # with less than this left, no new call is started
+
+class DeadlineExceeded(Exception):
+    """The request's time budget ran out"""
+
+class Cancelled(DeadlineExceeded):
+    """The request was cancelled (rerun, disconnect, job cancelled)"""
+
+class Deadline:
+    """
+    Expiry time plus a cancellation flag. A Deadline created inside another
+    one never outlives it and is cancelled along with it.
+    """
+
+    def __init__(self, seconds=None, name="request", parent=None):
+        self.name = name
+        self.parent = parent
+        self.expires = time.monotonic() + seconds if seconds is not None else None
+        if parent is not None and parent.expires is not None:
+            self.expires = parent.expires if self.expires is None else min(self.expires, parent.expires)
+        self.reason = None
+        self._cancelled = threading.Event()
+        self._reported = False
+
+    def cancel(self, reason="cancelled"):
+        if not self._cancelled.is_set():
+            self.reason = reason
+            self._cancelled.set()
+            registry.inc("deadline_cancellations", scope=self.name)
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set() or (self.parent is not None and self.parent.cancelled)
+
+    def remaining(self):
+        """Seconds left, or None without a time limit"""
+        if self.expires is None:
+            return None
+        return max(0.0, self.expires - time.monotonic())
+
+    @property
+    def expired(self):
+        return self.remaining() == 0.0
+
+    @property
+    def done(self):
+        """Cancelled, or too little time left to start another call"""
+        remaining = self.remaining()
+        return self.cancelled or (remaining is not None and remaining < MIN_CALL_TIMEOUT)
+
+    def check(self):
+        """Raises Cancelled or DeadlineExceeded once the request is over"""
+        if self.cancelled:
+            raise Cancelled(f"{self.name} cancelled ({self._reason()})")
+        if self.expired:
+            self._report()
+            raise DeadlineExceeded(f"{self.name} ran out of time")
+
+    def timeout(self, default=HTTP_TIMEOUT):
+        """Timeout for the next call: the remaining budget, capped at default"""
+        self.check()
+        remaining = self.remaining()
+        if remaining is None:
+            return default
+        if remaining < MIN_CALL_TIMEOUT:
+            # Too little left for a call to succeed; don't start one
+            self._report()
+            raise DeadlineExceeded(f"{self.name} ran out of time")
+        return min(default, remaining)
+
+    def _report(self):
+        if not self._reported:
+            self._reported = True
+            registry.inc("deadlines_exceeded", scope=self.name)
+
+    def _reason(self):
+        node = self
+        while node is not None:
+            if node._cancelled.is_set():
+                return node.reason
+            node = node.parent
+        return None
+
+_current = contextvars.ContextVar("deadline", default=None)
+
+def current():
+    """The Deadline of the request being served, or None"""
+    return _current.get()
+
+@contextmanager
+def deadline_scope(seconds=None, name="request", deadline=None):
+    """
+    Runs the block under a Deadline (a new one of `seconds`, nested in any
+    enclosing scope, or the given one) and yields it.
+    """
+    deadline = deadline or Deadline(seconds, name, parent=current())
+    token = _current.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current.reset(token)
+
+def check():
+    deadline = current()
+    if deadline is not None:
+        deadline.check()
+
+def call_timeout(default=HTTP_TIMEOUT):
+    """Timeout for an outbound call: default, or less if the request's budget is nearly spent"""
+    deadline = current()
+    return default if deadline is None else deadline.timeout(default)
+
+def remaining():
+    deadline = current()
+    return None if deadline is None else deadline.remaining()
+
+def request_done():
+    """True once the current request has run out of time or was cancelled: time to return what there is"""
+    deadline = current()
+    return deadline is not None and deadline.done
+
+def bind(fn):
+    """fn wrapped to run in the caller's context (and so under its Deadline) on another thread"""
+    context = contextvars.copy_context()
+
+    @functools.wraps(fn)
+    def run(*args, **kwargs):
+        # A Context can only be entered by one thread at a time; each call gets its own copy
+        return context.copy().run(fn, *args, **kwargs)
+    return run
+
+def _checked(fn, *args, **kwargs):
+    check()
+    return fn(*args, **kwargs)
+
+def submit(executor, fn, *args, **kwargs):
+    """
+    executor.submit under the caller's Deadline. Raises at once if it has
+    passed; work still queued when it passes raises instead of running.
+    """
+    check()
+    return executor.submit(bind(_checked), fn, *args, **kwargs)
@@ -0,0 +1,255 @@
+import os
+import re
+import sqlite3
+import uuid
+import hashlib
+import threading
+import unicodedata
+from array import array
+from functools import lru_cache
+
+# --- Configuration ---
+INDEX_PATH = os.getenv("DEDUP_INDEX_PATH", "./data/dedup_index.db")
+
+# MinHash / LSH parameters: 8 bands x 8 rows catches pairs with Jaccard >= ~0.77,
+# candidates are then confirmed against SIMILARITY_THRESHOLD.
+NUM_PERM = 64
+BANDS = 8
+ROWS = NUM_PERM // BANDS
+SHINGLE_SIZE = 4
+SIMILARITY_THRESHOLD = 0.9
+# Titles shorter than this (or generic ones) say nothing about which paper it is
+MIN_TITLE_WORDS = 3
+GENERIC_TITLES = {
+    "editorial", "no title", "untitled", "title", "erratum", "errata", "correction", "corrigendum",
+    "retraction", "retraction notice", "expression of concern", "letter to the editor", "reply",
+    "in reply", "response", "comment", "commentary", "book review", "preface", "foreword",
+    "introduction", "front matter", "back matter", "index", "contents", "abstracts", "news",
+}
+# Identifier namespaces where two different values mean two different papers
+ID_NAMESPACES = ("doi", "pmid", "pmcid", "arxiv")
+
+# --- Helper Functions ---
+def normalize_title(title):
+    """Lowercase, strip accents/punctuation and collapse whitespace"""
+    if not title:
+        return ""
+    text = unicodedata.normalize("NFKD", title)
+    text = "".join(c for c in text if not unicodedata.combining(c)).lower()
+    text = re.sub(r"[^a-z0-9]+", " ", text)
+    return " ".join(text.split())
+
+def title_matchable(title):
+    """True if a normalized title is specific enough to identify a paper on its own"""
+    return len(title.split()) >= MIN_TITLE_WORDS and title not in GENERIC_TITLES
+
+def _title_markers(title):
+    # Numbers and roman numerals tell "Part I" from "Part II" where shingles barely differ
+    return {w for w in title.split() if w.isdigit() or re.fullmatch(r"[ivx]+", w)}
+
+def _id_conflict(keys_a, keys_b):
+    """True if two key sets carry different identifiers of the same kind"""
+    for namespace in ID_NAMESPACES:
+        prefix = namespace + ":"
+        # arXiv-minted DOIs duplicate the arxiv: key; a preprint and its journal DOI don't conflict
+        a = {k for k in keys_a if k.startswith(prefix) and not k.startswith("doi:10.48550/")}
+        b = {k for k in keys_b if k.startswith(prefix) and not k.startswith("doi:10.48550/")}
+        if a and b and not a & b:
+            return True
+    return False
+
+def normalize_arxiv_id(arxiv_id):
+    """Strips URL prefixes and version suffixes (e.g. 2101.00001v2 -> 2101.00001)"""
+    clean = str(arxiv_id).strip().lower()
+    clean = clean.split("arxiv.org/abs/")[-1]
+    clean = re.sub(r"^arxiv:", "", clean)
+    return re.sub(r"v\d+$", "", clean)
+
+def crosswalk_keys(paper):
+    """Returns the identifier keys (DOI/PMID/PMCID/arXiv) a paper can be matched on"""
+    keys = []
+    doi = paper.get("doi")
+    if doi:
+        doi = doi.strip().lower()
+        doi = re.sub(r"^(https?://(dx\.)?doi\.org/|doi:)", "", doi)
+        keys.append(f"doi:{doi}")
+        # arXiv-minted DOIs carry the arXiv ID as well
+        if doi.startswith("10.48550/arxiv."):
+            keys.append(f"arxiv:{normalize_arxiv_id(doi[len('10.48550/arxiv.'):])}")
+
+    source = paper.get("source")
+    if source == "arxiv" and paper.get("id"):
+        keys.append(f"arxiv:{normalize_arxiv_id(paper['id'])}")
+    elif source == "pubmed" and paper.get("id"):
+        keys.append(f"pmid:{str(paper['id']).strip()}")
+
+    pmcid = paper.get("pmcid") or (paper.get("id") if source == "pmc" else None)
+    if pmcid:
+        pmcid = str(pmcid).strip().upper()
+        keys.append(f"pmcid:{pmcid if pmcid.startswith('PMC') else 'PMC' + pmcid}")
+    return list(dict.fromkeys(keys))
+
+@lru_cache(maxsize=200_000)
+def _shingle_hashes(shingle):
+    # One SHAKE digest per shingle yields NUM_PERM independent 32-bit hash values
+    return array("I", hashlib.shake_128(shingle.encode()).digest(4 * NUM_PERM))
+
+def minhash_signature(text):
+    """MinHash signature over character shingles of a normalized title"""
+    if not text:
+        return None
+    padded = f" {text} "
+    shingles = {padded[i:i + SHINGLE_SIZE] for i in range(max(1, len(padded) - SHINGLE_SIZE + 1))}
+    # Per-permutation minimum is computed column-wise in C
+    return list(map(min, zip(*map(_shingle_hashes, shingles))))
+
+def signature_similarity(sig_a, sig_b):
+    """Estimated Jaccard similarity between two MinHash signatures"""
+    return sum(1 for x, y in zip(sig_a, sig_b) if x == y) / NUM_PERM
+
+def _band_hashes(signature):
+    for band in range(BANDS):
+        chunk = signature[band * ROWS:(band + 1) * ROWS]
+        yield f"{band}:" + hashlib.blake2b(repr(chunk).encode(), digest_size=8).hexdigest()
+
+def _encode_signature(signature):
+    return b"".join(v.to_bytes(4, "big") for v in signature)
+
+def _decode_signature(blob):
+    return [int.from_bytes(blob[i:i + 4], "big") for i in range(0, len(blob), 4)]
+
+# --- Persistent Index ---
+class PaperDedupIndex:
+    """SQLite-backed index mapping crosswalk keys and title LSH bands to a cluster ID.
+
+    Clusters persist across searches, so a paper seen once from PubMed is
+    recognised later when the same study comes back from arXiv.
+    """
+
+    def __init__(self, path=INDEX_PATH):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.conn:
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS clusters (cluster_id TEXT PRIMARY KEY, title TEXT, signature BLOB);
+                CREATE TABLE IF NOT EXISTS keys (key TEXT PRIMARY KEY, cluster_id TEXT NOT NULL);
+                CREATE TABLE IF NOT EXISTS bands (band TEXT NOT NULL, cluster_id TEXT NOT NULL);
+                CREATE INDEX IF NOT EXISTS idx_bands ON bands(band);
+            """)
+
+    def _lookup_keys(self, keys):
+        for key in keys:
+            row = self.conn.execute("SELECT cluster_id FROM keys WHERE key = ?", (key,)).fetchone()
+            if row:
+                return row[0]
+        return None
+
+    def _lookup_title(self, title, signature, keys):
+        bands = list(_band_hashes(signature))
+        placeholders = ",".join("?" * len(bands))
+        candidates = self.conn.execute(
+            f"SELECT DISTINCT c.cluster_id, c.title, c.signature FROM bands b JOIN clusters c ON c.cluster_id = b.cluster_id "
+            f"WHERE b.band IN ({placeholders})", bands).fetchall()
+        best_id, best_score = None, SIMILARITY_THRESHOLD
+        for cluster_id, cluster_title, blob in candidates:
+            score = signature_similarity(signature, _decode_signature(blob))
+            if score < best_score or _title_markers(title) != _title_markers(cluster_title or ""):
+                continue
+            # Same title but a different DOI/PMID/arXiv ID: two papers, not one
+            cluster_keys = [k for (k,) in self.conn.execute("SELECT key FROM keys WHERE cluster_id = ?", (cluster_id,))]
+            if _id_conflict(keys, cluster_keys):
+                continue
+            best_id, best_score = cluster_id, score
+        return best_id
+
+    def resolve(self, paper):
+        """Returns the cluster ID for a paper, registering new keys/titles as it goes"""
+        keys = crosswalk_keys(paper)
+        title = normalize_title(paper.get("title"))
+        signature = minhash_signature(title) if title_matchable(title) else None
+
+        cluster_id = self._lookup_keys(keys)
+        if cluster_id is None and signature:
+            cluster_id = self._lookup_title(title, signature, keys)
+
+        if cluster_id is None:
+            if keys:
+                cluster_id = keys[0]
+            elif signature:
+                cluster_id = "title:" + hashlib.sha1(title.encode()).hexdigest()
+            else:
+                # Nothing to match on: the record stands alone
+                cluster_id = "record:" + uuid.uuid4().hex
+            self.conn.execute("INSERT OR IGNORE INTO clusters VALUES (?, ?, ?)",
+                              (cluster_id, title, _encode_signature(signature) if signature else None))
+            if signature:
+                self.conn.executemany("INSERT INTO bands VALUES (?, ?)",
+                                      [(band, cluster_id) for band in _band_hashes(signature)])
+
+        self.conn.executemany("INSERT OR IGNORE INTO keys VALUES (?, ?)", [(k, cluster_id) for k in keys])
+        return cluster_id
+
+    def resolve_many(self, papers):
+        """Resolves a whole result set in one transaction"""
+        with self.lock, self.conn:
+            return [self.resolve(p) for p in papers]
+
+    def close(self):
+        self.conn.close()
+
+# --- Merging ---
+def merge_records(records):
+    """Merges duplicate records into one, keeping every source and identifier"""
+    merged = dict(records[0])
+    merged["sources"] = []
+    merged["source_ids"] = {}
+    for record in records:
+        source = record.get("source", "unknown")
+        if source not in merged["sources"]:
+            merged["sources"].append(source)
+        ids = merged["source_ids"].setdefault(source, [])
+        if record.get("id") and record["id"] not in ids:
+            ids.append(record["id"])
+        for field in ("doi", "pmcid", "pdf_url"):
+            if not merged.get(field) and record.get(field):
+                merged[field] = record[field]
+        # Prefer the longest abstract (PubMed esummary only carries the title)
+        if len(record.get("summary") or "") > len(merged.get("summary") or ""):
+            merged["summary"] = record["summary"]
+    return merged
+
+_default_index = None
+_default_lock = threading.Lock()
+
+def get_default_index():
+    global _default_index
+    with _default_lock:
+        if _default_index is None:
+            _default_index = PaperDedupIndex()
+        return _default_index
+
+def deduplicate_papers(papers, index=None):
+    """Collapses duplicate papers across sources.
+
+    Returns (merged_papers, removed_count); order follows first appearance.
+    """
+    if not papers:
+        return [], 0
+    index = index or get_default_index()
+    try:
+        cluster_ids = index.resolve_many(papers)
+    except sqlite3.Error as e:
+        print(f"[ERROR] Dedup index error: {e}")
+        return list(papers), 0
+
+    groups = {}
+    for cluster_id, paper in zip(cluster_ids, papers):
+        groups.setdefault(cluster_id, []).append(paper)
+
+    merged = [merge_records(group) for group in groups.values()]
+    removed = len(papers) - len(merged)
+    if removed:
+        print(f"[DEDUP] Removed {removed} duplicate(s) from {len(papers)} results")
+    return merged, removed
@@ -0,0 +1,220 @@
+"""
+Local full-text index over the BioC JSON articles NCBILoader stores in data/json.
+
+SQLite FTS5 (no outside services), one row per article with a column per
+section group so bm25 can weight them: title > abstract > results > methods /
+discussion > body / captions. Files are (re)indexed incrementally by mtime and
+size, and NCBILoader indexes each new download as it lands.
+
+Usage:
+    python fulltext_index.py sync
+    python fulltext_index.py search "seasonal malaria vaccination" --limit 5
+    python fulltext_index.py search '"rainy season" AND cohort' --raw
+"""
+import os
+import re
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import threading
+from src.metrics import span
+
+# --- Configuration ---
+FULLTEXT_DB_PATH = os.getenv("FULLTEXT_DB_PATH", "./data/fulltext.db")
+FULLTEXT_JSON_DIR = os.getenv("FULLTEXT_JSON_DIR", "./data/json")
+
+# Column order matters: it is the order of the bm25() weights below
+COLUMNS = ("title", "abstract", "results", "methods", "discussion", "body", "captions")
+COLUMN_WEIGHTS = (10.0, 5.0, 2.0, 1.5, 1.5, 1.0, 1.0)
+SECTION_COLUMNS = {
+    "TITLE": "title", "ABSTRACT": "abstract", "RESULTS": "results", "METHODS": "methods",
+    "DISCUSS": "discussion", "CONCL": "discussion", "FIG": "captions", "TABLE": "captions",
+}
+SKIP_SECTIONS = {"REF", "COMP_INT", "AUTH_CONT", "ACK_FUND", "SUPPL"}
+HIGHLIGHT = ("**", "**")  # snippet markers (Markdown bold)
+
+TERM_RE = re.compile(r'"[^"]+"|\S+')
+FTS_OPERATORS = {"AND", "OR", "NOT"}
+
+def normalize_pmcid(value):
+    value = str(value).strip()
+    return value if value.upper().startswith("PMC") else f"PMC{value}"
+
+def extract_sections(bioc):
+    """{column: text} from a BioC JSON collection (the API returns a list of collections)"""
+    collections = bioc if isinstance(bioc, list) else [bioc]
+    parts = {column: [] for column in COLUMNS}
+    for collection in collections:
+        for document in collection.get("documents", []):
+            for passage in document.get("passages", []):
+                infons = passage.get("infons", {})
+                section = infons.get("section_type", "").upper()
+                text = (passage.get("text") or "").strip()
+                if not text or section in SKIP_SECTIONS:
+                    continue
+                column = SECTION_COLUMNS.get(section)
+                if column is None:
+                    column = "title" if infons.get("type") == "front" and not parts["title"] else "body"
+                parts[column].append(text)
+    return {column: "\n".join(texts) for column, texts in parts.items()}
+
+def build_match(query):
+    """
+    Turns a free-text query into FTS5 syntax: quoted phrases stay phrases,
+    AND/OR/NOT pass through, every other word is quoted (so punctuation such
+    as COVID-19 cannot break the parser). Terms are implicitly AND-ed.
+    """
+    terms = []
+    for term in TERM_RE.findall(query):
+        if term in FTS_OPERATORS:
+            terms.append(term)
+        elif term.startswith('"'):
+            terms.append(term)
+        else:
+            cleaned = term.replace('"', "").strip("()")
+            if cleaned:
+                terms.append(f'"{cleaned}"')
+    while terms and terms[-1] in FTS_OPERATORS:
+        terms.pop()
+    return " ".join(terms)
+
+class FullTextIndex:
+    def __init__(self, path=FULLTEXT_DB_PATH, json_dir=FULLTEXT_JSON_DIR):
+        self.path = path
+        self.json_dir = json_dir
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._conn()
+        with conn:
+            conn.executescript(f"""
+                CREATE TABLE IF NOT EXISTS articles (
+                    pmcid TEXT PRIMARY KEY,
+                    path TEXT NOT NULL,
+                    mtime REAL NOT NULL,
+                    size INTEGER NOT NULL,
+                    title TEXT,
+                    indexed_at REAL NOT NULL
+                );
+                CREATE VIRTUAL TABLE IF NOT EXISTS articles_fts USING fts5(
+                    pmcid UNINDEXED, {", ".join(COLUMNS)},
+                    tokenize = 'porter unicode61'
+                );
+            """)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    # --- Indexing ---
+    def index_file(self, path, force=False):
+        """Indexes one BioC JSON file; skipped when mtime and size are unchanged"""
+        pmcid = normalize_pmcid(os.path.splitext(os.path.basename(path))[0])
+        stat = os.stat(path)
+        conn = self._conn()
+        row = conn.execute("SELECT mtime, size FROM articles WHERE pmcid = ?", (pmcid,)).fetchone()
+        if row and not force and row["mtime"] == stat.st_mtime and row["size"] == stat.st_size:
+            return False
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                sections = extract_sections(json.load(f))
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"[WARN] Skipping unreadable BioC file {path}: {e}")
+            return False
+        with conn:
+            conn.execute("DELETE FROM articles_fts WHERE pmcid = ?", (pmcid,))
+            conn.execute(f"INSERT INTO articles_fts (pmcid, {', '.join(COLUMNS)}) VALUES (?{', ?' * len(COLUMNS)})",
+                         (pmcid, *(sections[c] for c in COLUMNS)))
+            conn.execute("INSERT OR REPLACE INTO articles (pmcid, path, mtime, size, title, indexed_at) "
+                         "VALUES (?, ?, ?, ?, ?, ?)",
+                         (pmcid, os.path.abspath(path), stat.st_mtime, stat.st_size,
+                          sections["title"].split("\n")[0][:500], time.time()))
+        return True
+
+    def sync(self):
+        """Indexes new or changed files under json_dir and drops entries whose file is gone"""
+        if not os.path.isdir(self.json_dir):
+            return {"indexed": 0, "removed": 0}
+        with span("fulltext_sync", source="local"):
+            seen, indexed = set(), 0
+            for name in os.listdir(self.json_dir):
+                if name.endswith(".json"):
+                    path = os.path.join(self.json_dir, name)
+                    seen.add(normalize_pmcid(os.path.splitext(name)[0]))
+                    indexed += self.index_file(path)
+            conn = self._conn()
+            gone = [r["pmcid"] for r in conn.execute("SELECT pmcid FROM articles") if r["pmcid"] not in seen]
+            with conn:
+                for pmcid in gone:
+                    conn.execute("DELETE FROM articles_fts WHERE pmcid = ?", (pmcid,))
+                    conn.execute("DELETE FROM articles WHERE pmcid = ?", (pmcid,))
+        return {"indexed": indexed, "removed": len(gone)}
+
+    # --- Search ---
+    def search(self, query, limit=10, raw=False):
+        """
+        Ranked hits [{pmcid, title, path, score, snippet}], best first. raw=True
+        passes the query to FTS5 unchanged (NEAR, column filters, prefixes).
+        """
+        match = query if raw else build_match(query)
+        if not match:
+            return []
+        weights = ", ".join(str(w) for w in COLUMN_WEIGHTS)
+        sql = f"""
+            SELECT f.pmcid, a.title, a.path,
+                   bm25(articles_fts, 0.0, {weights}) AS score,
+                   snippet(articles_fts, -1, ?, ?, '…', 24) AS snippet
+            FROM articles_fts f JOIN articles a ON a.pmcid = f.pmcid
+            WHERE articles_fts MATCH ?
+            ORDER BY score LIMIT ?
+        """
+        with span("fulltext_search", source="local") as sp:
+            try:
+                rows = self._conn().execute(sql, (*HIGHLIGHT, match, limit)).fetchall()
+            except sqlite3.OperationalError as e:
+                print(f"[WARN] Full-text query '{match}' failed: {e}")
+                sp.status = "error"
+                return []
+        return [dict(r) for r in rows]
+
+    def has(self, pmcid):
+        return self._conn().execute("SELECT 1 FROM articles WHERE pmcid = ?", (normalize_pmcid(pmcid),)).fetchone() is not None
+
+    def path_for(self, pmcid):
+        row = self._conn().execute("SELECT path FROM articles WHERE pmcid = ?", (normalize_pmcid(pmcid),)).fetchone()
+        return row["path"] if row else None
+
+    def count(self):
+        return self._conn().execute("SELECT COUNT(*) FROM articles").fetchone()[0]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local full-text index over stored BioC articles.")
+    parser.add_argument("--db", default=FULLTEXT_DB_PATH)
+    parser.add_argument("--json-dir", default=FULLTEXT_JSON_DIR)
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("sync", help="Index new/changed files")
+    search = sub.add_parser("search", help="Search the index")
+    search.add_argument("query")
+    search.add_argument("--limit", type=int, default=10)
+    search.add_argument("--raw", action="store_true", help="Pass the query to FTS5 unchanged")
+    args = parser.parse_args(argv)
+
+    index = FullTextIndex(args.db, args.json_dir)
+    if args.command == "sync":
+        print(f"[FULLTEXT] {index.sync()} ({index.count()} articles)")
+        return 0
+    started = time.perf_counter()
+    hits = index.search(args.query, args.limit, raw=args.raw)
+    for hit in hits:
+        print(f"{hit['pmcid']:<12} {hit['score']:8.2f}  {hit['title'][:80]}\n    {hit['snippet']}")
+    print(f"[FULLTEXT] {len(hits)} hit(s) in {(time.perf_counter() - started) * 1000:.1f} ms")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
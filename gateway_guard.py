@@ -0,0 +1,204 @@
+import os
+import time
+import threading
+from urllib.parse import urlparse
+from src.metrics import registry
+
+# --- Configuration ---
+GATEWAY_INITIAL_CONCURRENCY = float(os.getenv("GATEWAY_INITIAL_CONCURRENCY", "4"))
+GATEWAY_MIN_CONCURRENCY = float(os.getenv("GATEWAY_MIN_CONCURRENCY", "1"))
+GATEWAY_MAX_CONCURRENCY = float(os.getenv("GATEWAY_MAX_CONCURRENCY", "32"))
+GATEWAY_QUEUE_TIMEOUT = float(os.getenv("GATEWAY_QUEUE_TIMEOUT", "120"))        # max wait for a slot (s)
+GATEWAY_BACKOFF = 0.5               # multiplicative decrease on 429 / 5xx
+GATEWAY_LATENCY_BACKOFF = 0.9       # gentler decrease when latency climbs
+GATEWAY_LATENCY_TOLERANCE = 2.0     # short-term latency above 2x the baseline counts as congestion
+GATEWAY_DECREASE_INTERVAL = 1.0     # one decrease per congestion event, not one per failed request
+GATEWAY_MAX_PAUSE = 30.0            # cap on honouring Retry-After
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))   # consecutive errors
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", "30"))                  # seconds open before a probe
+
+# Request outcomes reported by llm_client
+OK = "ok"
+THROTTLED = "throttled"   # 429
+ERROR = "error"           # 5xx, timeouts, connection failures
+IGNORE = "ignore"         # client errors (400/404) say nothing about gateway capacity
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+BREAKER_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limit: +1/limit per healthy response (about +1 per round of
+    requests), halved on 429/5xx, trimmed when the short-term latency average
+    drifts well above the long-term baseline.
+    """
+
+    def __init__(self, initial=GATEWAY_INITIAL_CONCURRENCY, minimum=GATEWAY_MIN_CONCURRENCY,
+                 maximum=GATEWAY_MAX_CONCURRENCY):
+        self.limit = float(initial)
+        self.minimum = float(minimum)
+        self.maximum = float(maximum)
+        self.in_flight = 0
+        self.short_latency = None   # fast EWMA
+        self.baseline_latency = None  # slow EWMA
+        self.last_decrease = 0.0
+        self.paused_until = 0.0
+        self.cond = threading.Condition()
+
+    def acquire(self, timeout=GATEWAY_QUEUE_TIMEOUT):
+        """Waits for a free slot; False if none freed up within timeout"""
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            while True:
+                now = time.monotonic()
+                if self.in_flight < int(self.limit) and now >= self.paused_until:
+                    self.in_flight += 1
+                    return True
+                remaining = deadline - now
+                if remaining <= 0:
+                    return False
+                if now < self.paused_until:
+                    remaining = min(remaining, self.paused_until - now)
+                self.cond.wait(remaining)
+
+    def release(self, outcome, latency, retry_after=None):
+        with self.cond:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if outcome in (THROTTLED, ERROR):
+                self._decrease(now, GATEWAY_BACKOFF)
+                if retry_after:
+                    self.paused_until = max(self.paused_until, now + min(retry_after, GATEWAY_MAX_PAUSE))
+            elif outcome == OK:
+                self._observe_latency(latency)
+                if self.baseline_latency and self.short_latency > self.baseline_latency * GATEWAY_LATENCY_TOLERANCE:
+                    self._decrease(now, GATEWAY_LATENCY_BACKOFF)
+                else:
+                    self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            self.cond.notify_all()
+
+    def _observe_latency(self, latency):
+        if self.short_latency is None:
+            self.short_latency = self.baseline_latency = latency
+            return
+        self.short_latency += 0.2 * (latency - self.short_latency)
+        self.baseline_latency += 0.02 * (latency - self.baseline_latency)
+
+    def _decrease(self, now, factor):
+        if now - self.last_decrease < GATEWAY_DECREASE_INTERVAL:
+            return
+        self.last_decrease = now
+        self.limit = max(self.minimum, self.limit * factor)
+
+class CircuitBreaker:
+    """
+    Opens after BREAKER_FAILURE_THRESHOLD consecutive errors and fails fast for
+    BREAKER_COOLDOWN seconds; then lets a single probe through (half-open) and
+    closes again if it succeeds. 429s are left to the limiter.
+    """
+
+    def __init__(self, threshold=BREAKER_FAILURE_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self.lock = threading.Lock()
+
+    def current_state(self):
+        with self.lock:
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.cooldown:
+                return HALF_OPEN
+            return self.state
+
+    def allow(self):
+        with self.lock:
+            if self.state == OPEN:
+                if time.monotonic() - self.opened_at < self.cooldown:
+                    return False
+                self.state = HALF_OPEN
+                self.probe_in_flight = False
+            if self.state == HALF_OPEN:
+                if self.probe_in_flight:
+                    return False
+                self.probe_in_flight = True
+            return True
+
+    def record(self, outcome):
+        with self.lock:
+            if outcome == OK:
+                self.failures = 0
+                self.state = CLOSED
+            elif outcome == ERROR:
+                self.failures += 1
+                if self.state == HALF_OPEN or self.failures >= self.threshold:
+                    self.state = OPEN
+                    self.opened_at = time.monotonic()
+            if self.state == HALF_OPEN:
+                # Throttled or ignored probe: let the next request try again
+                self.probe_in_flight = False
+
+class Permit:
+    """One admitted request; release() reports how it went"""
+
+    def __init__(self, guard):
+        self.guard = guard
+        self.started = time.perf_counter()
+
+    def release(self, outcome, retry_after=None):
+        self.guard._release(outcome, time.perf_counter() - self.started, retry_after)
+
+class GatewayGuard:
+    """Limiter and breaker for one model on one gateway"""
+
+    def __init__(self, model, base_url):
+        self.labels = {"model": model, "gateway": urlparse(base_url or "").netloc or "default"}
+        self.limiter = AdaptiveLimiter()
+        self.breaker = CircuitBreaker()
+        self._publish()
+
+    def acquire(self, timeout=GATEWAY_QUEUE_TIMEOUT):
+        """A Permit, or None when the breaker is open or no slot frees up in time"""
+        if not self.breaker.allow():
+            registry.inc("llm_circuit_rejections", **self.labels)
+            self._publish()
+            return None
+        if not self.limiter.acquire(timeout):
+            self.breaker.record(IGNORE)
+            registry.inc("llm_limiter_timeouts", **self.labels)
+            return None
+        self._publish()
+        return Permit(self)
+
+    def _release(self, outcome, latency, retry_after):
+        self.limiter.release(outcome, latency, retry_after)
+        self.breaker.record(outcome)
+        if outcome == THROTTLED:
+            registry.inc("llm_throttled", **self.labels)
+        self._publish()
+
+    def _publish(self):
+        registry.set_gauge("llm_concurrency_limit", round(self.limiter.limit, 2), **self.labels)
+        registry.set_gauge("llm_in_flight", self.limiter.in_flight, **self.labels)
+        registry.set_gauge("llm_circuit_state", BREAKER_STATE_VALUES[self.breaker.current_state()], **self.labels)
+
+    def snapshot(self):
+        return {**self.labels, "limit": round(self.limiter.limit, 2), "in_flight": self.limiter.in_flight,
+                "circuit": self.breaker.current_state()}
+
+_guards = {}
+_guards_lock = threading.Lock()
+
+def get_guard(model, base_url):
+    with _guards_lock:
+        key = (model, base_url)
+        if key not in _guards:
+            _guards[key] = GatewayGuard(model, base_url)
+        return _guards[key]
+
+def guard_snapshot():
+    """Rows of {model, gateway, limit, in_flight, circuit} for dashboards"""
+    with _guards_lock:
+        guards = list(_guards.values())
+    return [g.snapshot() for g in guards]
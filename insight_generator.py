@@ -1,9 +1,11 @@
 import os
 import json
 import re
+import hashlib
 from pydantic import BaseModel, Field, ValidationError
 from typing import List
-from src.llm_client import get_llm_response
+from src.llm_router import routed_llm_response, routed_model
+from src.metrics import span
 
 # Get Model ID from env
 MODEL_NAME = os.getenv("MODEL_REASONING", "azure/genailab-maas-gpt-4o")
@@ -26,6 +28,28 @@ class ComparisonInsight(BaseModel):
     conclusion: str = Field(description="Synthesis conclusion")
     key_findings: List[str] = Field(description="List of key comparative findings")
 
+# Built once; PAPER_INSIGHT_VERSION changes whenever the schema or the prompt wording does,
+# which is what invalidates stored insights (see insight_store)
+PAPER_SYSTEM_PROMPT = f"""
+    You are a scientific analyst. Analyze the provided text.
+    You MUST return the output as a valid JSON object matching this schema exactly:
+    {json.dumps(PaperInsight.model_json_schema())}
+    
+    Do not add any markdown formatting or explanation text outside the JSON.
+    """
+PAPER_USER_TEMPLATE = "Text to analyze:\n{text}"
+PAPER_TEXT_LIMIT = 25000  # Truncate to be safe
+PAPER_INSIGHT_VERSION = hashlib.sha256(
+    f"{PAPER_SYSTEM_PROMPT}|{PAPER_USER_TEMPLATE}|{PAPER_TEXT_LIMIT}".encode("utf-8")).hexdigest()[:12]
+
+COMPARISON_SYSTEM_PROMPT = f"""
+    Compare the provided scientific papers.
+    You MUST return the output as a valid JSON object matching this schema exactly:
+    {json.dumps(ComparisonInsight.model_json_schema())}
+    
+    For 'tabular_data', return a string formatted as a Markdown table.
+    """
+
 def clean_json_string(text_response):
     """Helper to strip ```json markdown blocks from LLM response"""
     if not text_response:
@@ -35,31 +59,29 @@ def clean_json_string(text_response):
     cleaned = re.sub(r"```", "", cleaned)
     return cleaned.strip()
 
+def validates_as(model_cls):
+    """Response check for the router: a hedge only wins if its JSON fits the schema"""
+    return lambda text: model_cls.model_validate_json(clean_json_string(text))
+
+def insight_failed(insight):
+    """generate_paper_insight returns a placeholder instead of raising; this spots it"""
+    return insight.methodology_score == 0 and insight.background == "Error parsing model response"
+
 def generate_paper_insight(text: str) -> PaperInsight:
     """Generates structured insight for a single paper using Internal API."""
     
-    # We construct a prompt that explicitly asks for JSON matching the schema
-    schema_desc = PaperInsight.model_json_schema()
-    
-    system_prompt = f"""
-    You are a scientific analyst. Analyze the provided text.
-    You MUST return the output as a valid JSON object matching this schema exactly:
-    {json.dumps(schema_desc)}
-    
-    Do not add any markdown formatting or explanation text outside the JSON.
-    """
-
-    user_prompt = f"Text to analyze:\n{text[:25000]}" # Truncate to be safe
-
+    # The system prompt (schema included) is built once at import
     messages = [
-        {"role": "system", "content": system_prompt},
-        {"role": "user", "content": user_prompt}
+        {"role": "system", "content": PAPER_SYSTEM_PROMPT},
+        {"role": "user", "content": PAPER_USER_TEMPLATE.format(text=text[:PAPER_TEXT_LIMIT])}
     ]
     
     try:
-        response_text = get_llm_response(messages, MODEL_NAME, json_mode=True)
-        cleaned_json = clean_json_string(response_text)
-        return PaperInsight.model_validate_json(cleaned_json)
+        response_text = routed_llm_response(messages, "insight", validate=validates_as(PaperInsight), json_mode=True)
+        with span("json_clean", source="paper_insight", model=routed_model()):
+            cleaned_json = clean_json_string(response_text)
+        with span("schema_validate", source="paper_insight", model=routed_model()):
+            return PaperInsight.model_validate_json(cleaned_json)
     except (ValidationError, json.JSONDecodeError, Exception) as e:
         print(f"Error generating paper insight: {e}")
         return PaperInsight(
@@ -75,27 +97,17 @@ def generate_paper_insight(text: str) -> PaperInsight:
 def generate_comparison_insight(papers_text: str) -> ComparisonInsight:
     """Generates comparative insight for multiple papers."""
     
-    schema_desc = ComparisonInsight.model_json_schema()
-    
-    system_prompt = f"""
-    Compare the provided scientific papers.
-    You MUST return the output as a valid JSON object matching this schema exactly:
-    {json.dumps(schema_desc)}
-    
-    For 'tabular_data', return a string formatted as a Markdown table.
-    """
-
-    user_prompt = f"Papers Content:\n{papers_text[:40000]}"
-
     messages = [
-        {"role": "system", "content": system_prompt},
-        {"role": "user", "content": user_prompt}
+        {"role": "system", "content": COMPARISON_SYSTEM_PROMPT},
+        {"role": "user", "content": f"Papers Content:\n{papers_text[:40000]}"}
     ]
     
     try:
-        response_text = get_llm_response(messages, MODEL_NAME, json_mode=True)
-        cleaned_json = clean_json_string(response_text)
-        return ComparisonInsight.model_validate_json(cleaned_json)
+        response_text = routed_llm_response(messages, "compare", validate=validates_as(ComparisonInsight), json_mode=True)
+        with span("json_clean", source="comparison_insight", model=routed_model()):
+            cleaned_json = clean_json_string(response_text)
+        with span("schema_validate", source="comparison_insight", model=routed_model()):
+            return ComparisonInsight.model_validate_json(cleaned_json)
     except Exception as e:
         print(f"Error generating comparison insight: {e}")
         return ComparisonInsight(
@@ -0,0 +1,204 @@
+"""
+Shared, persistent cache of paper insights.
+
+One SQLite table keyed by (paper key, input-text hash, prompt/schema version,
+model), shared by every session, both UIs and the batch tools, and surviving
+restarts. The version is PAPER_INSIGHT_VERSION, a hash of the prompt and the
+PaperInsight schema, so editing either silently invalidates old entries;
+`prune` deletes them. Failed (placeholder) insights are never stored.
+
+Usage:
+    python insight_store.py warm watchlist.txt --limit 5 --workers 4
+    python insight_store.py stats
+    python insight_store.py prune
+"""
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import os
+import sys
+import time
+import sqlite3
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from src.insight_generator import (PaperInsight, generate_paper_insight, insight_failed,
+                                   MODEL_NAME, PAPER_INSIGHT_VERSION)
+from src.llm_router import routed_model
+from src.corpus_store import paper_key, record_insight
+from src.metrics import registry, span
+
+# --- Configuration ---
+INSIGHT_DB_PATH = os.getenv("INSIGHT_DB_PATH", "./data/insight_store.db")
+INSIGHT_STORE_ENABLED = os.getenv("INSIGHT_STORE_ENABLED", "1") == "1"
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:32]
+
+class InsightStore:
+    def __init__(self, path=INSIGHT_DB_PATH):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.lock = threading.Lock()
+        with self.conn:
+            if path != ":memory:":
+                self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS insights (
+                    paper_key TEXT NOT NULL,
+                    text_hash TEXT NOT NULL,
+                    version TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    insight TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    hits INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (paper_key, text_hash, version, model)
+                );
+            """)
+
+    def get(self, key, text, model=MODEL_NAME, version=PAPER_INSIGHT_VERSION):
+        """The stored PaperInsight for exactly this input, prompt version and model, or None"""
+        ident = (key, text_hash(text), version, model)
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT insight FROM insights WHERE paper_key = ? AND text_hash = ? AND version = ? AND model = ?",
+                ident).fetchone()
+            if row is None:
+                return None
+            with self.conn:
+                self.conn.execute("UPDATE insights SET hits = hits + 1 WHERE paper_key = ? AND text_hash = ? "
+                                  "AND version = ? AND model = ?", ident)
+        try:
+            return PaperInsight.model_validate_json(row[0])
+        except ValueError:
+            return None  # written under a schema this version string failed to capture
+
+    def put(self, key, text, insight, model=MODEL_NAME, version=PAPER_INSIGHT_VERSION):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO insights (paper_key, text_hash, version, model, insight, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, text_hash(text), version, model, insight.model_dump_json(), time.time()))
+
+    def prune(self, version=PAPER_INSIGHT_VERSION):
+        """Deletes entries written under any other prompt/schema version"""
+        with self.lock, self.conn:
+            return self.conn.execute("DELETE FROM insights WHERE version != ?", (version,)).rowcount
+
+    def stats(self):
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT version, model, COUNT(*), COALESCE(SUM(hits), 0) FROM insights GROUP BY version, model").fetchall()
+        return [{"version": v, "model": m, "entries": n, "hits": h, "current": v == PAPER_INSIGHT_VERSION}
+                for v, m, n, h in rows]
+
+_default_store = None
+_default_lock = threading.Lock()
+
+def get_insight_store():
+    global _default_store
+    with _default_lock:
+        if _default_store is None:
+            _default_store = InsightStore()
+        return _default_store
+
+def cached_paper_insight(paper, text, model=MODEL_NAME, store=None):
+    """
+    (insight, cached): the stored insight for this paper and text when there is
+    one, otherwise generate_paper_insight's result, stored (and recorded in the
+    corpus) if it succeeded. A store problem never blocks analysis.
+
+    Lookups ask for `model`; a new insight is stored under the model that
+    actually answered, so a failover answer from the fast model is not served
+    later as the reasoning model's.
+    """
+    store = store or (get_insight_store() if INSIGHT_STORE_ENABLED else None)
+    key = paper_key(paper)
+    if store is not None:
+        try:
+            with span("insight_store_get", source="local"):
+                insight = store.get(key, text, model)
+            if insight is not None:
+                registry.inc("insight_store_hits")
+                return insight, True
+        except sqlite3.Error as e:
+            print(f"[WARN] Insight store lookup failed: {e}")
+    registry.inc("insight_store_misses")
+    insight = generate_paper_insight(text)
+    if not insight_failed(insight):
+        answered_by = routed_model() or model
+        record_insight(paper, insight, model=answered_by)
+        if store is not None:
+            try:
+                store.put(key, text, insight, answered_by)
+            except sqlite3.Error as e:
+                print(f"[WARN] Could not store insight: {e}")
+    return insight, False
+
+def warm(args):
+    """Searches every watch-list line and precomputes insights for the papers found"""
+    from src.batch_runner import parse_input_line, resolve_item, paper_text, ProgressTracker
+    from src.arxiv_fetcher import ArxivLoader
+    from src.pubmed_fetcher import PubMedLoader
+    from src.dedup import deduplicate_papers
+
+    with open(args.watchlist, "r", encoding="utf-8") as f:
+        items = [item for item in map(parse_input_line, f) if item]
+    store = InsightStore(args.db)
+    arxiv_loader, pubmed_loader = ArxivLoader(), PubMedLoader()
+    counts = {"cached": 0, "generated": 0, "failed": 0}
+    counts_lock = threading.Lock()
+
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        papers = []
+        for future in as_completed([executor.submit(resolve_item, item, arxiv_loader, pubmed_loader, args.limit, True)
+                                    for item in items]):
+            try:
+                papers += future.result()
+            except Exception as e:
+                print(f"[ERROR] Watch-list fetch failed: {e}")
+        papers, removed = deduplicate_papers(papers)
+        print(f"[WARM] {len(items)} watch-list line(s) -> {len(papers)} unique papers ({removed} duplicates merged)")
+
+        progress = ProgressTracker(len(papers), "WARM")
+
+        def work(paper):
+            insight, cached = cached_paper_insight(paper, paper_text(paper), store=store)
+            outcome = "cached" if cached else ("failed" if insight_failed(insight) else "generated")
+            with counts_lock:
+                counts[outcome] += 1
+            progress.update(ok=outcome != "failed")
+
+        for future in as_completed([executor.submit(work, p) for p in papers]):
+            future.result()
+    print(f"[WARM] {counts['generated']} generated, {counts['cached']} already stored, {counts['failed']} failed")
+    return 0 if not counts["failed"] else 1
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Shared insight store: warm-up and maintenance.")
+    parser.add_argument("--db", default=INSIGHT_DB_PATH)
+    sub = parser.add_subparsers(dest="command", required=True)
+    warm_cmd = sub.add_parser("warm", help="Precompute insights for a watch-list (batch_runner input format)")
+    warm_cmd.add_argument("watchlist")
+    warm_cmd.add_argument("--limit", type=int, default=5, help="Papers per source per query")
+    warm_cmd.add_argument("--workers", type=int, default=4)
+    sub.add_parser("stats", help="Entries and hits per prompt version and model")
+    sub.add_parser("prune", help="Delete entries from older prompt/schema versions")
+    args = parser.parse_args(argv)
+
+    if args.command == "warm":
+        return warm(args)
+    store = InsightStore(args.db)
+    if args.command == "prune":
+        print(f"[INSIGHTS] Removed {store.prune()} stale entries")
+        return 0
+    for row in store.stats():
+        print(f"{row['version']}{' (current)' if row['current'] else ''}  {row['model']}: "
+              f"{row['entries']} entries, {row['hits']} hits")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,385 @@
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import threading
+import traceback
+from src.arxiv_fetcher import ArxivLoader
+from src.pubmed_fetcher import PubMedLoader
+from src.insight_generator import PaperInsight, insight_failed
+from src.comparison_engine import compare_papers
+from src.insight_store import cached_paper_insight
+from src.query_refiner import refine_query
+from src.dedup import deduplicate_papers
+from src.reranker import rerank, RERANK_POOL, RERANK_TOP_N
+from src.deadline import (Deadline, deadline_scope, check, request_done, DeadlineExceeded, Cancelled,
+                          SEARCH_BUDGET, ANALYSIS_BUDGET)
+
+# --- Configuration ---
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", "./data/jobs.db")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+POLL_INTERVAL = 0.5
+# Speculative (negative-priority) jobs may occupy at most this many workers
+SPECULATIVE_MAX_RUNNING = int(os.getenv("SPECULATIVE_MAX_RUNNING", str(max(1, JOB_WORKERS // 2))))
+# Jobs of a session that has not polled for this long (tab closed) are cancelled
+SESSION_LEASE_SECONDS = float(os.getenv("SESSION_LEASE_SECONDS", "30"))
+# A running job is owned by its process for this long and renewed while it runs;
+# only jobs whose lease ran out (the owner died) are re-queued
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60"))
+# Finished jobs are deleted this long after they ended
+JOB_RETENTION_SECONDS = float(os.getenv("JOB_RETENTION_SECONDS", str(7 * 24 * 3600)))
+PRUNE_INTERVAL = 600
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+PRIORITY_NORMAL, PRIORITY_SPECULATIVE = 0, -1
+
+class JobQueue:
+    """Persistent SQLite-backed job queue with an in-process worker pool.
+
+    Jobs carry an ID, status, progress and JSON result, all stored in SQLite so
+    a page refresh or a server restart does not lose them. Workers pick the
+    oldest queued job from the session with the fewest running jobs, so one
+    long analysis cannot starve other sessions. Speculative jobs (negative
+    priority) only run when no normal job is queued, and never on more than
+    SPECULATIVE_MAX_RUNNING workers at once.
+
+    A job may carry a time budget (submit(..., budget=seconds)); its handler
+    runs under that deadline (see deadline.py), counted from submission, and a
+    job whose budget ran out while queued fails without running. Running jobs
+    can be cancelled (cancel(job_id, running=True)). A session that calls
+    heartbeat() and then stops for SESSION_LEASE_SECONDS (a closed tab) has its
+    normal jobs cancelled; a page refresh heartbeats again well within that.
+    Speculative jobs run while nobody polls, so only their budget bounds them.
+
+    Several processes (e.g. Streamlit and the batch runner) can share one
+    database: a claimed job records its owner and a lease that the owner's
+    watchdog renews, and only jobs whose lease lapsed are re-queued. Finished
+    jobs are pruned after JOB_RETENTION_SECONDS.
+    """
+
+    def __init__(self, path=JOB_DB_PATH, workers=JOB_WORKERS):
+        self.path = path
+        self.workers = workers
+        self.handlers = {}
+        self.budgets = {}       # kind -> default time budget in seconds
+        self._local = threading.local()
+        self._threads = []
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+        self._running = {}      # job id -> (session id, priority, Deadline) of jobs running in this process
+        self._heartbeats = {}   # session id -> monotonic time of its last heartbeat
+        self._lock = threading.Lock()
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._pruned = 0.0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        conn = self._conn()
+        with conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    session_id TEXT,
+                    params TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    priority INTEGER NOT NULL DEFAULT 0,
+                    progress REAL NOT NULL DEFAULT 0,
+                    message TEXT,
+                    result TEXT,
+                    error TEXT,
+                    created REAL NOT NULL,
+                    updated REAL NOT NULL,
+                    deadline REAL,
+                    owner TEXT,
+                    lease REAL
+                );
+                CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, created);
+            """)
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if "priority" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN priority INTEGER NOT NULL DEFAULT 0")
+            if "deadline" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN deadline REAL")
+            for column in ("owner TEXT", "lease REAL"):
+                if column.split()[0] not in columns:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {column}")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_session ON jobs(status, session_id)")
+        self._requeue_expired()
+        self._prune()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    # --- Public API ---
+    def register(self, kind, handler, budget=None):
+        """Registers handler(params, progress) -> JSON-serializable result, with an optional default budget"""
+        self.handlers[kind] = handler
+        self.budgets[kind] = budget
+
+    def submit(self, kind, params, session_id=None, priority=PRIORITY_NORMAL, budget=None):
+        """Queues a job; budget (seconds from now) bounds how long it may take, including queueing"""
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        job_id = uuid.uuid4().hex[:12]
+        now = time.time()
+        budget = budget if budget is not None else self.budgets.get(kind)
+        self._conn().execute(
+            "INSERT INTO jobs (id, kind, session_id, params, status, priority, created, updated, deadline) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, kind, session_id, json.dumps(params), QUEUED, priority, now, now,
+             now + budget if budget is not None else None))
+        self._wakeup.set()
+        return job_id
+
+    def cancel(self, job_id, running=False):
+        """
+        Cancels a job that has not started yet; True if it was still queued.
+        With running=True a job already running in this process is told to stop
+        as well (it ends as cancelled at its next deadline check or call).
+        """
+        cursor = self._conn().execute("UPDATE jobs SET status = ?, updated = ? WHERE id = ? AND status = ?",
+                                      (CANCELLED, time.time(), job_id, QUEUED))
+        if cursor.rowcount > 0:
+            return True
+        if running:
+            with self._lock:
+                entry = self._running.get(job_id)
+            if entry is not None:
+                entry[2].cancel("job cancelled")
+                return True
+        return False
+
+    def heartbeat(self, session_id):
+        """Marks a session as still watching its jobs (called on every UI run)"""
+        with self._lock:
+            self._heartbeats[session_id] = time.monotonic()
+
+    def _cancel_abandoned(self):
+        """Cancels normal jobs of sessions whose heartbeat lapsed; sessions that never sent one are left alone"""
+        cutoff = time.monotonic() - SESSION_LEASE_SECONDS
+        with self._lock:
+            gone = {session_id for session_id, seen in self._heartbeats.items() if seen < cutoff}
+            for session_id in gone:
+                del self._heartbeats[session_id]
+            running = [deadline for session_id, priority, deadline in self._running.values()
+                       if session_id in gone and priority >= PRIORITY_NORMAL]
+        for deadline in running:
+            deadline.cancel("session went away")
+        for session_id in gone:
+            self._conn().execute("UPDATE jobs SET status = ?, updated = ? WHERE session_id = ? AND status = ? AND priority >= ?",
+                                 (CANCELLED, time.time(), session_id, QUEUED, PRIORITY_NORMAL))
+
+    def _renew_leases(self):
+        self._conn().execute("UPDATE jobs SET lease = ? WHERE owner = ? AND status = ?",
+                             (time.time() + JOB_LEASE_SECONDS, self.owner, RUNNING))
+
+    def _requeue_expired(self):
+        """Re-queues running jobs whose owner stopped renewing the lease (a crashed or killed process)"""
+        cursor = self._conn().execute(
+            "UPDATE jobs SET status = ?, owner = NULL, lease = NULL, updated = ? "
+            "WHERE status = ? AND (lease IS NULL OR lease < ?)", (QUEUED, time.time(), RUNNING, time.time()))
+        if cursor.rowcount > 0:
+            print(f"[WARN] Re-queued {cursor.rowcount} job(s) left running by a process that went away")
+            self._wakeup.set()
+
+    def _prune(self):
+        """Deletes finished jobs older than JOB_RETENTION_SECONDS"""
+        self._pruned = time.monotonic()
+        self._conn().execute("DELETE FROM jobs WHERE status IN (?, ?, ?) AND updated < ?",
+                             (DONE, FAILED, CANCELLED, time.time() - JOB_RETENTION_SECONDS))
+
+    def _watchdog_loop(self):
+        while not self._stop.wait(POLL_INTERVAL * 2):
+            try:
+                self._renew_leases()
+                self._cancel_abandoned()
+                self._requeue_expired()
+                if time.monotonic() - self._pruned > PRUNE_INTERVAL:
+                    self._prune()
+            except sqlite3.Error as e:
+                print(f"[ERROR] Job queue watchdog failed: {e}")
+
+    def promote(self, job_id, priority=PRIORITY_NORMAL):
+        """
+        Raises the priority of a queued job, e.g. when speculative work becomes
+        real; its budget starts over, since someone is waiting for it from now on.
+        """
+        row = self._conn().execute("SELECT kind FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        budget = self.budgets.get(row["kind"]) if row else None
+        now = time.time()
+        self._conn().execute("UPDATE jobs SET priority = ?, deadline = ?, updated = ? WHERE id = ? AND status = ? AND priority < ?",
+                             (priority, now + budget if budget is not None else None, now, job_id, QUEUED, priority))
+        self._wakeup.set()
+
+    def get(self, job_id):
+        row = self._conn().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    def get_many(self, job_ids):
+        return [self.get(job_id) for job_id in job_ids]
+
+    def list_jobs(self, session_id=None, limit=50):
+        if session_id:
+            rows = self._conn().execute("SELECT * FROM jobs WHERE session_id = ? ORDER BY created DESC LIMIT ?",
+                                        (session_id, limit)).fetchall()
+        else:
+            rows = self._conn().execute("SELECT * FROM jobs ORDER BY created DESC LIMIT ?", (limit,)).fetchall()
+        return [self._to_dict(r) for r in rows]
+
+    def start(self):
+        if self._threads:
+            return self
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker_loop, name=f"job-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        watchdog = threading.Thread(target=self._watchdog_loop, name="job-watchdog", daemon=True)
+        watchdog.start()
+        self._threads.append(watchdog)
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+        for t in self._threads:
+            t.join(timeout=5)
+        self._threads = []
+
+    # --- Worker Internals ---
+    def _to_dict(self, row):
+        job = dict(row)
+        job["params"] = json.loads(job["params"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def _claim(self):
+        """Atomically moves the next fair-share job from queued to running"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Running counts are taken once per claim from the running rows only
+            speculative = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = ? AND priority < 0",
+                                       (RUNNING,)).fetchone()[0]
+            row = conn.execute("""
+                WITH busy AS (SELECT session_id, COUNT(*) AS n FROM jobs WHERE status = ? GROUP BY session_id)
+                SELECT j.* FROM jobs j LEFT JOIN busy b ON b.session_id IS j.session_id
+                WHERE j.status = ? AND (j.priority >= 0 OR ?)
+                ORDER BY j.priority DESC, COALESCE(b.n, 0), j.created
+                LIMIT 1
+            """, (RUNNING, QUEUED, speculative < SPECULATIVE_MAX_RUNNING)).fetchone()
+            if row:
+                now = time.time()
+                conn.execute("UPDATE jobs SET status = ?, owner = ?, lease = ?, updated = ? WHERE id = ?",
+                             (RUNNING, self.owner, now + JOB_LEASE_SECONDS, now, row["id"]))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return self._to_dict(row) if row else None
+
+    def _update(self, job_id, **fields):
+        fields["updated"] = time.time()
+        assignments = ", ".join(f"{k} = ?" for k in fields)
+        self._conn().execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    def _worker_loop(self):
+        while not self._stop.is_set():
+            try:
+                job = self._claim()
+            except sqlite3.Error as e:
+                print(f"[ERROR] Job queue claim failed: {e}")
+                job = None
+            if job is None:
+                self._wakeup.wait(POLL_INTERVAL)
+                self._wakeup.clear()
+                continue
+            self._run(job)
+
+    def _run(self, job):
+        job_id = job["id"]
+
+        def progress(fraction, message=None):
+            self._update(job_id, progress=max(0.0, min(1.0, fraction)), message=message)
+
+        budget = job["deadline"] - time.time() if job.get("deadline") is not None else None
+        if budget is not None and budget <= 0:
+            self._update(job_id, status=FAILED, error="Deadline exceeded before the job started")
+            return
+        deadline = Deadline(budget, name=f"{job['kind']} job")
+        with self._lock:
+            self._running[job_id] = (job["session_id"], job["priority"], deadline)
+        try:
+            with deadline_scope(deadline=deadline):
+                result = self.handlers[job["kind"]](job["params"], progress)
+            status = CANCELLED if deadline.cancelled else DONE
+            self._update(job_id, status=status, progress=1.0, result=json.dumps(result))
+        except Cancelled as e:
+            self._update(job_id, status=CANCELLED, error=str(e))
+        except DeadlineExceeded as e:
+            print(f"[WARN] Job {job_id} ({job['kind']}): {e}")
+            self._update(job_id, status=FAILED, error=str(e))
+        except Exception as e:
+            print(f"[ERROR] Job {job_id} ({job['kind']}) failed: {e}")
+            traceback.print_exc()
+            self._update(job_id, status=FAILED, error=str(e))
+        finally:
+            with self._lock:
+                self._running.pop(job_id, None)
+
+# --- Analysis Job Handlers ---
+def search_job(params, progress):
+    progress(0.1, "Refining query")
+    refined = refine_query(params["query"])
+    # Fetch wide, then rank locally and show only the best matches
+    pool = params.get("pool", RERANK_POOL)
+    progress(0.3, "Searching arXiv")
+    arxiv_papers = ArxivLoader().fetch_papers(refined.arxiv(), limit=pool)
+    progress(0.6, "Searching PubMed")
+    pubmed_papers = PubMedLoader().fetch_papers(refined.pubmed(), limit=pool)
+    papers, removed = deduplicate_papers(arxiv_papers + pubmed_papers)
+    progress(0.9, f"Ranking {len(papers)} candidates")
+    ranked = rerank(refined, papers, params.get("top_n", RERANK_TOP_N))
+    # A source that ran out of time returns nothing; the other source's results still count
+    return {"refined_query": refined.display, "refine_method": refined.method,
+            "papers": ranked, "duplicates_removed": removed, "candidates": len(papers),
+            "partial": request_done()}
+
+def fetch_job(params, progress):
+    papers = ArxivLoader().fetch_by_ids(params.get("arxiv_ids", []))
+    progress(0.5, "Fetching PubMed records")
+    papers += PubMedLoader().fetch_by_ids(params.get("pmids", []))
+    return {"papers": papers}
+
+def insight_job(params, progress):
+    paper = params["paper"]
+    progress(0.1, f"Analyzing {paper['title'][:60]}")
+    text_content = f"Title: {paper['title']}\nAbstract: {paper['summary']}"
+    # Shared across sessions and restarts; only a miss calls the LLM
+    insight, cached = cached_paper_insight(paper, text_content)
+    if insight_failed(insight) and request_done():
+        check()   # report the deadline rather than a parse-error placeholder
+    return {"paper_id": paper["id"], "text": text_content, "insight": insight.model_dump(), "cached": cached}
+
+def compare_job(params, progress):
+    progress(0.1, f"Comparing {len(params['papers'])} papers")
+    entries = [{"paper": e["paper"], "text": e["text"], "insight": PaperInsight.model_validate(e["insight"])}
+               for e in params["papers"]]
+    comparison = compare_papers(entries)
+    return {"comparison": comparison.model_dump()}
+
+def create_default_queue(path=JOB_DB_PATH, workers=JOB_WORKERS):
+    """Queue with the search/fetch/insight/compare handlers (and their budgets) registered and workers running"""
+    queue = JobQueue(path, workers)
+    queue.register("search", search_job, budget=SEARCH_BUDGET)
+    queue.register("fetch", fetch_job, budget=SEARCH_BUDGET)
+    queue.register("insight", insight_job, budget=ANALYSIS_BUDGET)
+    queue.register("compare", compare_job, budget=ANALYSIS_BUDGET)
+    return queue.start()
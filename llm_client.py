@@ -3,6 +3,10 @@ import requests
 import json
 import urllib3
 from dotenv import load_dotenv
+from src.metrics import span
+from src.gateway_guard import get_guard, OK, THROTTLED, ERROR, IGNORE, OPEN, GATEWAY_QUEUE_TIMEOUT
+from src.singleflight import get_flight, canonical_key
+from src.deadline import call_timeout, DeadlineExceeded
 
 load_dotenv()
 
@@ -10,17 +14,31 @@ load_dotenv()
 # Matches: BASE_URL = "https://genailab.tcs.in"
 BASE_URL = os.getenv("GENAI_LAB_BASE_URL")
 API_KEY = os.getenv("GENAI_LAB_API_KEY")
+LLM_REQUEST_TIMEOUT = float(os.getenv("LLM_REQUEST_TIMEOUT", "300"))  # cap per call; a request's deadline can make it shorter
 
 # --- Disable SSL warnings (Critical for your environment) ---
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
-def get_llm_response(messages, model_name, temperature=0.2, max_tokens=4096, json_mode=False):
+# Identical prompts sent while one is already in flight wait for its answer instead of a second call
+_flight = get_flight("llm", copy_result=False)
+
+def get_llm_response(messages, model_name, temperature=0.2, max_tokens=4096, json_mode=False, base_url=None):
     """
     Calls the GenAI Lab API using the OpenAI-compatible standard.
+    base_url overrides the gateway, e.g. to reach an alternate deployment.
     """
+    key = canonical_key(messages, model_name, temperature, max_tokens, json_mode, base_url or BASE_URL)
+    try:
+        return _flight.do(key, _request_llm_response, messages, model_name, temperature, max_tokens, json_mode, base_url)
+    except DeadlineExceeded as e:
+        # Waiting on an identical in-flight call outlasted this request's budget
+        print(f"⏳ {e}; no response for {model_name}.")
+        return None
+
+def _request_llm_response(messages, model_name, temperature, max_tokens, json_mode, base_url):
     # Construct standard OpenAI URL: https://genailab.tcs.in/v1/chat/completions
     # This avoids the "Deployment not found" errors by letting the gateway route based on the model name.
-    url = f"{BASE_URL}/v1/chat/completions"
+    url = f"{base_url or BASE_URL}/v1/chat/completions"
     
     headers = {
         "Content-Type": "application/json",
@@ -38,25 +56,123 @@ def get_llm_response(messages, model_name, temperature=0.2, max_tokens=4096, jso
     if json_mode:
         payload["response_format"] = {"type": "json_object"}
 
-    try:
-        response = requests.post(
-            url,
-            headers=headers,
-            json=payload,
-            verify=False  # ⚠️ Bypass SSL as per your requirement
-        )
-        
-        if response.status_code == 404:
-            print(f"❌ 404 Error: Endpoint not found.")
-            print(f"   Debug URL: {url}")
+    response = None
+    with span("llm_request", source="genai_lab", model=model_name) as sp:
+        # Adaptive concurrency + circuit breaker per model, so a throttling gateway
+        # sees fewer in-flight requests instead of every session retrying at once.
+        # Waiting for a slot and the call itself both fit in the request's remaining budget.
+        try:
+            permit = get_guard(model_name, base_url or BASE_URL).acquire(call_timeout(GATEWAY_QUEUE_TIMEOUT))
+        except DeadlineExceeded as e:
+            print(f"⏳ {e}; skipping request for {model_name}.")
+            sp.status = "deadline"
+            return None
+        if permit is None:
+            print(f"⏳ Gateway guard rejected request for {model_name} (circuit open or no free slot).")
+            sp.status = "rejected"
             return None
+
+        outcome, retry_after = ERROR, None
+        timeout = LLM_REQUEST_TIMEOUT
+        try:
+            timeout = call_timeout(LLM_REQUEST_TIMEOUT)
+            response = requests.post(
+                url,
+                headers=headers,
+                json=payload,
+                verify=False,  # ⚠️ Bypass SSL as per your requirement
+                timeout=timeout
+            )
             
-        response.raise_for_status()
-        data = response.json()
-        return data["choices"][0]["message"]["content"]
-    
-    except requests.exceptions.RequestException as e:
-        print(f"❌ API Request Error: {e}")
-        if response is not None:
-             print(f"   Response Body: {response.text}")
-        return None
\ No newline at end of file
+            if response.status_code == 404:
+                print(f"❌ 404 Error: Endpoint not found.")
+                print(f"   Debug URL: {url}")
+                outcome = IGNORE
+                sp.status = "error"
+                return None
+                
+            response.raise_for_status()
+            data = response.json()
+            outcome = OK
+            return data["choices"][0]["message"]["content"]
+        
+        except DeadlineExceeded as e:
+            print(f"⏳ {e}; skipping request for {model_name}.")
+            outcome = IGNORE
+            sp.status = "deadline"
+            return None
+        except requests.exceptions.RequestException as e:
+            print(f"❌ API Request Error: {e}")
+            if isinstance(e, requests.exceptions.Timeout) and timeout < LLM_REQUEST_TIMEOUT:
+                # Cut short by the request's budget, which says nothing about the gateway's health
+                outcome = IGNORE
+            if response is not None:
+                 print(f"   Response Body: {response.text}")
+                 outcome, retry_after = classify_response(response)
+            sp.status = "error"
+            return None
+        finally:
+            permit.release(outcome, retry_after)
+
+def get_embeddings(texts, model_name, base_url=None):
+    """
+    Embedding vectors for a batch of texts via the OpenAI-compatible
+    /v1/embeddings endpoint, in input order; None on failure.
+    """
+    url = f"{base_url or BASE_URL}/v1/embeddings"
+    headers = {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {API_KEY}"
+    }
+    response = None
+    with span("embedding_request", source="genai_lab", model=model_name) as sp:
+        try:
+            permit = get_guard(model_name, base_url or BASE_URL).acquire(call_timeout(GATEWAY_QUEUE_TIMEOUT))
+        except DeadlineExceeded as e:
+            print(f"⏳ {e}; skipping embedding request for {model_name}.")
+            sp.status = "deadline"
+            return None
+        if permit is None:
+            print(f"⏳ Gateway guard rejected embedding request for {model_name} (circuit open or no free slot).")
+            sp.status = "rejected"
+            return None
+
+        outcome, retry_after = ERROR, None
+        try:
+            response = requests.post(
+                url,
+                headers=headers,
+                json={"model": model_name, "input": list(texts)},
+                verify=False,
+                timeout=call_timeout(LLM_REQUEST_TIMEOUT)
+            )
+            response.raise_for_status()
+            data = sorted(response.json()["data"], key=lambda d: d["index"])
+            outcome = OK
+            return [d["embedding"] for d in data]
+        except DeadlineExceeded as e:
+            print(f"⏳ {e}; skipping embedding request for {model_name}.")
+            outcome = IGNORE
+            sp.status = "deadline"
+            return None
+        except (requests.exceptions.RequestException, KeyError, ValueError) as e:
+            print(f"❌ Embedding Request Error: {e}")
+            if response is not None:
+                 outcome, retry_after = classify_response(response)
+            sp.status = "error"
+            return None
+        finally:
+            permit.release(outcome, retry_after)
+
+def classify_response(response):
+    """Maps a failed response to a gateway-guard outcome and optional Retry-After (s)"""
+    if response.status_code == 429:
+        retry_after = response.headers.get("Retry-After", "")
+        return THROTTLED, float(retry_after) if retry_after.replace(".", "", 1).isdigit() else None
+    if response.status_code >= 500:
+        return ERROR, None
+    return IGNORE, None
+
+def circuit_open(model_name, base_url=None):
+    """True while the breaker for this model is failing fast"""
+    return get_guard(model_name, base_url or BASE_URL).breaker.current_state() == OPEN
\ No newline at end of file
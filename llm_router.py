@@ -0,0 +1,251 @@
+import os
+import time
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from src.llm_client import get_llm_response, circuit_open
+from src.metrics import span, registry
+from src.deadline import current, submit, DeadlineExceeded
+
+# --- Configuration ---
+MODEL_FAST = os.getenv("MODEL_FAST", "azure_ai/genailab-maas-Llama-3.3-70B-Instruct")
+MODEL_REASONING = os.getenv("MODEL_REASONING", "azure/genailab-maas-gpt-4o")
+
+ROUTER_WINDOW = int(os.getenv("ROUTER_WINDOW", "200"))                    # samples kept per target
+ROUTER_WINDOW_SECONDS = float(os.getenv("ROUTER_WINDOW_SECONDS", "900"))  # and only the last 15 minutes
+ROUTER_MIN_SAMPLES = int(os.getenv("ROUTER_MIN_SAMPLES", "5"))            # before stats override the defaults
+ROUTER_MAX_ERROR_RATE = float(os.getenv("ROUTER_MAX_ERROR_RATE", "0.5"))  # above this a target is demoted
+ROUTER_MIN_HEDGE_DELAY = 0.25
+ROUTER_MAX_WORKERS = int(os.getenv("ROUTER_MAX_WORKERS", "32"))
+ROUTER_DEADLINE_POLL = 0.25   # how quickly a cancelled request stops waiting on its attempts
+
+# Model that answered the last routed call in this context (hedges and failovers change it)
+_answered_by = contextvars.ContextVar("answered_by", default=None)
+
+class Target:
+    """One model on one deployment; base_url None means the default gateway"""
+
+    def __init__(self, model, base_url=None):
+        self.model = model
+        self.base_url = base_url
+
+    @classmethod
+    def parse(cls, spec):
+        # "model" or "model@https://other-gateway"
+        model, _, base_url = spec.strip().partition("@")
+        return cls(model, base_url or None)
+
+    @property
+    def key(self):
+        return f"{self.model}@{self.base_url}" if self.base_url else self.model
+
+class RoutePolicy:
+    """
+    How one call type is routed: targets in preference order, whether to hedge,
+    and how long to wait before hedging while the primary has too few samples.
+    """
+
+    def __init__(self, targets, hedge=True, hedge_after=5.0, max_attempts=2):
+        self.targets = targets
+        self.hedge = hedge
+        self.hedge_after = hedge_after
+        self.max_attempts = max_attempts
+
+    @classmethod
+    def from_env(cls, call_type, models, hedge, hedge_after):
+        # ROUTE_<TYPE>_MODELS="model[@base_url],..."  ROUTE_<TYPE>_HEDGE=0|1  ROUTE_<TYPE>_HEDGE_AFTER=seconds
+        prefix = f"ROUTE_{call_type.upper()}_"
+        specs = os.getenv(prefix + "MODELS")
+        targets = [Target.parse(s) for s in specs.split(",") if s.strip()] if specs else [Target(m) for m in models]
+        hedge = os.getenv(prefix + "HEDGE", "1" if hedge else "0").lower() in ("1", "true", "yes")
+        hedge_after = float(os.getenv(prefix + "HEDGE_AFTER", hedge_after))
+        max_attempts = int(os.getenv(prefix + "MAX_ATTEMPTS", "2"))
+        return cls(targets, hedge=hedge, hedge_after=hedge_after, max_attempts=max_attempts)
+
+# Interactive steps hedge to the other model; insight and comparison keep the
+# reasoning model and only fall over to the fast one when it errors or is unhealthy.
+POLICIES = {
+    "refine": RoutePolicy.from_env("refine", [MODEL_FAST, MODEL_REASONING], hedge=True, hedge_after=3.0),
+    "chat": RoutePolicy.from_env("chat", [MODEL_REASONING, MODEL_FAST], hedge=True, hedge_after=15.0),
+    "insight": RoutePolicy.from_env("insight", [MODEL_REASONING, MODEL_FAST], hedge=False, hedge_after=45.0),
+    "compare": RoutePolicy.from_env("compare", [MODEL_REASONING, MODEL_FAST], hedge=False, hedge_after=60.0),
+    "summarize": RoutePolicy.from_env("summarize", [MODEL_FAST, MODEL_REASONING], hedge=False, hedge_after=30.0),
+    "facets": RoutePolicy.from_env("facets", [MODEL_FAST, MODEL_REASONING], hedge=False, hedge_after=30.0),
+}
+
+class TargetStats:
+    """Rolling latency and error window for one target"""
+
+    def __init__(self, size=ROUTER_WINDOW, max_age=ROUTER_WINDOW_SECONDS):
+        self.samples = deque(maxlen=size)  # (timestamp, seconds, ok)
+        self.max_age = max_age
+        self.lock = threading.Lock()
+
+    def record(self, seconds, ok):
+        with self.lock:
+            self.samples.append((time.time(), seconds, ok))
+
+    def _window(self):
+        cutoff = time.time() - self.max_age
+        with self.lock:
+            return [s for s in self.samples if s[0] >= cutoff]
+
+    def summary(self):
+        window = self._window()
+        latencies = sorted(seconds for _, seconds, ok in window if ok)
+        errors = sum(1 for _, _, ok in window if not ok)
+        pick = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] if latencies else None
+        return {"samples": len(window), "error_rate": errors / len(window) if window else 0.0,
+                "p50_s": pick(0.5), "p95_s": pick(0.95)}
+
+class ModelRouter:
+    def __init__(self, policies=None, max_workers=ROUTER_MAX_WORKERS):
+        self.policies = policies or POLICIES
+        self.stats = {}
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm-route")
+
+    def stats_for(self, target):
+        with self.lock:
+            return self.stats.setdefault(target.key, TargetStats())
+
+    def healthy(self, target):
+        if circuit_open(target.model, target.base_url):
+            return False
+        summary = self.stats_for(target).summary()
+        return summary["samples"] < ROUTER_MIN_SAMPLES or summary["error_rate"] <= ROUTER_MAX_ERROR_RATE
+
+    def ordered_targets(self, policy):
+        """Policy order, with unhealthy targets (open circuit, high error rate) moved to the back"""
+        healthy = [t for t in policy.targets if self.healthy(t)]
+        return healthy + [t for t in policy.targets if t not in healthy]
+
+    def hedge_delay(self, policy, target):
+        """The target's rolling p95 once it has enough samples, else the policy default"""
+        summary = self.stats_for(target).summary()
+        if summary["samples"] >= ROUTER_MIN_SAMPLES and summary["p95_s"] is not None:
+            return max(ROUTER_MIN_HEDGE_DELAY, summary["p95_s"])
+        return policy.hedge_after
+
+    def _attempt(self, target, messages, validate, kwargs):
+        started = time.perf_counter()
+        response = get_llm_response(messages, target.model, base_url=target.base_url, **kwargs)
+        ok = _is_valid(response, validate)
+        deadline = current()
+        if ok or deadline is None or not deadline.done:
+            # A call cut short by the caller's budget says nothing about the target
+            self.stats_for(target).record(time.perf_counter() - started, ok)
+        return response, ok
+
+    def complete(self, messages, call_type, validate=None, **kwargs):
+        """
+        Sends messages to the policy's primary target. If it is still running after
+        its p95 (and the policy hedges), a duplicate goes to the next target; if it
+        fails, the next target is tried at once. The first valid response wins.
+        Returns None when every attempt failed, like get_llm_response, or when
+        the request's deadline passed first. routed_model() then tells the
+        caller which model answered.
+        """
+        policy = self.policies[call_type]
+        targets = self.ordered_targets(policy)[:max(1, policy.max_attempts)]
+        _answered_by.set(None)
+        with span("llm_route", source=call_type, model=targets[0].model) as sp:
+            pending = {}
+            launched = 0
+            hedge_at = None
+
+            deadline = current()
+
+            def launch(target):
+                nonlocal launched, hedge_at
+                # Attempts run under the caller's deadline, so they time out with it
+                future = submit(self.executor, self._attempt, target, messages, validate, kwargs)
+                pending[future] = target
+                launched += 1
+                hedge_at = time.perf_counter() + self.hedge_delay(policy, target)
+
+            try:
+                launch(targets[0])
+                while pending:
+                    can_launch = launched < len(targets)
+                    timeout = max(0.0, hedge_at - time.perf_counter()) if policy.hedge and can_launch else None
+                    if deadline is not None:
+                        # Wake up regularly so a cancelled request stops waiting too
+                        timeout = min(timeout if timeout is not None else ROUTER_DEADLINE_POLL, ROUTER_DEADLINE_POLL)
+                    done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                    if not done:
+                        if deadline is not None:
+                            deadline.check()
+                        if policy.hedge and can_launch and time.perf_counter() >= hedge_at:
+                            # Primary is past its p95: hedge with the next target
+                            registry.inc("llm_hedges", call_type=call_type, model=targets[launched].model)
+                            launch(targets[launched])
+                        continue
+                    for future in done:
+                        target = pending.pop(future)
+                        try:
+                            response, ok = future.result()
+                        except DeadlineExceeded:
+                            response, ok = None, False
+                        if ok:
+                            self._cancel(pending)
+                            if target is not targets[0]:
+                                registry.inc("llm_hedge_wins", call_type=call_type, model=target.model)
+                            sp.model = target.model
+                            _answered_by.set(target.model)
+                            return response
+                    if not pending and launched < len(targets):
+                        registry.inc("llm_failovers", call_type=call_type, model=targets[launched].model)
+                        launch(targets[launched])
+            except DeadlineExceeded:
+                # Out of budget: attempts on the wire end on their own timeouts, nobody waits for them
+                self._cancel(pending)
+                sp.status = "deadline"
+                return None
+            sp.status = "error"
+            return None
+
+    def _cancel(self, pending):
+        # Queued attempts are cancelled outright; ones already on the wire cannot be
+        # interrupted, so their result is dropped (latency is still recorded).
+        for future in pending:
+            future.cancel()
+        pending.clear()
+
+    def snapshot(self):
+        """Rows of {target, samples, error_rate, p50, p95} for dashboards"""
+        with self.lock:
+            items = sorted(self.stats.items())
+        rows = []
+        for key, stats in items:
+            summary = stats.summary()
+            if not summary["samples"]:
+                continue
+            rows.append({"target": key, "samples": summary["samples"],
+                         "error_rate": round(summary["error_rate"], 3),
+                         "p50_s": _round(summary["p50_s"]), "p95_s": _round(summary["p95_s"])})
+        return rows
+
+def _is_valid(response, validate):
+    if not response:
+        return False
+    if validate is None:
+        return True
+    try:
+        return bool(validate(response))
+    except Exception:
+        return False
+
+def _round(value):
+    return round(value, 3) if value is not None else None
+
+router = ModelRouter()
+
+def routed_llm_response(messages, call_type, validate=None, **kwargs):
+    """get_llm_response with the model chosen (and hedged) by the call type's policy"""
+    return router.complete(messages, call_type, validate=validate, **kwargs)
+
+def routed_model():
+    """The model that answered the last routed call made from this context, or None if it failed"""
+    return _answered_by.get()
@@ -0,0 +1,206 @@
+import os
+import json
+import time
+import threading
+import functools
+from collections import deque
+
+# --- Configuration ---
+# Set METRICS_JSONL to a file path to append every finished span as one JSON line.
+METRICS_JSONL = os.getenv("METRICS_JSONL")
+METRIC_PREFIX = "lifescience"
+
+# Latency buckets in seconds, from cheap parses up to slow LLM calls.
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+LABEL_NAMES = ("stage", "source", "model", "status")
+
+class Histogram:
+    """Cumulative-bucket latency histogram (Prometheus semantics)"""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.total += value
+        self.count += 1
+
+    def cumulative(self):
+        running, out = 0, []
+        for c in self.counts:
+            running += c
+            out.append(running)
+        return out
+
+    def quantile(self, q):
+        """Estimates a quantile by linear interpolation inside the matching bucket"""
+        if not self.count:
+            return None
+        target = q * self.count
+        lower, running = 0.0, 0
+        for i, c in enumerate(self.counts):
+            upper = BUCKETS[i] if i < len(BUCKETS) else BUCKETS[-1]
+            if running + c >= target and c:
+                return lower + (upper - lower) * (target - running) / c
+            running += c
+            lower = upper
+        return BUCKETS[-1]
+
+class MetricsRegistry:
+    def __init__(self, recent_size=200):
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+        self.recent = deque(maxlen=recent_size)
+        self.lock = threading.Lock()
+
+    def observe(self, stage, duration, source=None, model=None, status="ok"):
+        key = (stage, source or "", model or "", status)
+        record = {"ts": time.time(), "stage": stage, "source": source, "model": model,
+                  "status": status, "duration_s": round(duration, 6)}
+        with self.lock:
+            self.histograms.setdefault(key, Histogram()).observe(duration)
+            self.recent.append(record)
+        if METRICS_JSONL:
+            _append_jsonl(METRICS_JSONL, record)
+
+    def inc(self, name, amount=1, **labels):
+        """Increments a named counter; labels are free-form key/value pairs"""
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def set_gauge(self, name, value, **labels):
+        """Sets a named gauge to its current value"""
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self.lock:
+            self.gauges[key] = value
+
+    def counter_values(self):
+        """Rows of {name, labels, value} for dashboards"""
+        with self.lock:
+            items = sorted(self.counters.items())
+        return [{"name": name, "labels": dict(labels), "value": value} for (name, labels), value in items]
+
+    def gauge_values(self):
+        with self.lock:
+            items = sorted(self.gauges.items())
+        return [{"name": name, "labels": dict(labels), "value": value} for (name, labels), value in items]
+
+    def snapshot(self):
+        """Rows of {labels..., count, sum, p50, p95, p99} for dashboards"""
+        with self.lock:
+            items = list(self.histograms.items())
+        rows = []
+        for key, hist in sorted(items):
+            row = dict(zip(LABEL_NAMES, key))
+            row.update({"count": hist.count, "sum_s": round(hist.total, 4),
+                        "mean_s": round(hist.total / hist.count, 4) if hist.count else None,
+                        "p50_s": _round(hist.quantile(0.5)), "p95_s": _round(hist.quantile(0.95)),
+                        "p99_s": _round(hist.quantile(0.99))})
+            rows.append(row)
+        return rows
+
+    def recent_spans(self, limit=50):
+        with self.lock:
+            return list(self.recent)[-limit:]
+
+    def reset(self):
+        with self.lock:
+            self.histograms.clear()
+            self.counters.clear()
+            self.gauges.clear()
+            self.recent.clear()
+
+    def export_prometheus(self):
+        """Renders every histogram in the Prometheus text exposition format"""
+        name = f"{METRIC_PREFIX}_stage_latency_seconds"
+        lines = [f"# HELP {name} Latency of pipeline stages.", f"# TYPE {name} histogram"]
+        with self.lock:
+            items = sorted((k, list(h.cumulative()), h.total, h.count) for k, h in self.histograms.items())
+        for key, cumulative, total, count in items:
+            labels = ",".join(f'{n}="{_escape(v)}"' for n, v in zip(LABEL_NAMES, key))
+            for bound, value in zip(list(BUCKETS) + ["+Inf"], cumulative):
+                lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {value}')
+            lines.append(f"{name}_sum{{{labels}}} {total}")
+            lines.append(f"{name}_count{{{labels}}} {count}")
+        for kind, suffix, rows in (("counter", "_total", self.counter_values()), ("gauge", "", self.gauge_values())):
+            for row in rows:
+                metric = f"{METRIC_PREFIX}_{row['name']}{suffix}"
+                if f"# TYPE {metric} {kind}" not in lines:
+                    lines.append(f"# TYPE {metric} {kind}")
+                labels = ",".join(f'{k}="{_escape(v)}"' for k, v in row["labels"].items())
+                lines.append(f"{metric}{{{labels}}} {row['value']}")
+        return "\n".join(lines) + "\n"
+
+    def export_jsonl(self, path):
+        """Writes the current histogram snapshot as JSON lines"""
+        with open(path, "w", encoding="utf-8") as f:
+            for row in self.snapshot():
+                f.write(json.dumps(row) + "\n")
+
+def _round(value):
+    return round(value, 4) if value is not None else None
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+_jsonl_lock = threading.Lock()
+
+def _append_jsonl(path, record):
+    try:
+        with _jsonl_lock, open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+    except OSError as e:
+        print(f"[WARN] Could not write metrics line: {e}")
+
+registry = MetricsRegistry()
+
+# --- Spans ---
+class Span:
+    """Times one pipeline stage. Use as a context manager or call finish() explicitly."""
+
+    def __init__(self, stage, source=None, model=None):
+        self.stage = stage
+        self.source = source
+        self.model = model
+        self.status = "ok"  # callers that swallow errors can set "error" before exit
+        self.started = time.perf_counter()
+        self.finished = False
+
+    def finish(self, status=None):
+        """Records the span once; status defaults to self.status"""
+        if self.finished:
+            return
+        self.finished = True
+        registry.observe(self.stage, time.perf_counter() - self.started,
+                         source=self.source, model=self.model, status=status or self.status)
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.finish("error" if exc_type else self.status)
+        return False
+
+def span(stage, source=None, model=None):
+    return Span(stage, source=source, model=model)
+
+def timed(stage, source=None, model=None):
+    """Decorator form of span()"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with Span(stage, source=source, model=model):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,337 @@
+"""
+Incremental literature monitoring for saved queries.
+
+Each saved query keeps a high-water mark per source, and each run asks only
+for what is newer:
+
+- PubMed / PMC: esearch with datetype=edat and mindate=<last run date> (the
+  first run looks back MONITOR_INITIAL_DAYS with reldate)
+- arXiv: results ordered by lastUpdatedDate, paged until the first entry
+  older than the newest one already seen
+
+Records seen before are recognized per query (arXiv revisions count as
+updates), and only new or updated records go to insight generation, through
+the shared insight store. A record whose analysis failed is retried on the
+next run. Each run writes a Markdown digest of what is new. A watermark only
+moves once every record fetched for that source has been marked seen, and not
+at all when the fetch failed, came back short (an unreadable article, an arXiv
+page cut off early) or more records matched than the query's limit (the run
+then warns to raise --limit), so nothing is skipped.
+
+Usage (schedule `run` with cron / Task Scheduler, or leave it looping with --every):
+    python monitor.py add malaria-vaccines "malaria vaccine children" --sources pubmed,arxiv --limit 100
+    python monitor.py list
+    python monitor.py run                      # every saved query
+    python monitor.py run malaria-vaccines --no-analyze
+    python monitor.py run --every 168          # weekly, in the foreground
+    python monitor.py reset malaria-vaccines   # forget watermarks and seen records
+    python monitor.py remove malaria-vaccines
+"""
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from src.metrics import registry, span
+
+# --- Configuration ---
+MONITOR_DB_PATH = os.getenv("MONITOR_DB_PATH", "./data/monitor.db")
+MONITOR_DIGEST_DIR = os.getenv("MONITOR_DIGEST_DIR", "./data/digests")
+MONITOR_INITIAL_DAYS = int(os.getenv("MONITOR_INITIAL_DAYS", "30"))   # look-back of a query's first run
+MONITOR_WORKERS = int(os.getenv("MONITOR_WORKERS", "4"))
+
+SOURCES = ("pubmed", "arxiv", "pmc")
+NEW, UPDATED, RETRY = "new", "updated", "retry"
+
+def _today():
+    return datetime.datetime.now(datetime.timezone.utc).strftime("%Y/%m/%d")
+
+def _days_ago_iso(days):
+    moment = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=days)
+    return moment.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+class MonitorStore:
+    def __init__(self, path=MONITOR_DB_PATH):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.lock = threading.Lock()
+        with self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS saved_queries (
+                    name TEXT PRIMARY KEY,
+                    query TEXT NOT NULL,
+                    sources TEXT NOT NULL,
+                    max_results INTEGER NOT NULL,
+                    created_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS watermarks (
+                    name TEXT NOT NULL,
+                    source TEXT NOT NULL,
+                    high_water TEXT NOT NULL,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (name, source)
+                );
+                CREATE TABLE IF NOT EXISTS seen (
+                    name TEXT NOT NULL,
+                    source TEXT NOT NULL,
+                    record_id TEXT NOT NULL,
+                    version TEXT NOT NULL,
+                    paper TEXT NOT NULL,
+                    analyzed INTEGER NOT NULL DEFAULT 0,
+                    first_seen REAL NOT NULL,
+                    PRIMARY KEY (name, source, record_id)
+                );
+            """)
+
+    # --- Saved queries ---
+    def add(self, name, query, sources, max_results):
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO saved_queries VALUES (?, ?, ?, ?, ?)",
+                              (name, query, ",".join(sources), max_results, time.time()))
+
+    def remove(self, name):
+        self.reset(name)
+        with self.lock, self.conn:
+            return self.conn.execute("DELETE FROM saved_queries WHERE name = ?", (name,)).rowcount
+
+    def reset(self, name):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM watermarks WHERE name = ?", (name,))
+            self.conn.execute("DELETE FROM seen WHERE name = ?", (name,))
+
+    def queries(self, names=None):
+        with self.lock:
+            rows = self.conn.execute("SELECT name, query, sources, max_results FROM saved_queries ORDER BY name").fetchall()
+        return [{"name": n, "query": q, "sources": s.split(","), "max_results": m}
+                for n, q, s, m in rows if not names or n in names]
+
+    # --- Watermarks ---
+    def watermark(self, name, source):
+        with self.lock:
+            row = self.conn.execute("SELECT high_water FROM watermarks WHERE name = ? AND source = ?",
+                                    (name, source)).fetchone()
+        return row[0] if row else None
+
+    def set_watermark(self, name, source, value):
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO watermarks VALUES (?, ?, ?, ?)", (name, source, value, time.time()))
+
+    # --- Seen records ---
+    def classify(self, name, source, records):
+        """[(record_id, version, paper, NEW | UPDATED)] for records unseen or seen with another version"""
+        with self.lock:
+            versions = dict(self.conn.execute("SELECT record_id, version FROM seen WHERE name = ? AND source = ?",
+                                              (name, source)))
+        changes = []
+        for record_id, version, paper in records:
+            if record_id not in versions:
+                changes.append((record_id, version, paper, NEW))
+            elif versions[record_id] != version:
+                changes.append((record_id, version, paper, UPDATED))
+        return changes
+
+    def mark_seen(self, name, source, record_id, version, paper, analyzed):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO seen (name, source, record_id, version, paper, analyzed, first_seen) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (name, source, record_id) DO UPDATE SET "
+                "version = excluded.version, paper = excluded.paper, analyzed = excluded.analyzed",
+                (name, source, record_id, version, json.dumps(paper), int(analyzed), time.time()))
+
+    def unanalyzed(self, name):
+        """[(source, record_id, version, paper)] whose analysis failed on an earlier run"""
+        with self.lock:
+            rows = self.conn.execute("SELECT source, record_id, version, paper FROM seen WHERE name = ? AND analyzed = 0",
+                                     (name,)).fetchall()
+        return [(s, r, v, json.loads(p)) for s, r, v, p in rows]
+
+# --- Delta fetches: [(record_id, version, paper)], the next watermark, and whether nothing was left out ---
+def delta_pubmed(loader, saved, since):
+    run_date = _today()
+    papers, complete = loader.fetch_new_since(saved["query"], since, MONITOR_INITIAL_DAYS, saved["max_results"])
+    return [(p["id"], "", p) for p in papers], run_date, complete
+
+def delta_arxiv(loader, saved, since):
+    papers, complete = loader.fetch_updated_since(saved["query"], since or _days_ago_iso(MONITOR_INITIAL_DAYS),
+                                                  saved["max_results"])
+    newest = max((p["updated"] for p in papers), default=since)
+    return [(p["id"], p["updated"], p) for p in papers], newest, complete
+
+def delta_pmc(loader, saved, since):
+    from src.fulltext_index import extract_sections
+    run_date = _today()
+    records = []
+    results, complete = loader.fetch_new_since(saved["query"], since, MONITOR_INITIAL_DAYS, saved["max_results"])
+    for result in results:
+        try:
+            with open(result["json"], "r", encoding="utf-8") as f:
+                sections = extract_sections(json.load(f))
+        except (OSError, ValueError) as e:
+            # Left out: keep the watermark so the next run fetches it again
+            print(f"[WARN] Unreadable PMC article {result['id']}: {e}")
+            complete = False
+            continue
+        paper = {"id": f"PMC{result['id']}", "pmcid": f"PMC{result['id']}", "title": sections["title"].split("\n")[0],
+                 "summary": sections["abstract"] or sections["body"][:3000], "pdf_url": result["pdf"],
+                 "published": "", "source": "pmc", "doi": None}
+        records.append((paper["id"], "", paper))
+    return records, run_date, complete
+
+DELTAS = {"pubmed": delta_pubmed, "arxiv": delta_arxiv, "pmc": delta_pmc}
+
+def make_loaders(sources):
+    loaders = {}
+    if "pubmed" in sources:
+        from src.pubmed_fetcher import PubMedLoader
+        loaders["pubmed"] = PubMedLoader()
+    if "arxiv" in sources:
+        from src.arxiv_fetcher import ArxivLoader
+        loaders["arxiv"] = ArxivLoader()
+    if "pmc" in sources:
+        from src.compliance_fetcher import NCBILoader
+        loaders["pmc"] = NCBILoader()
+    return loaders
+
+def run_query(saved, store, loaders, analyze=True, workers=MONITOR_WORKERS):
+    """
+    Fetches what is new for one saved query, analyzes it and advances the
+    watermarks of the sources fetched in full once their records are marked
+    seen. Returns [{paper, source, status, insight}] for the digest.
+    """
+    from src.batch_runner import paper_text
+    from src.insight_generator import insight_failed
+    from src.insight_store import cached_paper_insight
+
+    name, changes, marks = saved["name"], [], {}
+    for source in saved["sources"]:
+        since = store.watermark(name, source)
+        try:
+            with span("monitor_fetch", source=source):
+                records, next_mark, complete = DELTAS[source](loaders[source], saved, since)
+        except Exception as e:
+            print(f"[ERROR] {name}/{source}: fetch failed, watermark kept at {since}: {e}")
+            continue
+        found = store.classify(name, source, records)
+        changes += [(source, *change) for change in found]
+        print(f"[MONITOR] {name}/{source}: {len(records)} fetched since {since or 'first run'}, {len(found)} new or updated")
+        registry.inc("monitor_records", len(found), source=source)
+        if not complete:
+            print(f"[WARN] {name}/{source}: incomplete fetch since {since or 'first run'} (limit {saved['max_results']}); "
+                  f"watermark kept, raise --limit if this repeats")
+        elif next_mark:
+            marks[source] = next_mark
+    retries = [(s, r, v, p, RETRY) for s, r, v, p in store.unanalyzed(name)
+               if (s, r) not in {(c[0], c[1]) for c in changes}]
+
+    def process(change):
+        source, record_id, version, paper, status = change
+        insight = None
+        if analyze:
+            insight, _ = cached_paper_insight(paper, paper_text(paper))
+            if insight_failed(insight):
+                insight = None
+        store.mark_seen(name, source, record_id, version, paper, analyzed=insight is not None or not analyze)
+        return {"paper": paper, "source": source, "status": status, "insight": insight}
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(process, changes + retries))
+    # Only now is everything fetched recorded; a crash before this refetches it next run
+    for source, next_mark in marks.items():
+        store.set_watermark(name, source, next_mark)
+    return results
+
+def write_digest(results_by_query, digest_dir=MONITOR_DIGEST_DIR):
+    """Markdown digest of new and updated papers per saved query; returns its path"""
+    os.makedirs(digest_dir, exist_ok=True)
+    stamp = datetime.datetime.now().strftime("%Y-%m-%d-%H%M%S")
+    path = os.path.join(digest_dir, f"digest-{stamp}.md")
+    total = sum(len(r) for r in results_by_query.values())
+    lines = [f"# Literature digest, {stamp}", "", f"{total} new or updated paper(s)."]
+    for name, results in results_by_query.items():
+        lines += ["", f"## {name} ({len(results)})"]
+        if not results:
+            lines.append("Nothing new.")
+        for item in sorted(results, key=lambda r: r["paper"].get("published") or "", reverse=True):
+            paper, insight = item["paper"], item["insight"]
+            tag = {UPDATED: " *(updated)*", RETRY: " *(analysis retried)*"}.get(item["status"], "")
+            lines += ["", f"### {paper['title']}{tag}",
+                      f"{item['source']} `{paper['id']}` · published {paper.get('published') or 'n/a'}"
+                      + (f" · doi:{paper['doi']}" if paper.get("doi") else "")]
+            if insight is not None:
+                lines.append(f"**Rigor {insight.methodology_score}/10.** {insight.conclusions}")
+                lines += [f"- {finding}" for finding in insight.key_findings]
+            else:
+                lines.append(paper.get("summary", "")[:600])
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    return path
+
+def run(store, names=None, analyze=True, workers=MONITOR_WORKERS, digest_dir=MONITOR_DIGEST_DIR):
+    saved_queries = store.queries(names)
+    if not saved_queries:
+        print("[MONITOR] No saved queries to run.")
+        return None
+    loaders = make_loaders({s for q in saved_queries for s in q["sources"]})
+    results = {}
+    with span("monitor_run", source="local"):
+        for saved in saved_queries:
+            results[saved["name"]] = run_query(saved, store, loaders, analyze, workers)
+    path = write_digest(results, digest_dir)
+    print(f"[MONITOR] {sum(len(r) for r in results.values())} new or updated paper(s); digest: {path}")
+    return path
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Saved-query literature monitoring with delta fetches.")
+    parser.add_argument("--db", default=MONITOR_DB_PATH)
+    sub = parser.add_subparsers(dest="command", required=True)
+    add_cmd = sub.add_parser("add", help="Save (or replace) a monitored query")
+    add_cmd.add_argument("name")
+    add_cmd.add_argument("query")
+    add_cmd.add_argument("--sources", default="pubmed,arxiv", help=f"Comma-separated, from {', '.join(SOURCES)}")
+    add_cmd.add_argument("--limit", type=int, default=100, help="Most records fetched per source per run")
+    sub.add_parser("list")
+    run_cmd = sub.add_parser("run", help="Fetch what is new for saved queries and write a digest")
+    run_cmd.add_argument("names", nargs="*")
+    run_cmd.add_argument("--no-analyze", action="store_true", help="Skip insight generation")
+    run_cmd.add_argument("--workers", type=int, default=MONITOR_WORKERS)
+    run_cmd.add_argument("--digest-dir", default=MONITOR_DIGEST_DIR)
+    run_cmd.add_argument("--every", type=float, help="Repeat every N hours instead of exiting")
+    for command in ("reset", "remove"):
+        sub.add_parser(command).add_argument("name")
+    args = parser.parse_args(argv)
+
+    store = MonitorStore(args.db)
+    if args.command == "add":
+        sources = [s.strip() for s in args.sources.split(",") if s.strip()]
+        unknown = set(sources) - set(SOURCES)
+        if unknown:
+            parser.error(f"unknown source(s): {', '.join(sorted(unknown))}")
+        store.add(args.name, args.query, sources, args.limit)
+        print(f"[MONITOR] Saved '{args.name}'")
+    elif args.command == "list":
+        for saved in store.queries():
+            marks = ", ".join(f"{s}: {store.watermark(saved['name'], s) or 'never run'}" for s in saved["sources"])
+            print(f"{saved['name']}: \"{saved['query']}\" ({marks})")
+    elif args.command == "reset":
+        store.reset(args.name)
+    elif args.command == "remove":
+        print(f"[MONITOR] Removed {store.remove(args.name)} saved query")
+    else:
+        while True:
+            run(store, args.names, not args.no_analyze, args.workers, args.digest_dir)
+            if not args.every:
+                break
+            time.sleep(args.every * 3600)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
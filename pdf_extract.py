@@ -0,0 +1,295 @@
+"""
+Lazy page-level PDF extraction: text and embedded figures, one page at a time.
+
+The PDF is memory-mapped and handed to PyMuPDF without a copy, so only the
+pages actually asked for are parsed. Every extracted page is cached on disk
+under PDF_CACHE_DIR/<sha256 of the file>/, so the same PDF (re-uploaded, or
+fetched again by NCBILoader) never pays twice. Multi-document batches fan out
+over one long-lived "spawn" process pool (safe to use from the threaded UI
+servers), and the workers' spans are replayed into this process's metrics.
+PyMuPDF is optional; without it extraction returns
+nothing and callers fall back to remote OCR.
+
+Usage:
+    python pdf_extract.py paper.pdf --pages 1-3 --figures
+    python pdf_extract.py data/pdfs/*.pdf --workers 4
+"""
+import os
+import sys
+import json
+import mmap
+import time
+import atexit
+import hashlib
+import argparse
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import src.metrics as metrics
+from src.metrics import span, registry
+
+# --- Configuration ---
+PDF_CACHE_DIR = os.getenv("PDF_CACHE_DIR", "./data/pdf_cache")
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", str(min(4, os.cpu_count() or 1))))
+MIN_FIGURE_SIDE = 64        # smaller embedded images are logos/icons, not figures
+MIN_TEXT_CHARS = 40         # a page with less text has no usable text layer (scanned)
+HASH_CHUNK = 1 << 20
+
+_fitz = None
+_fitz_warned = False
+_pool = None
+_pool_lock = threading.Lock()
+
+def _import_fitz():
+    """The PyMuPDF module, or None when it is not installed"""
+    global _fitz, _fitz_warned
+    if _fitz is None:
+        try:
+            import pymupdf
+            _fitz = pymupdf
+        except ImportError:
+            try:
+                # PyMuPDF before 1.24 only ships the legacy module name
+                import fitz
+                _fitz = fitz
+                return _fitz
+            except ImportError:
+                pass
+            if not _fitz_warned:
+                print("[WARN] PyMuPDF is not installed; local PDF extraction is disabled (pip install pymupdf)")
+                _fitz_warned = True
+            return None
+    return _fitz
+
+def file_hash(path):
+    """sha256 of the file, read through an mmap (no copy of the whole file in memory)"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return digest.hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            view = memoryview(mm)
+            for start in range(0, len(mm), HASH_CHUNK):
+                digest.update(view[start:start + HASH_CHUNK])
+            view.release()
+    return digest.hexdigest()
+
+def parse_pages(spec):
+    """'1-3,7' -> [0, 1, 2, 6] (1-based input, 0-based output)"""
+    pages = []
+    for part in (spec or "").split(","):
+        if "-" in part:
+            start, end = part.split("-", 1)
+            pages += range(int(start) - 1, int(end))
+        elif part.strip():
+            pages.append(int(part) - 1)
+    return pages
+
+class PdfPages:
+    """
+    One PDF, opened lazily. page_text(n) and page_figures(n) read from the page
+    cache first and only open (mmap + parse) the document on a miss.
+    """
+
+    def __init__(self, path, cache_dir=PDF_CACHE_DIR):
+        self.path = path
+        self.digest = file_hash(path)
+        self.cache_dir = os.path.join(cache_dir, self.digest)
+        self._file = self._mm = self._view = self._doc = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _open(self):
+        if self._doc is None:
+            fitz = _import_fitz()
+            if fitz is None:
+                return None
+            self._file = open(self.path, "rb")
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._view = memoryview(self._mm)
+            self._doc = fitz.open(stream=self._view, filetype="pdf")
+        return self._doc
+
+    def close(self):
+        if self._doc is not None:
+            self._doc.close()
+            self._view.release()
+            self._mm.close()
+            self._file.close()
+            self._file = self._mm = self._view = self._doc = None
+
+    def _cached(self, name):
+        return os.path.join(self.cache_dir, name)
+
+    def _write(self, name, data, mode="w"):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp = self._cached(f".{name}.{os.getpid()}.tmp")
+        with open(tmp, mode, **({"encoding": "utf-8"} if mode == "w" else {})) as f:
+            f.write(data)
+        os.replace(tmp, self._cached(name))
+
+    @property
+    def page_count(self):
+        meta = self._cached("meta.json")
+        if os.path.exists(meta):
+            with open(meta, "r", encoding="utf-8") as f:
+                return json.load(f)["page_count"]
+        doc = self._open()
+        if doc is None:
+            return 0
+        self._write("meta.json", json.dumps({"page_count": doc.page_count, "source": os.path.basename(self.path)}))
+        return doc.page_count
+
+    def page_text(self, number):
+        """Plain text of page `number` (0-based); None without PyMuPDF"""
+        name = f"page-{number:04d}.txt"
+        if os.path.exists(self._cached(name)):
+            with open(self._cached(name), "r", encoding="utf-8") as f:
+                return f.read()
+        doc = self._open()
+        if doc is None:
+            return None
+        with span("pdf_page_text", source="local"):
+            text = doc[number].get_text("text")
+        self._write(name, text)
+        return text
+
+    def page_figures(self, number):
+        """Paths of the figure images embedded in page `number`, written once as files"""
+        name = f"page-{number:04d}.figures.json"
+        if os.path.exists(self._cached(name)):
+            with open(self._cached(name), "r", encoding="utf-8") as f:
+                return [self._cached(p) for p in json.load(f)]
+        doc = self._open()
+        if doc is None:
+            return []
+        files = []
+        with span("pdf_page_figures", source="local"):
+            for index, info in enumerate(doc[number].get_images(full=True)):
+                xref, width, height = info[0], info[2], info[3]
+                if min(width, height) < MIN_FIGURE_SIDE:
+                    continue
+                image = doc.extract_image(xref)
+                if not image:
+                    continue
+                figure = f"page-{number:04d}-fig-{index:02d}.{image['ext']}"
+                self._write(figure, image["image"], mode="wb")
+                files.append(figure)
+        self._write(name, json.dumps(files))
+        return [self._cached(p) for p in files]
+
+    def extract(self, pages=None, figures=False):
+        """[{page, text, figures}] for the requested pages (all by default)"""
+        count = self.page_count
+        wanted = [p for p in (pages if pages is not None else range(count)) if 0 <= p < count]
+        return [{"page": p, "text": self.page_text(p),
+                 "figures": self.page_figures(p) if figures else []} for p in wanted]
+
+def has_text_layer(pages):
+    """True when most pages carry real text (a scanned PDF needs OCR instead)"""
+    if not pages:
+        return False
+    with_text = sum(1 for p in pages if p["text"] and len(p["text"].strip()) >= MIN_TEXT_CHARS)
+    return with_text >= 0.8 * len(pages)
+
+def extract_document(path, pages=None, figures=False, cache_dir=PDF_CACHE_DIR):
+    """Page dicts for one PDF; [] when it cannot be read"""
+    try:
+        with PdfPages(path, cache_dir) as pdf:
+            return pdf.extract(pages, figures)
+    except Exception as e:
+        print(f"[WARN] Local PDF extraction failed for {path}: {e}")
+        return []
+
+def _extract_job(job):
+    path, pages, figures, cache_dir = job
+    return extract_document(path, pages, figures, cache_dir)
+
+def _init_worker():
+    # The parent records the worker's spans (and writes METRICS_JSONL); keep every span of a job
+    metrics.METRICS_JSONL = None
+    registry.recent = deque()
+
+def _worker_job(job):
+    """Runs in a pool worker: (page dicts, span records) for one document"""
+    registry.reset()
+    return _extract_job(job), registry.recent_spans(limit=len(registry.recent))
+
+def _get_pool(workers):
+    """The shared worker pool, started on first use. "spawn" avoids forking a process full of threads."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                        initializer=_init_worker)
+            atexit.register(_shutdown, _pool)
+        return _pool
+
+def _shutdown(pool):
+    # cancel_futures is Python 3.9+; on 3.8 queued jobs still run before the workers exit
+    if sys.version_info >= (3, 9):
+        pool.shutdown(wait=False, cancel_futures=True)
+    else:
+        pool.shutdown(wait=False)
+
+def _discard_pool(pool):
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    _shutdown(pool)
+
+def extract_batch(paths, pages=None, figures=False, workers=PDF_WORKERS, cache_dir=PDF_CACHE_DIR):
+    """
+    {path: page dicts} for several PDFs, parsed on the worker pool (PDF parsing
+    is CPU-bound and holds the GIL). Single documents stay in-process.
+    """
+    if _import_fitz() is None:
+        return {path: [] for path in paths}
+    jobs = [(path, pages, figures, cache_dir) for path in paths]
+    with span("pdf_extract_batch", source="local"):
+        if len(jobs) <= 1 or workers <= 1:
+            return {job[0]: _extract_job(job) for job in jobs}
+        pool = _get_pool(workers)
+        try:
+            outcomes = list(pool.map(_worker_job, jobs))
+        except BrokenProcessPool as e:
+            # A worker died (e.g. crashed on a malformed PDF); start a fresh pool next time
+            print(f"[WARN] PDF worker pool failed ({e}); extracting in-process")
+            _discard_pool(pool)
+            return {job[0]: _extract_job(job) for job in jobs}
+        results = {}
+        for path, (doc_pages, spans) in zip(paths, outcomes):
+            for record in spans:
+                registry.observe(record["stage"], record["duration_s"], source=record["source"],
+                                 model=record["model"], status=record["status"])
+            results[path] = doc_pages
+        return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Extract PDF page text and figures locally (cached per page).")
+    parser.add_argument("pdfs", nargs="+")
+    parser.add_argument("--pages", help="1-based pages, e.g. 1-3,7 (default: all)")
+    parser.add_argument("--figures", action="store_true", help="Also extract embedded figure images")
+    parser.add_argument("--workers", type=int, default=PDF_WORKERS)
+    parser.add_argument("--cache-dir", default=PDF_CACHE_DIR)
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    results = extract_batch(args.pdfs, parse_pages(args.pages) if args.pages else None,
+                            args.figures, args.workers, args.cache_dir)
+    for path, pages in results.items():
+        chars = sum(len(p["text"] or "") for p in pages)
+        figures = sum(len(p["figures"]) for p in pages)
+        print(f"{path}: {len(pages)} page(s), {chars} chars, {figures} figure(s)")
+    print(f"[PDF] {len(results)} document(s) in {time.perf_counter() - started:.2f} s")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,255 @@
+"""
+On-demand profiling of single user actions (OCR processing, analysis, search).
+
+Off by default. When enabled (PROFILE_ACTIONS=1, or the hidden per-session
+toggles in the UIs), `profile_action(name)` wraps one action (or
+`start_profile(name)` ... `.stop()` one that spans several calls) in:
+
+- a sampling CPU profiler: a background thread reads every thread's stack
+  every PROFILE_INTERVAL seconds, so the action itself runs unmodified and
+  work done in job workers or executor threads is included. Threads parked in
+  an idle wait (Event.wait, selector, executor queue) are skipped. Stacks are
+  written in the collapsed "frame;frame;frame count" format that flamegraph.pl,
+  speedscope and inferno read directly.
+- with PROFILE_MEMORY=1, tracemalloc snapshots before and after, written as
+  the top allocation sites by growth (the profiler's own allocations are
+  filtered out). Off by default: tracing every allocation slows
+  allocation-heavy code by up to two orders of magnitude, which also skews the
+  CPU profile, so take memory profiles in a separate run.
+
+Files go to PROFILE_DIR/<timestamp>-<action>.collapsed / .alloc.txt. When
+profiling is off the context manager does nothing but yield None. Only one
+action is profiled at a time per process (tracemalloc is process-wide); a
+second concurrent request runs unprofiled.
+
+Usage (render a saved profile):
+    python profiling.py top data/profiles/20261019-101500-ocr.collapsed --limit 20
+"""
+import os
+import re
+import sys
+import time
+import argparse
+import threading
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from src.metrics import registry
+
+# --- Configuration ---
+PROFILE_ACTIONS = os.getenv("PROFILE_ACTIONS", "0") == "1"
+PROFILE_DIR = os.getenv("PROFILE_DIR", "./data/profiles")
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.005"))   # seconds between stack samples
+PROFILE_TOP_ALLOCS = int(os.getenv("PROFILE_TOP_ALLOCS", "30"))
+PROFILE_MEMORY = os.getenv("PROFILE_MEMORY", "0") == "1"    # tracemalloc slows allocation-heavy code up to ~100x
+PROFILE_TRACE_FRAMES = int(os.getenv("PROFILE_TRACE_FRAMES", "4"))  # tracemalloc traceback depth
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "600"))  # an abandoned profile stops itself
+
+SAFE_NAME_RE = re.compile(r"[^A-Za-z0-9._-]+")
+
+# Innermost frames of a thread that is waiting for work rather than doing any
+IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("selectors.py", "select"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+    ("socketserver.py", "serve_forever"),
+}
+
+_active = threading.Lock()   # one profiled action at a time
+
+def _frame_label(code):
+    path = code.co_filename
+    parts = path.replace("\\", "/").split("/")
+    return f"{code.co_name} ({'/'.join(parts[-2:])}:{code.co_firstlineno})"
+
+class SamplingProfiler:
+    """Samples all thread stacks on a background thread; stacks are counted in collapsed form"""
+
+    def __init__(self, interval=PROFILE_INTERVAL, max_seconds=None, on_timeout=None):
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self.on_timeout = on_timeout
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self, names):
+        own = threading.get_ident()
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            leaf = frame.f_code
+            if (os.path.basename(leaf.co_filename), leaf.co_name) in IDLE_FRAMES:
+                continue
+            labels = []
+            while frame is not None:
+                labels.append(_frame_label(frame.f_code))
+                frame = frame.f_back
+            labels.append(names.get(ident, f"thread-{ident}"))
+            self.stacks[";".join(reversed(labels))] += 1
+
+    def _run(self):
+        deadline = time.monotonic() + self.max_seconds if self.max_seconds else None
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name.replace(";", "_") for t in threading.enumerate()}
+            self._sample(names)
+            self.samples += 1
+            if deadline is not None and time.monotonic() > deadline:
+                self._stop.set()
+                if self.on_timeout is not None:
+                    self.on_timeout()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="profiler-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def collapsed(self):
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common()) + "\n"
+
+def allocation_report(before, after, limit=PROFILE_TOP_ALLOCS):
+    """Top allocation sites by growth between two tracemalloc snapshots, as text"""
+    # The sampler's stack counts and tracemalloc's own bookkeeping are not the action's
+    profiler_frames = [tracemalloc.Filter(False, __file__, all_frames=True), tracemalloc.Filter(False, tracemalloc.__file__)]
+    stats = after.filter_traces(profiler_frames).compare_to(before.filter_traces(profiler_frames), "traceback")
+    current, peak = tracemalloc.get_traced_memory()
+    lines = [f"Traced memory: {current / 1024 / 1024:.1f} MB now, {peak / 1024 / 1024:.1f} MB peak", ""]
+    for i, stat in enumerate(stats[:limit], 1):
+        lines.append(f"#{i}: {stat.size_diff / 1024:+.1f} KiB in {stat.count_diff:+d} blocks "
+                     f"(now {stat.size / 1024:.1f} KiB)")
+        lines += [f"    {line}" for line in stat.traceback.format(most_recent_first=True)]
+    return "\n".join(lines) + "\n"
+
+class ActionProfile:
+    """
+    One profiled action: sampling starts on creation (via start_profile) and
+    the files are written by stop(). An action that is never stopped, e.g. a
+    closed browser tab, is stopped after PROFILE_MAX_SECONDS.
+    """
+
+    def __init__(self, name, out_dir=PROFILE_DIR, max_seconds=PROFILE_MAX_SECONDS, memory=PROFILE_MEMORY):
+        self.name = name
+        self.out_dir = out_dir
+        self.collapsed_path = None
+        self.alloc_path = None
+        self.duration = None
+        self.samples = 0
+        self._stopped = threading.Lock()
+        self._started_tracing = memory and not tracemalloc.is_tracing()
+        if self._started_tracing:
+            tracemalloc.start(PROFILE_TRACE_FRAMES)
+        self._before = None
+        if memory:
+            if hasattr(tracemalloc, "reset_peak"):
+                # Python 3.9+; on 3.8 the reported peak covers all tracing so far
+                tracemalloc.reset_peak()
+            self._before = tracemalloc.take_snapshot()
+        self._sampler = SamplingProfiler(max_seconds=max_seconds, on_timeout=self.stop)
+        self._start = time.perf_counter()
+        self._sampler.start()
+
+    def stop(self):
+        """Stops sampling and writes the profile; later calls do nothing"""
+        if not self._stopped.acquire(blocking=False):
+            return self
+        try:
+            self._sampler.stop()
+            self.duration = time.perf_counter() - self._start
+            self.samples = self._sampler.samples
+            alloc_text = None
+            if self._before is not None:
+                alloc_text = allocation_report(self._before, tracemalloc.take_snapshot())
+            try:
+                self._write(alloc_text)
+            except OSError as e:
+                print(f"[WARN] Could not write profile for '{self.name}': {e}")
+        finally:
+            self._before = None
+            if self._started_tracing:
+                tracemalloc.stop()
+            _active.release()
+        return self
+
+    def _write(self, alloc_text):
+        os.makedirs(self.out_dir, exist_ok=True)
+        base = os.path.join(self.out_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{SAFE_NAME_RE.sub('_', self.name)}")
+        self.collapsed_path = f"{base}.collapsed"
+        with open(self.collapsed_path, "w", encoding="utf-8") as f:
+            f.write(self._sampler.collapsed())
+        if alloc_text is not None:
+            self.alloc_path = f"{base}.alloc.txt"
+            with open(self.alloc_path, "w", encoding="utf-8") as f:
+                f.write(alloc_text)
+        registry.inc("profiles_written", action=self.name)
+        print(f"[PROFILE] {self.summary()}")
+
+    def summary(self):
+        if self.collapsed_path is None:
+            return f"{self.name}: not written"
+        paths = ", ".join(p for p in (self.collapsed_path, self.alloc_path) if p)
+        return f"{self.name}: {self.duration:.2f}s, {self.samples} samples -> {paths}"
+
+def start_profile(name, enabled=None, out_dir=None):
+    """
+    An ActionProfile for an action spanning several calls (e.g. Streamlit
+    reruns), or None when profiling is off or another action is being profiled.
+    """
+    if not (PROFILE_ACTIONS if enabled is None else enabled) or not _active.acquire(blocking=False):
+        return None
+    try:
+        return ActionProfile(name, out_dir or PROFILE_DIR)
+    except Exception:
+        _active.release()
+        raise
+
+@contextmanager
+def profile_action(name, enabled=None, out_dir=None):
+    """
+    Profiles the enclosed block when enabled (default: PROFILE_ACTIONS) and
+    yields the ActionProfile; otherwise yields None at no measurable cost.
+    """
+    profile = start_profile(name, enabled, out_dir)
+    try:
+        yield profile
+    finally:
+        if profile is not None:
+            profile.stop()
+
+def top_frames(collapsed_path, limit=20):
+    """[(frame, self samples, total samples)] from a collapsed stack file, by self samples"""
+    self_counts, total_counts = Counter(), Counter()
+    with open(collapsed_path, "r", encoding="utf-8") as f:
+        for line in f:
+            stack, _, count = line.rstrip("\n").rpartition(" ")
+            if not stack:
+                continue
+            frames = stack.split(";")[1:]   # drop the thread name
+            if not frames:
+                continue
+            self_counts[frames[-1]] += int(count)
+            for frame in set(frames):
+                total_counts[frame] += int(count)
+    return [(frame, n, total_counts[frame]) for frame, n in self_counts.most_common(limit)]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect profiles written by profile_action.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    top_cmd = sub.add_parser("top", help="Hottest frames of a collapsed stack file")
+    top_cmd.add_argument("path")
+    top_cmd.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    rows = top_frames(args.path, args.limit)
+    print(f"{'self':>6}  {'total':>6}  frame")
+    for frame, self_n, total_n in rows:
+        print(f"{self_n:6d}  {total_n:6d}  {frame}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,40 +1,145 @@
+import os
 import requests
 import urllib3
+import xml.etree.ElementTree as ET
+from src.metrics import span
+from src.corpus_store import record_papers
+from src.singleflight import get_flight, canonical_key
+from src.deadline import call_timeout
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
+# Sessions searching the same thing at the same moment share one set of E-utilities requests
+_flight = get_flight("pubmed")
+
+# Records per esearch/esummary request for delta fetches
+PUBMED_PAGE_SIZE = int(os.getenv("PUBMED_PAGE_SIZE", "200"))
+
 class PubMedLoader:
-    def __init__(self):
-        self.base_url = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils"
+    def __init__(self, base_url=None):
+        # NCBI_EUTILS_URL lets batch runs point at a local stand-in
+        self.base_url = base_url or os.getenv("NCBI_EUTILS_URL", "https://eutils.ncbi.nlm.nih.gov/entrez/eutils")
 
-    def fetch_papers(self, query, limit=3):
-        print(f"[SEARCH] Searching PubMed for: {query}")
+    def fetch_papers(self, query, limit=3, strict=False):
+        """Search results; on errors [] (or the exception with strict=True)"""
         try:
+            return _flight.do(canonical_key(self.base_url, "search", query, limit), self._fetch_papers, query, limit)
+        except Exception as e:
+            if strict:
+                raise
+            print(f"[ERROR] PubMed Search Error: {e}")
+            return []
+
+    def _fetch_papers(self, query, limit):
+        print(f"[SEARCH] Searching PubMed for: {query}")
+        with span("fetch_papers", source="pubmed"):
             # Search
             search_url = f"{self.base_url}/esearch.fcgi"
             search_params = {"db": "pubmed", "term": query, "retmode": "json", "retmax": limit}
-            resp = requests.get(search_url, params=search_params, verify=False) # verify=False
-            
+            with span("esearch", source="pubmed"):
+                resp = requests.get(search_url, params=search_params, verify=False, timeout=call_timeout()) # verify=False
+            resp.raise_for_status()
+
             id_list = resp.json().get('esearchresult', {}).get('idlist', [])
             if not id_list: return []
 
-            # Summary
-            summary_url = f"{self.base_url}/esummary.fcgi"
-            summary_params = {"db": "pubmed", "id": ",".join(id_list), "retmode": "json"}
-            resp = requests.get(summary_url, params=summary_params, verify=False) # verify=False
-            
+            return self._fetch_summaries(id_list)
+
+    def fetch_by_ids(self, pmids, strict=False):
+        """Fetches metadata and abstracts for known PMIDs"""
+        if not pmids:
+            return []
+        pmids = [str(p).strip() for p in pmids]
+        try:
+            return _flight.do(canonical_key(self.base_url, "ids", pmids), self._fetch_by_ids, pmids)
+        except Exception as e:
+            if strict:
+                raise
+            print(f"[ERROR] PubMed ID Lookup Error: {e}")
+            return []
+
+    def _fetch_by_ids(self, pmids):
+        with span("fetch_by_ids", source="pubmed"):
+            return self._fetch_summaries(pmids)
+
+    def fetch_new_since(self, query, since=None, reldate=30, limit=200, page_size=PUBMED_PAGE_SIZE):
+        """
+        (papers, complete): records added to PubMed (Entrez date) on or after
+        `since` ('YYYY/MM/DD'), or within the last `reldate` days when there is
+        no watermark yet. Pages through every match up to `limit`; complete is
+        False when more matched than that. Raises on network errors so the
+        caller can keep its watermark.
+        """
+        params = {"db": "pubmed", "term": query, "retmode": "json", "datetype": "edat", "sort": "pub_date"}
+        if since:
+            params.update(mindate=since, maxdate="3000/12/31")
+        else:
+            params["reldate"] = reldate
+        id_list, count = [], None
+        with span("fetch_new", source="pubmed"):
+            while len(id_list) < limit and (count is None or len(id_list) < count):
+                page = dict(params, retstart=len(id_list), retmax=min(page_size, limit - len(id_list)))
+                with span("esearch", source="pubmed"):
+                    resp = requests.get(f"{self.base_url}/esearch.fcgi", params=page, verify=False, timeout=call_timeout())
+                resp.raise_for_status()
+                result = resp.json().get('esearchresult', {})
+                ids = result.get('idlist', [])
+                count = int(result.get('count', len(id_list) + len(ids)))
+                id_list += ids
+                if not ids:
+                    break
             papers = []
-            for pmid, details in resp.json().get('result', {}).items():
-                if pmid == 'uids': continue
-                papers.append({
-                    "id": pmid,
-                    "title": details.get('title', 'No Title'),
-                    "summary": details.get('title', 'No Abstract'), # Simple fallback
-                    "pdf_url": None,
-                    "published": details.get('pubdate', 'Unknown'),
-                    "source": "pubmed"
-                })
-            return papers
+            for start in range(0, len(id_list), page_size):
+                papers += self._fetch_summaries(id_list[start:start + page_size])
+            return papers, len(id_list) >= count
+
+    def _fetch_summaries(self, id_list):
+        # Summary
+        summary_url = f"{self.base_url}/esummary.fcgi"
+        summary_params = {"db": "pubmed", "id": ",".join(id_list), "retmode": "json"}
+        with span("esummary", source="pubmed"):
+            resp = requests.get(summary_url, params=summary_params, verify=False, timeout=call_timeout()) # verify=False
+        resp.raise_for_status()
+        abstracts = self._fetch_abstracts(id_list)
+
+        papers = []
+        for pmid, details in resp.json().get('result', {}).items():
+            if pmid == 'uids': continue
+            article_ids = {a.get('idtype'): a.get('value') for a in details.get('articleids', [])}
+            papers.append({
+                "id": pmid,
+                "title": details.get('title', 'No Title'),
+                "summary": abstracts.get(pmid) or details.get('title', 'No Abstract'), # Title fallback
+                "pdf_url": None,
+                "published": details.get('pubdate', 'Unknown'),
+                "source": "pubmed",
+                "doi": article_ids.get('doi'),
+                "pmcid": article_ids.get('pmc')
+            })
+        record_papers(papers)
+        return papers
+
+    def _fetch_abstracts(self, id_list):
+        """Returns {pmid: abstract} using efetch; esummary does not carry abstracts"""
+        fetch_url = f"{self.base_url}/efetch.fcgi"
+        fetch_params = {"db": "pubmed", "id": ",".join(id_list), "rettype": "abstract", "retmode": "xml"}
+        abstracts = {}
+        try:
+            with span("efetch", source="pubmed"):
+                resp = requests.get(fetch_url, params=fetch_params, verify=False, timeout=call_timeout()) # verify=False
+            resp.raise_for_status()
+            with span("parse_efetch", source="pubmed"):
+                root = ET.fromstring(resp.content)
+            for article in root.iter('PubmedArticle'):
+                pmid = article.findtext('.//PMID')
+                parts = []
+                for node in article.iter('AbstractText'):
+                    text = "".join(node.itertext()).strip()
+                    label = node.get('Label')
+                    if text:
+                        parts.append(f"{label}: {text}" if label else text)
+                if pmid and parts:
+                    abstracts[pmid] = " ".join(parts)
         except Exception as e:
-            print(f"[ERROR] PubMed Search Error: {e}")
-            return []
\ No newline at end of file
+            print(f"[WARN] PubMed abstract fetch failed: {e}")
+        return abstracts
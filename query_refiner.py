@@ -0,0 +1,218 @@
+import os
+import re
+import json
+from functools import lru_cache
+from src.llm_router import routed_llm_response, routed_model
+from src.metrics import span
+
+# Load specific model names from env or defaults
+MODEL_FAST = os.getenv("MODEL_FAST", "azure_ai/genailab-maas-Llama-3.3-70B-Instruct")
+
+REFINE_SYSTEM_PROMPT = "You are a Scientific Search Optimizer. Convert the user's natural language request into a precise, keyword-based search query. Return ONLY the keywords. Do not add quotes or prefixes."
+
+# --- Local refinement configuration ---
+VOCABULARY_PATH = os.getenv("QUERY_VOCABULARY_PATH", os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "resources", "biomedical_vocabulary.json"))
+REFINE_MIN_CONFIDENCE = float(os.getenv("REFINE_MIN_CONFIDENCE", "0.5"))  # below this the LLM is asked
+REFINE_CACHE_SIZE = 1024
+MAX_SYNONYMS = 3  # per concept in the built queries, besides the preferred term and MeSH heading
+
+STOPWORDS = frozenset("""
+a about above after again against all also am an and any are as at be because been before being below
+between both but by can could did do does doing down during each few for from further had has have
+having he her here hers him his how i if in into is it its itself just me more most my no nor not now
+of off on once only or other our ours out over own same she should so some such than that the their
+them then there these they this those through to too under until up very was we were what when where
+which while who whom why will with would you your yours
+find search show give list get looking look want need please tell know help explain understand us
+paper papers article articles publication publications literature research study studies evidence
+latest recent new current regarding related using use used based
+effect effects impact role influence influences affect affects association relationship
+""".split())
+
+TOKEN_RE = re.compile(r"[A-Za-z0-9]+(?:['\-/.,][A-Za-z0-9]+)*")
+QUOTED_RE = re.compile(r'"([^"]+)"')
+
+class Concept:
+    """A vocabulary entry: preferred term, optional MeSH heading and synonyms"""
+
+    def __init__(self, term, mesh=None, synonyms=()):
+        self.term = term
+        self.mesh = mesh
+        self.synonyms = list(synonyms)
+
+    def terms(self, matched=None):
+        """Preferred term, the form the user typed, then a few synonyms"""
+        terms = [self.term]
+        if matched and matched not in terms:
+            terms.append(matched)
+        terms += [s for s in self.synonyms if s not in terms][:MAX_SYNONYMS]
+        return terms
+
+class Vocabulary:
+    """Phrase index over the bundled vocabulary (token tuple -> Concept)"""
+
+    def __init__(self, concepts):
+        self.index = {}
+        for concept in concepts:
+            for phrase in [concept.term] + concept.synonyms:
+                self.index.setdefault(tuple(tokenize(phrase)), concept)
+        self.max_len = max((len(k) for k in self.index), default=1)
+
+    @classmethod
+    def load(cls, path=VOCABULARY_PATH):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"[WARN] Query vocabulary unavailable ({e}); local refinement will lean on the LLM.")
+            return cls([])
+        return cls(Concept(c["term"], c.get("mesh"), c.get("synonyms", [])) for c in data.get("concepts", []))
+
+    def match(self, tokens, start):
+        """Longest vocabulary phrase starting at tokens[start]; (concept, length) or (None, 0)"""
+        for length in range(min(self.max_len, len(tokens) - start), 0, -1):
+            key = tuple(tokens[start:start + length])
+            concept = self.index.get(key)
+            if concept is None and key[-1].endswith("s") and len(key[-1]) > 3:
+                concept = self.index.get(key[:-1] + (key[-1][:-1],))  # naive plural
+            if concept is not None:
+                return concept, length
+        return None, 0
+
+@lru_cache(maxsize=None)
+def get_vocabulary():
+    return Vocabulary.load()
+
+def tokenize(text):
+    return [t.lower() for t in TOKEN_RE.findall(text)]
+
+def is_identifier(token):
+    """Gene/strain/drug-code style tokens (BRCA1, IL-6, H5N1, PCSK9) are specific on their own"""
+    return any(ch.isdigit() for ch in token) or (token.isupper() and len(token) >= 2)
+
+class RefinedQuery:
+    """
+    A refined search: concept groups (alternative terms OR-ed together) and free
+    keywords, AND-ed, renderable as PubMed or arXiv query syntax.
+    """
+
+    def __init__(self, text, concepts, keywords, confidence, method="local", labels=None):
+        self.text = text
+        self.concepts = concepts  # [(label, mesh or None, [terms])]
+        self.keywords = keywords
+        self.confidence = confidence
+        self.method = method      # "local" or "llm"
+        self.labels = labels or [label for label, _, _ in concepts] + keywords  # in input order
+
+    @property
+    def display(self):
+        """Plain keyword string for the UI"""
+        return " ".join(self.labels) or self.text
+
+    def pubmed(self):
+        parts = []
+        for _, mesh, terms in self.concepts:
+            alternatives = ([f'"{mesh}"[MeSH Terms]'] if mesh else []) + [f'"{t}"[Title/Abstract]' for t in terms]
+            parts.append(_group(alternatives))
+        parts += [f"{k}[Title/Abstract]" for k in self.keywords]
+        return " AND ".join(parts) or self.text
+
+    def arxiv(self):
+        parts = [_group([f'all:"{t}"' for t in terms]) for _, _, terms in self.concepts]
+        parts += [f"all:{k}" for k in self.keywords]
+        return " AND ".join(parts) or f"all:{self.text}"
+
+def _group(alternatives):
+    return alternatives[0] if len(alternatives) == 1 else "(" + " OR ".join(alternatives) + ")"
+
+def parse_query(text, method="local", vocabulary=None):
+    """Local refinement: quoted phrases, vocabulary phrases, then non-stopword keywords"""
+    vocabulary = vocabulary or get_vocabulary()
+    concepts, labels, seen = [], [], set()
+    for phrase in QUOTED_RE.findall(text):
+        if phrase.strip() and phrase.lower() not in seen:
+            seen.add(phrase.lower())
+            concepts.append((phrase.strip(), None, [phrase.strip()]))
+            labels.append(phrase.strip())
+    raw_tokens = TOKEN_RE.findall(QUOTED_RE.sub(" ", text))
+    tokens = [t.lower() for t in raw_tokens]
+
+    keywords, covered, specific = [], len(concepts), 0
+    i = 0
+    while i < len(tokens):
+        concept, length = vocabulary.match(tokens, i)
+        if concept is not None:
+            covered += length
+            if concept.term not in seen:
+                seen.add(concept.term)
+                concepts.append((concept.term, concept.mesh, concept.terms(" ".join(tokens[i:i + length]))))
+                labels.append(concept.term)
+            i += length
+            continue
+        token = tokens[i]
+        if token not in STOPWORDS and len(token) > 1 and token not in seen:
+            seen.add(token)
+            keywords.append(token)
+            labels.append(token)
+            specific += is_identifier(raw_tokens[i])
+        i += 1
+
+    content = covered + len(keywords)
+    confidence = (covered + specific) / content if content else 0.0
+    if len(keywords) > 4:
+        confidence *= 0.7  # long free-text questions are where the LLM earns its keep
+    return RefinedQuery(text, concepts, keywords, round(confidence, 3), method, labels)
+
+def llm_refine_keywords(user_input):
+    """Uses the Llama 3.3 model to turn a request into keywords; None on failure"""
+    with span("refine_llm", source="genai_lab", model=MODEL_FAST) as sp:
+        try:
+            messages = [
+                {"role": "system", "content": REFINE_SYSTEM_PROMPT},
+                {"role": "user", "content": user_input}
+            ]
+            # Fast model (Llama) first; the router hedges to the reasoning model when it is slow
+            response = routed_llm_response(messages, "refine", temperature=0.1)
+            sp.model = routed_model() or MODEL_FAST
+            return response.strip() if response else None
+        except Exception:
+            sp.status = "error"
+            return None
+
+class _Unrefined(Exception):
+    """The LLM was needed but did not answer; carries the local result, which is not memoized"""
+
+    def __init__(self, local):
+        self.local = local
+
+@lru_cache(maxsize=REFINE_CACHE_SIZE)
+def _refine_cached(text, llm_refine):
+    # lru_cache does not store exceptions, so a failed LLM call is retried next time
+    local = parse_query(text)
+    if local.confidence >= REFINE_MIN_CONFIDENCE:
+        return local
+    keywords = llm_refine(text)
+    if not keywords:
+        raise _Unrefined(local)
+    refined = parse_query(keywords, method="llm")
+    return refined if refined.concepts or refined.keywords else local
+
+def refine_query(user_input, llm_refine=None):
+    """
+    Refines a natural-language request locally and only asks the LLM when the
+    local confidence is low. Results are memoized per normalized input.
+    llm_refine(text) -> keywords or None overrides the default gateway call.
+    """
+    text = " ".join(user_input.split())
+    with span("refine_query", source="local") as sp:
+        try:
+            result = _refine_cached(text, llm_refine or llm_refine_keywords)
+        except _Unrefined as e:
+            result = e.local
+        sp.source = result.method
+        return result
+
+def refine_search_query(user_input):
+    """Keyword string for a request (kept for callers that want plain text)"""
+    return refine_query(user_input).display
@@ -0,0 +1,138 @@
+"""
+Local relevance re-ranking of merged search results.
+
+The loaders return results in source order with no common score, so the
+search paths fetch a wide pool (RERANK_POOL per source), and this module
+scores every candidate against the refined query and keeps the best
+RERANK_TOP_N. Scoring is BM25 over title and abstract (title term
+frequency weighted higher): words are counted per field in C and only
+distinct words are stemmed (cached), and the scores are NumPy array
+operations over the (papers x query terms) matrix, with IDF taken from the
+pool itself. A hundred candidates rank in a few milliseconds.
+
+Concept synonyms from the query refiner count at a reduced weight. Optionally,
+with RERANK_EMBEDDING_MODEL set and sentence-transformers installed, a small
+local embedding model's cosine similarity is blended in
+(RERANK_EMBEDDING_WEIGHT).
+"""
+import os
+import re
+import threading
+import functools
+from collections import Counter
+import numpy as np
+from src.query_refiner import tokenize, STOPWORDS
+from src.metrics import span
+
+# --- Configuration ---
+RERANK_POOL = int(os.getenv("RERANK_POOL", "50"))          # candidates fetched per source
+RERANK_TOP_N = int(os.getenv("RERANK_TOP_N", "10"))        # ranked results shown
+RERANK_EMBEDDING_MODEL = os.getenv("RERANK_EMBEDDING_MODEL", "")   # e.g. sentence-transformers/all-MiniLM-L6-v2
+RERANK_EMBEDDING_WEIGHT = float(os.getenv("RERANK_EMBEDDING_WEIGHT", "0.4"))
+BM25_K1 = 1.2
+BM25_B = 0.75
+TITLE_WEIGHT = 3.0      # a title hit counts as this many abstract hits
+SYNONYM_WEIGHT = 0.5    # query terms that only appear as concept synonyms
+
+EDGE_PUNCTUATION = ".,;:!?()[]{}\"'“”‘’"
+SUFFIX_RE = re.compile(r"(?<=[a-z]{3})(?:ing|ed|(?<![isu])s)$")   # keeps virus, analysis, mass
+
+@functools.lru_cache(maxsize=65536)
+def stem(token):
+    """Crude suffix stripping so 'vaccines'/'vaccine' and 'infected'/'infect' match"""
+    if any(ch.isdigit() for ch in token):
+        return token
+    if token.endswith("ies") and len(token) > 4:
+        return token[:-3] + "y"
+    return SUFFIX_RE.sub("", token)
+
+def terms(text):
+    return [stem(t) for t in tokenize(text or "") if t not in STOPWORDS and len(t) > 1]
+
+def query_weights(refined):
+    """{term: weight} from a RefinedQuery (or plain text): labels and keywords at 1, synonyms lower"""
+    if isinstance(refined, str):
+        return {t: 1.0 for t in terms(refined)}
+    weights = {}
+    for label in refined.labels:
+        for term in terms(label):
+            weights[term] = 1.0
+    for _, _, alternatives in refined.concepts:
+        for alternative in alternatives:
+            for term in terms(alternative):
+                weights.setdefault(term, SYNONYM_WEIGHT)
+    return weights or {t: 1.0 for t in terms(refined.text)}
+
+@functools.lru_cache(maxsize=262144)
+def _word_term(word):
+    """Whitespace-split word -> stemmed term (punctuation stripped), cached across papers"""
+    return stem(word.strip(EDGE_PUNCTUATION))
+
+def bm25_scores(query, papers):
+    """BM25 score per paper over title + abstract; IDF from the candidate pool"""
+    weights = query_weights(query)
+    if not papers or not weights:
+        return np.zeros(len(papers))
+    vocab = {term: i for i, term in enumerate(weights)}
+    tf = np.zeros((len(papers), len(vocab)), dtype=np.float32)
+    lengths = np.zeros(len(papers), dtype=np.float32)
+    for row, paper in enumerate(papers):
+        for field, field_weight in (("title", TITLE_WEIGHT), ("summary", 1.0)):
+            # Counting whitespace-split words runs in C; only distinct words are looked at in Python
+            counts = Counter((paper.get(field) or "").lower().split())
+            lengths[row] += field_weight * sum(counts.values())
+            for word, count in counts.items():
+                column = vocab.get(_word_term(word))
+                if column is not None:
+                    tf[row, column] += field_weight * count
+    df = (tf > 0).sum(axis=0)
+    idf = np.log1p((len(papers) - df + 0.5) / (df + 0.5))
+    norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths / max(lengths.mean(), 1.0))
+    saturated = tf * (BM25_K1 + 1) / (tf + norm[:, None])
+    return saturated @ (idf * np.fromiter(weights.values(), dtype=np.float32))
+
+_model = None
+_model_lock = threading.Lock()
+_model_warned = False
+
+def _embedding_model():
+    """The optional sentence-transformers model, loaded once; None when not configured or installed"""
+    global _model, _model_warned
+    if not RERANK_EMBEDDING_MODEL:
+        return None
+    with _model_lock:
+        if _model is None and not _model_warned:
+            try:
+                from sentence_transformers import SentenceTransformer
+                _model = SentenceTransformer(RERANK_EMBEDDING_MODEL)
+            except Exception as e:
+                print(f"[WARN] Re-ranking embedding model unavailable ({e}); using BM25 only "
+                      "(pip install sentence-transformers)")
+                _model_warned = True
+        return _model
+
+def embedding_scores(query_text, papers):
+    """Cosine similarity of each paper to the query, or None without the embedding model"""
+    model = _embedding_model()
+    if model is None or not papers:
+        return None
+    texts = [f"{p.get('title', '')}. {p.get('summary', '')}" for p in papers]
+    vectors = model.encode([query_text] + texts, normalize_embeddings=True, convert_to_numpy=True)
+    return vectors[1:] @ vectors[0]
+
+def rerank(query, papers, top_n=RERANK_TOP_N):
+    """
+    Papers sorted by relevance to `query` (RefinedQuery or text), each annotated
+    with "relevance" (0-1, best = 1), cut to top_n (None keeps all).
+    """
+    if not papers:
+        return []
+    with span("rerank", source="local"):
+        scores = bm25_scores(query, papers)
+        if scores.max() > 0:
+            scores = scores / scores.max()
+        semantic = embedding_scores(query if isinstance(query, str) else query.display, papers)
+        if semantic is not None:
+            scores = (1 - RERANK_EMBEDDING_WEIGHT) * scores + RERANK_EMBEDDING_WEIGHT * np.clip(semantic, 0, 1)
+        order = np.argsort(-scores, kind="stable")[:top_n]
+    return [{**papers[i], "relevance": round(float(scores[i]), 3)} for i in order]
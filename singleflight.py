@@ -0,0 +1,210 @@
+"""
+Request coalescing ("single flight") for identical in-flight work.
+
+The first caller for a key runs the work; callers that arrive with the same
+key while it is running wait for that result instead of repeating the call,
+from threads (`do`) or from asyncio tasks (`do_async`, which awaits without
+blocking the loop). Errors are raised to every waiter. Nothing is cached: once
+the call finishes, the next request for the key runs again.
+
+The first caller runs the call in place, under its own deadline. Callers
+that join wait only until their own deadline passes (DeadlineExceeded) or
+their request is cancelled. If the first caller's budget cuts the call short
+while others are still waiting, the call is run again for them on a small
+shared pool, under a deadline that follows the longest budget among the
+waiters and is cancelled once they have all given up, so abandoned calls
+drain instead of piling up.
+
+Every request that was served by someone else's call increments the
+`singleflight_coalesced` counter, labelled with the group name.
+"""
+import os
+import copy
+import json
+import asyncio
+import hashlib
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from src.metrics import registry
+from src.deadline import Deadline, current, check, bind, deadline_scope, DeadlineExceeded
+
+# --- Configuration ---
+SINGLEFLIGHT_WORKERS = int(os.getenv("SINGLEFLIGHT_WORKERS", "16"))   # calls rerun for waiters at once
+SINGLEFLIGHT_POLL = 0.25   # how quickly a cancelled request stops waiting on a call
+
+# Calls whose first caller ran out of time, rerun for the callers still waiting
+_executor = ThreadPoolExecutor(max_workers=SINGLEFLIGHT_WORKERS, thread_name_prefix="singleflight")
+
+class _FlightDeadline(Deadline):
+    """Deadline of a rerun call: the longest budget among its waiters, cancelled once none is left"""
+
+    def __init__(self, name, waiters):
+        super().__init__(None, name)
+        self.cover(waiters)
+
+    def cover(self, waiters):
+        expiries = [w.expires if w is not None else None for w in waiters]
+        self.expires = None if None in expiries else max(expiries)
+
+class _Flight:
+    """One call in flight: its result, the deadlines of the callers waiting on it, and its own once rerun"""
+
+    def __init__(self):
+        self.future = Future()
+        self.waiters = []
+        self.deadline = None
+
+def canonical_key(*parts, **named):
+    """Stable identity for a request: order-insensitive for dict keys, hashed to a short string"""
+    text = json.dumps([parts, named], sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:32]
+
+class SingleFlight:
+    """
+    One group of coalesced calls (e.g. "arxiv_fetch"). Waiters receive a deep
+    copy of the leader's result so no session can mutate another's data.
+    """
+
+    def __init__(self, name, copy_result=True):
+        self.name = name
+        self.copy_result = copy_result
+        self.calls = {}    # key -> _Flight of the running call
+        self.lock = threading.Lock()
+
+    def _join(self, key, deadline):
+        """(flight, leader)"""
+        with self.lock:
+            flight = self.calls.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.calls[key] = _Flight()
+            else:
+                registry.inc("singleflight_coalesced", group=self.name)
+            flight.waiters.append(deadline)
+            if flight.deadline is not None:
+                flight.deadline.cover(flight.waiters)
+            return flight, leader
+
+    def _leave(self, flight, deadline):
+        with self.lock:
+            flight.waiters.remove(deadline)
+            if flight.deadline is not None and not flight.future.done():
+                if flight.waiters:
+                    flight.deadline.cover(flight.waiters)
+                else:
+                    flight.deadline.cancel("no one waiting")
+
+    def _finish(self, key, flight, result=None, error=None):
+        with self.lock:
+            if self.calls.get(key) is flight:
+                del self.calls[key]
+        if error is not None:
+            flight.future.set_exception(error)
+        else:
+            flight.future.set_result(result)
+
+    def _settle(self, key, flight, deadline, call, result=None, error=None):
+        """
+        Publishes the leader's result, unless its budget ran out before the
+        call succeeded while others still wait: then the call reruns for them.
+        """
+        with self.lock:
+            flight.waiters.remove(deadline)
+            rerun = (deadline is not None and deadline.done and (error is not None or not result)
+                     and bool(flight.waiters))
+            if rerun:
+                flight.deadline = _FlightDeadline(f"singleflight:{self.name}", flight.waiters)
+        if not rerun:
+            self._finish(key, flight, result, error)
+            return
+        registry.inc("singleflight_reruns", group=self.name)
+        with deadline_scope(deadline=flight.deadline):
+            _executor.submit(bind(self._rerun), key, flight, *call)
+
+    def _rerun(self, key, flight, fn, args, kwargs):
+        try:
+            # Skipped if every waiter gave up while it was queued
+            check()
+            result = fn(*args, **kwargs)
+            if asyncio.iscoroutine(result):
+                result = asyncio.run(result)
+        except BaseException as e:
+            self._finish(key, flight, error=e)
+            return
+        self._finish(key, flight, result)
+
+    def _shared(self, result):
+        return copy.deepcopy(result) if self.copy_result else result
+
+    def _gave_up(self):
+        return DeadlineExceeded(f"{self.name}: gave up waiting for the in-flight call")
+
+    def _wait(self, flight, deadline):
+        while True:
+            timeout = None
+            if deadline is not None:
+                # Wake up regularly so a cancelled request stops waiting too
+                left = deadline.remaining()
+                timeout = SINGLEFLIGHT_POLL if left is None else min(SINGLEFLIGHT_POLL, left)
+            try:
+                return flight.future.result(timeout=timeout)
+            except FutureTimeout:
+                if deadline.cancelled:
+                    deadline.check()
+                if deadline.expired:
+                    raise self._gave_up() from None
+
+    def do(self, key, fn, *args, **kwargs):
+        """fn(*args, **kwargs), or the result of an identical call already in flight"""
+        deadline = current()
+        flight, leader = self._join(key, deadline)
+        if leader:
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException as e:
+                self._settle(key, flight, deadline, (fn, args, kwargs), error=e)
+                raise
+            self._settle(key, flight, deadline, (fn, args, kwargs), result)
+            return result
+        try:
+            return self._shared(self._wait(flight, deadline))
+        finally:
+            self._leave(flight, deadline)
+
+    async def do_async(self, key, fn, *args, **kwargs):
+        """Async variant: fn may be a coroutine function; threads and tasks share the same flights"""
+        deadline = current()
+        flight, leader = self._join(key, deadline)
+        if leader:
+            try:
+                result = fn(*args, **kwargs)
+                if asyncio.iscoroutine(result):
+                    result = await result
+            except BaseException as e:
+                self._settle(key, flight, deadline, (fn, args, kwargs), error=e)
+                raise
+            self._settle(key, flight, deadline, (fn, args, kwargs), result)
+            return result
+        try:
+            # shield: timing out must not cancel the call for everyone else
+            result = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(flight.future)),
+                                            None if deadline is None else deadline.remaining())
+        except asyncio.TimeoutError:
+            raise self._gave_up() from None
+        finally:
+            self._leave(flight, deadline)
+        return self._shared(result)
+
+    def in_flight(self):
+        with self.lock:
+            return len(self.calls)
+
+_groups = {}
+_groups_lock = threading.Lock()
+
+def get_flight(name, copy_result=True):
+    """The process-wide SingleFlight for a group name"""
+    with _groups_lock:
+        if name not in _groups:
+            _groups[name] = SingleFlight(name, copy_result)
+        return _groups[name]
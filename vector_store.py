@@ -0,0 +1,518 @@
+"""
+Shared on-disk vector store for paper and chunk embeddings.
+
+Vectors are L2-normalized, quantized (int8 with a per-row float32 scale, or
+float16) and appended to fixed-size segment files under VECTOR_DIR that every
+process memory-maps read-only, so N worker processes share one page-cached
+copy instead of N in-RAM indexes. A SQLite table maps each row to its item
+id, chunk hash and metadata; the chunk hash is unique, so a chunk is embedded
+once no matter how often it is indexed.
+
+Search is cosine similarity by batched NumPy dot products over the segments,
+block by block. For large corpora `build_ivf` clusters the rows (spherical
+k-means) and search then scans only the nprobe closest lists, plus any rows
+appended since the IVF was built.
+
+Writers serialize on a SQLite write transaction, which also works across
+processes; bytes past the last committed row (an interrupted append) are
+overwritten by the next one. Readers only ever see committed rows.
+
+Usage:
+    python vector_store.py index --source corpus        # titles + abstracts from corpus_store
+    python vector_store.py index --source fulltext      # chunked BioC articles in FULLTEXT_JSON_DIR
+    python vector_store.py search "malaria vaccine efficacy in children" -k 5
+    python vector_store.py build-ivf --lists 1024
+    python vector_store.py stats
+"""
+import os
+import sys
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from src.metrics import registry, span
+
+# --- Configuration ---
+VECTOR_DIR = os.getenv("VECTOR_DIR", "./data/vectors")
+VECTOR_DTYPE = os.getenv("VECTOR_DTYPE", "int8")                  # int8 | float16
+VECTOR_SEGMENT_ROWS = int(os.getenv("VECTOR_SEGMENT_ROWS", "65536"))
+VECTOR_IVF_NPROBE = int(os.getenv("VECTOR_IVF_NPROBE", "16"))
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "azure/genailab-maas-text-embedding-3-large")
+EMBED_BATCH = int(os.getenv("EMBED_BATCH", "64"))                 # texts per embedding request
+EMBED_WORKERS = int(os.getenv("EMBED_WORKERS", "4"))
+CHUNK_CHARS = int(os.getenv("VECTOR_CHUNK_CHARS", "1500"))
+CHUNK_OVERLAP = 200
+SCAN_BLOCK_ROWS = 32768     # rows dequantized at a time during a scan
+SQL_BATCH = 500             # parameters per IN (...) lookup
+
+DTYPES = {"int8": np.int8, "float16": np.float16}
+
+def chunk_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:32]
+
+def chunk_text(text, size=CHUNK_CHARS, overlap=CHUNK_OVERLAP):
+    """Overlapping windows of about `size` characters, cut at whitespace"""
+    text = " ".join(text.split())
+    if len(text) <= size:
+        return [text] if text else []
+    chunks, start = [], 0
+    while start < len(text):
+        end = min(len(text), start + size)
+        if end < len(text):
+            cut = text.rfind(" ", start + size // 2, end)
+            end = cut if cut > 0 else end
+        chunks.append(text[start:end])
+        if end >= len(text):
+            break
+        start = max(end - overlap, start + 1)
+    return chunks
+
+def normalize(vectors):
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+def quantize(vectors, dtype):
+    """(stored rows, per-row scales or None) for normalized float32 vectors"""
+    if dtype == "float16":
+        return vectors.astype(np.float16), None
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    rows = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return rows, scales.astype(np.float32)
+
+def _atomic_json(path, data):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp, path)
+
+def _atomic_npy(path, array):
+    tmp = f"{path}.tmp.npy"
+    np.save(tmp, array)
+    os.replace(tmp, path)
+
+class VectorStore:
+    def __init__(self, path=VECTOR_DIR, dtype=VECTOR_DTYPE, segment_rows=VECTOR_SEGMENT_ROWS, model=EMBEDDING_MODEL):
+        if dtype not in DTYPES:
+            raise ValueError(f"VECTOR_DTYPE must be one of {sorted(DTYPES)}, not '{dtype}'")
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.meta_path = os.path.join(path, "meta.json")
+        self.meta = self._load_meta() or {"dtype": dtype, "segment_rows": segment_rows, "dim": None,
+                                          "model": model, "ivf": None}
+        if self.meta["model"] != model:
+            raise ValueError(f"Vector store at {path} holds '{self.meta['model']}' embeddings, not '{model}'")
+        self.dtype = self.meta["dtype"]
+        self.segment_rows = self.meta["segment_rows"]
+        self.conn = sqlite3.connect(os.path.join(path, "ids.db"), check_same_thread=False,
+                                    timeout=60, isolation_level=None)
+        self.lock = threading.Lock()
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS vectors (
+                row INTEGER PRIMARY KEY,
+                chunk_hash TEXT NOT NULL UNIQUE,
+                item_id TEXT NOT NULL,
+                meta TEXT
+            )""")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS vectors_item ON vectors (item_id)")
+        self._maps = {}    # segment -> (rows mapped, vectors memmap, scales memmap or None)
+        self._ivf = None
+
+    def _load_meta(self):
+        if not os.path.exists(self.meta_path):
+            return None
+        with open(self.meta_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _segment_path(self, segment, ext):
+        return os.path.join(self.path, f"seg-{segment:05d}.{ext}")
+
+    @property
+    def dim(self):
+        return self.meta["dim"]
+
+    # --- ID map ---
+    def count(self):
+        """Committed rows; anything beyond this in the segment files is ignored"""
+        with self.lock:
+            return self.conn.execute("SELECT COALESCE(MAX(row) + 1, 0) FROM vectors").fetchone()[0]
+
+    def known(self, hashes):
+        """{chunk_hash: row} for the hashes already stored"""
+        found, hashes = {}, list(hashes)
+        with self.lock:
+            for i in range(0, len(hashes), SQL_BATCH):
+                part = hashes[i:i + SQL_BATCH]
+                found.update(self.conn.execute(
+                    f"SELECT chunk_hash, row FROM vectors WHERE chunk_hash IN ({', '.join('?' * len(part))})", part))
+        return found
+
+    def rows_info(self, rows):
+        """{row: (item_id, chunk_hash, meta dict)}"""
+        info, rows = {}, [int(r) for r in rows]
+        with self.lock:
+            for i in range(0, len(rows), SQL_BATCH):
+                part = rows[i:i + SQL_BATCH]
+                for row, item_id, hash_, meta in self.conn.execute(
+                        f"SELECT row, item_id, chunk_hash, meta FROM vectors WHERE row IN ({', '.join('?' * len(part))})",
+                        part):
+                    info[row] = (item_id, hash_, json.loads(meta) if meta else {})
+        return info
+
+    # --- Writes ---
+    def add(self, hashes, item_ids, vectors, metas=None):
+        """
+        Appends vectors whose chunk hash is not stored yet; returns how many
+        were added. vectors is (n, dim) float; they are normalized and quantized here.
+        """
+        vectors = normalize(vectors)
+        metas = metas or [None] * len(hashes)
+        if self.dim is None:
+            self.meta["dim"] = int(vectors.shape[1])
+            _atomic_json(self.meta_path, self.meta)
+        elif vectors.shape[1] != self.dim:
+            raise ValueError(f"Expected {self.dim}-dimensional vectors, got {vectors.shape[1]}")
+
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")   # the write lock, across processes too
+            try:
+                existing = set()
+                for i in range(0, len(hashes), SQL_BATCH):
+                    part = list(hashes[i:i + SQL_BATCH])
+                    existing.update(h for (h,) in self.conn.execute(
+                        f"SELECT chunk_hash FROM vectors WHERE chunk_hash IN ({', '.join('?' * len(part))})", part))
+                keep = []
+                for i, h in enumerate(hashes):
+                    if h not in existing:
+                        existing.add(h)
+                        keep.append(i)
+                if not keep:
+                    self.conn.execute("COMMIT")
+                    return 0
+                start = self.conn.execute("SELECT COALESCE(MAX(row) + 1, 0) FROM vectors").fetchone()[0]
+                rows, scales = quantize(vectors[keep], self.dtype)
+                self._append(start, rows, scales)
+                self.conn.executemany(
+                    "INSERT INTO vectors (row, chunk_hash, item_id, meta) VALUES (?, ?, ?, ?)",
+                    [(start + n, hashes[i], str(item_ids[i]), json.dumps(metas[i]) if metas[i] else None)
+                     for n, i in enumerate(keep)])
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+        registry.inc("vector_rows_added", len(keep))
+        return len(keep)
+
+    def _append(self, start, rows, scales):
+        """Writes rows starting at global row `start`, splitting across segment files"""
+        written = 0
+        while written < len(rows):
+            segment, offset = divmod(start + written, self.segment_rows)
+            n = min(len(rows) - written, self.segment_rows - offset)
+            self._write_at(self._segment_path(segment, "vec"), offset * rows.itemsize * self.dim,
+                           rows[written:written + n])
+            if scales is not None:
+                self._write_at(self._segment_path(segment, "scale"), offset * 4, scales[written:written + n])
+            written += n
+
+    @staticmethod
+    def _write_at(path, position, array):
+        with open(path, "r+b" if os.path.exists(path) else "w+b") as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() > position:
+                f.truncate(position)   # bytes of an append that never committed
+            f.seek(position)
+            f.write(np.ascontiguousarray(array).tobytes())
+
+    # --- Reads ---
+    def _segment(self, segment, rows):
+        """(vectors, scales) memmaps covering the first `rows` rows of a segment"""
+        cached = self._maps.get(segment)
+        if cached is None or cached[0] < rows:
+            vectors = np.memmap(self._segment_path(segment, "vec"), dtype=DTYPES[self.dtype], mode="r",
+                                shape=(rows, self.dim))
+            scales = None
+            if self.dtype == "int8":
+                scales = np.memmap(self._segment_path(segment, "scale"), dtype=np.float32, mode="r", shape=(rows,))
+            cached = self._maps[segment] = (rows, vectors, scales)
+        return cached[1][:rows], (cached[2][:rows] if cached[2] is not None else None)
+
+    def _segments(self, total):
+        for segment in range((total + self.segment_rows - 1) // self.segment_rows):
+            yield segment, min(self.segment_rows, total - segment * self.segment_rows)
+
+    def vectors(self, rows):
+        """Dequantized float32 vectors for global row numbers (any order)"""
+        rows = np.asarray(rows, dtype=np.int64)
+        out = np.empty((len(rows), self.dim), dtype=np.float32)
+        total = self.count()
+        for segment, seg_rows in self._segments(total):
+            mask = (rows // self.segment_rows) == segment
+            if not mask.any():
+                continue
+            local = rows[mask] - segment * self.segment_rows
+            vectors, scales = self._segment(segment, seg_rows)
+            block = vectors[local].astype(np.float32)
+            out[mask] = block * scales[local][:, None] if scales is not None else block
+        return out
+
+    def _scan(self, queries, k, row_ranges):
+        """Exact top-k over [(start, stop), ...] global row ranges; (scores, rows) per query"""
+        best_scores = [np.empty(0, np.float32) for _ in range(len(queries))]
+        best_rows = [np.empty(0, np.int64) for _ in range(len(queries))]
+        for range_start, range_stop in row_ranges:
+            for segment, seg_rows in self._segments(range_stop):
+                seg_start = segment * self.segment_rows
+                lo, hi = max(range_start, seg_start), min(range_stop, seg_start + seg_rows)
+                if lo >= hi:
+                    continue
+                vectors, scales = self._segment(segment, seg_rows)
+                for block_lo in range(lo, hi, SCAN_BLOCK_ROWS):
+                    block_hi = min(hi, block_lo + SCAN_BLOCK_ROWS)
+                    local = slice(block_lo - seg_start, block_hi - seg_start)
+                    scores = vectors[local].astype(np.float32) @ queries.T      # (block, queries)
+                    if scales is not None:
+                        scores *= scales[local][:, None]
+                    self._merge(scores, np.arange(block_lo, block_hi), k, best_scores, best_rows)
+        return best_scores, best_rows
+
+    @staticmethod
+    def _merge(scores, rows, k, best_scores, best_rows):
+        if len(rows) > k:
+            top = np.argpartition(-scores, k - 1, axis=0)[:k]        # (k, queries)
+        else:
+            top = np.broadcast_to(np.arange(len(rows))[:, None], scores.shape)
+        for q in range(scores.shape[1]):
+            best_scores[q] = np.concatenate([best_scores[q], scores[top[:, q], q]])
+            best_rows[q] = np.concatenate([best_rows[q], rows[top[:, q]]])
+            if len(best_rows[q]) > k:
+                keep = np.argpartition(-best_scores[q], k - 1)[:k]
+                best_scores[q], best_rows[q] = best_scores[q][keep], best_rows[q][keep]
+
+    def search(self, queries, k=10, nprobe=VECTOR_IVF_NPROBE, exact=False):
+        """
+        Top-k hits per query vector: [[{row, item_id, chunk_hash, score, meta}, ...], ...],
+        best first. Uses the IVF index when one is built, unless exact=True.
+        """
+        total = self.count()
+        queries = normalize(queries)
+        if self.dim is None:
+            self.meta = self._load_meta() or self.meta   # first rows written by another process
+        if not total or self.dim is None:
+            return [[] for _ in queries]
+        with span("vector_search", source="local") as sp:
+            ivf = None if exact else self._load_ivf()
+            if ivf is None:
+                scores, rows = self._scan(queries, k, [(0, total)])
+            else:
+                sp.status = "ivf"
+                scores, rows = self._ivf_search(ivf, queries, k, nprobe, total)
+        info = self.rows_info(np.unique(np.concatenate(rows)) if rows else [])
+        results = []
+        for query_scores, query_rows in zip(scores, rows):
+            order = np.argsort(-query_scores)
+            hits = []
+            for i in order:
+                row = int(query_rows[i])
+                item_id, hash_, meta = info.get(row, (None, None, {}))
+                hits.append({"row": row, "item_id": item_id, "chunk_hash": hash_,
+                             "score": float(query_scores[i]), "meta": meta})
+            results.append(hits)
+        return results
+
+    # --- IVF ---
+    def build_ivf(self, lists=None, iterations=10, sample=None, seed=0):
+        """
+        Clusters every committed row into `lists` inverted lists (default
+        4*sqrt(rows)); rows appended later are scanned exhaustively until the next build.
+        """
+        total = self.count()
+        if not total:
+            return None
+        lists = max(1, min(lists or int(4 * np.sqrt(total)), total))
+        rng = np.random.default_rng(seed)
+        sample_rows = np.sort(rng.choice(total, size=min(total, sample or lists * 64), replace=False))
+        data = self.vectors(sample_rows)
+        centroids = data[rng.choice(len(data), size=lists, replace=False)]
+        with span("vector_build_ivf", source="local"):
+            for _ in range(iterations):
+                assign = np.argmax(data @ centroids.T, axis=1)
+                for c in range(lists):
+                    members = data[assign == c]
+                    centroids[c] = members.sum(axis=0) if len(members) else data[rng.integers(len(data))]
+                centroids = normalize(centroids)
+            assign = np.empty(total, dtype=np.int32)
+            for lo in range(0, total, SCAN_BLOCK_ROWS):
+                hi = min(total, lo + SCAN_BLOCK_ROWS)
+                assign[lo:hi] = np.argmax(self.vectors(np.arange(lo, hi)) @ centroids.T, axis=1)
+        order = np.argsort(assign, kind="stable").astype(np.int64)
+        offsets = np.searchsorted(assign[order], np.arange(lists + 1)).astype(np.int64)
+        _atomic_npy(os.path.join(self.path, "ivf_centroids.npy"), centroids)
+        _atomic_npy(os.path.join(self.path, "ivf_order.npy"), order)
+        _atomic_npy(os.path.join(self.path, "ivf_offsets.npy"), offsets)
+        self.meta["ivf"] = {"lists": lists, "rows": total, "built_at": time.time()}
+        _atomic_json(self.meta_path, self.meta)
+        self._ivf = None
+        return self.meta["ivf"]
+
+    def _load_ivf(self):
+        meta = (self._load_meta() or {}).get("ivf")
+        if not meta:
+            return None
+        if self._ivf is None or self._ivf[0] != meta:
+            load = lambda name: np.load(os.path.join(self.path, f"ivf_{name}.npy"), mmap_mode="r")
+            self._ivf = (meta, load("centroids"), load("order"), load("offsets"))
+        return self._ivf
+
+    def _ivf_search(self, ivf, queries, k, nprobe, total):
+        meta, centroids, order, offsets = ivf
+        nprobe = min(nprobe, meta["lists"])
+        probe = np.argpartition(-(queries @ np.asarray(centroids).T), nprobe - 1, axis=1)[:, :nprobe]
+        tail = np.arange(meta["rows"], total)   # appended since the build
+        best_scores, best_rows = [], []
+        for q, lists in enumerate(probe):
+            candidates = np.concatenate([order[offsets[c]:offsets[c + 1]] for c in lists] + [tail])
+            candidates.sort()
+            scores, rows = [np.empty(0, np.float32)], [np.empty(0, np.int64)]
+            if len(candidates):
+                self._merge((self.vectors(candidates) @ queries[q])[:, None], candidates, k, scores, rows)
+            best_scores.append(scores[0])
+            best_rows.append(rows[0])
+        return best_scores, best_rows
+
+    def stats(self):
+        total = self.count()
+        stored = sum(os.path.getsize(os.path.join(self.path, n)) for n in os.listdir(self.path)
+                     if n.startswith("seg-"))
+        return {"rows": total, "dim": self.dim, "dtype": self.dtype, "model": self.meta["model"],
+                "segments": len(list(self._segments(total))), "bytes": stored,
+                "ivf": (self._load_meta() or {}).get("ivf")}
+
+_default_store = None
+_default_lock = threading.Lock()
+
+def get_vector_store():
+    global _default_store
+    with _default_lock:
+        if _default_store is None:
+            _default_store = VectorStore()
+        return _default_store
+
+# --- Embedding ---
+def embed_texts(texts, model=EMBEDDING_MODEL, batch_size=EMBED_BATCH, workers=EMBED_WORKERS):
+    """(n, dim) float32 embeddings, batches sent in parallel; None if any batch failed"""
+    from src.llm_client import get_embeddings
+    batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(lambda batch: get_embeddings(batch, model), batches))
+    if any(r is None or len(r) != len(b) for r, b in zip(results, batches)):
+        return None
+    return np.asarray([v for r in results for v in r], dtype=np.float32)
+
+def index_chunks(items, store=None, embed=embed_texts):
+    """
+    Embeds and stores (item_id, text, meta) chunks; a chunk whose text is
+    already stored is not embedded again. Returns {"added", "reused", "failed"}.
+    """
+    store = store or get_vector_store()
+    unique = {}
+    for item_id, text, meta in items:
+        if text:
+            unique.setdefault(chunk_hash(text), (item_id, text, meta))
+    known = store.known(unique)
+    todo = [(h, *unique[h]) for h in unique if h not in known]
+    counts = {"added": 0, "reused": len(known), "failed": 0}
+    for i in range(0, len(todo), EMBED_BATCH * EMBED_WORKERS):
+        part = todo[i:i + EMBED_BATCH * EMBED_WORKERS]
+        with span("vector_embed", source="genai_lab"):
+            vectors = embed([text for _, _, text, _ in part])
+        if vectors is None:
+            counts["failed"] += len(part)
+            continue
+        counts["added"] += store.add([h for h, _, _, _ in part], [item for _, item, _, _ in part], vectors,
+                                     [meta for _, _, _, meta in part])
+    registry.inc("vector_chunks_reused", counts["reused"])
+    return counts
+
+def search_text(query, k=10, store=None, embed=embed_texts, **kwargs):
+    """Top-k stored chunks for a natural-language query"""
+    store = store or get_vector_store()
+    vectors = embed([query])
+    if vectors is None:
+        return []
+    return store.search(vectors, k, **kwargs)[0]
+
+def paper_chunks(paper_id, title, text, **meta):
+    """(item_id, text, meta) chunks of one paper; every chunk carries the title for context"""
+    return [(paper_id, f"{title}\n{chunk}", {"title": title, "chunk": i, **meta})
+            for i, chunk in enumerate(chunk_text(text))]
+
+def _corpus_items():
+    from src.corpus_store import get_default_store, PAPERS
+    table = get_default_store().scan(PAPERS, columns=["paper_key", "title", "abstract"])
+    if table is None:
+        return []
+    return [chunk for row in table.to_pylist()
+            for chunk in paper_chunks(row["paper_key"], row["title"] or "", row["abstract"] or "", source="corpus")]
+
+def _fulltext_items(json_dir):
+    from src.fulltext_index import extract_sections, normalize_pmcid
+    items = []
+    for name in sorted(os.listdir(json_dir)) if os.path.isdir(json_dir) else []:
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(json_dir, name), "r", encoding="utf-8") as f:
+                sections = extract_sections(json.load(f))
+        except (OSError, ValueError) as e:
+            print(f"[WARN] Skipping unreadable BioC file {name}: {e}")
+            continue
+        pmcid = normalize_pmcid(os.path.splitext(name)[0])
+        title = sections["title"].split("\n")[0]
+        for column, text in sections.items():
+            if column != "title":
+                items += paper_chunks(pmcid, title, text, source="fulltext", section=column)
+    return items
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Shared memory-mapped vector store for paper embeddings.")
+    parser.add_argument("--dir", default=VECTOR_DIR)
+    sub = parser.add_subparsers(dest="command", required=True)
+    index_cmd = sub.add_parser("index", help="Embed and store chunks not stored yet")
+    index_cmd.add_argument("--source", choices=["corpus", "fulltext"], default="corpus")
+    index_cmd.add_argument("--json-dir", default=os.getenv("FULLTEXT_JSON_DIR", "./data/json"))
+    search_cmd = sub.add_parser("search", help="Nearest chunks to a query")
+    search_cmd.add_argument("query")
+    search_cmd.add_argument("-k", type=int, default=10)
+    search_cmd.add_argument("--exact", action="store_true", help="Ignore the IVF index")
+    ivf_cmd = sub.add_parser("build-ivf", help="(Re)build the inverted-file index")
+    ivf_cmd.add_argument("--lists", type=int)
+    sub.add_parser("stats")
+    args = parser.parse_args(argv)
+
+    store = VectorStore(args.dir)
+    if args.command == "index":
+        items = _corpus_items() if args.source == "corpus" else _fulltext_items(args.json_dir)
+        counts = index_chunks(items, store)
+        print(f"[VECTORS] {len(items)} chunks: {counts['added']} embedded, {counts['reused']} already stored, "
+              f"{counts['failed']} failed")
+        return 1 if counts["failed"] else 0
+    if args.command == "search":
+        for hit in search_text(args.query, args.k, store, exact=args.exact):
+            print(f"{hit['score']:.3f}  {hit['item_id']}  {hit['meta'].get('title', '')[:80]}")
+        return 0
+    if args.command == "build-ivf":
+        print(f"[VECTORS] IVF built: {store.build_ivf(args.lists)}")
+        return 0
+    print(json.dumps(store.stats(), indent=2))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())